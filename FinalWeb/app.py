@@ -3,7 +3,7 @@ author       : 渐渐
 Date         : 2025-03-31 14:19:08
 LastEditTime : 2025-04-03 16:09:22
 '''
-from flask import Flask, render_template, request, redirect, url_for, jsonify 
+from flask import Flask, render_template, request, redirect, url_for, jsonify, Response, g, send_file, send_from_directory
 
 import warnings
 import time
@@ -11,12 +11,39 @@ import requests
 from dotenv import load_dotenv
 import os
 import json
+import base64
+import re
+import mimetypes
 from search.elastic import Esearch
+from search.metrics import REGISTRY, STAGE_LATENCY
+from jobs import JobManager
+from recommender import RecommendService
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 import subprocess
-import time
+import threading
 import shlex  # 处理命令拆分（Unix-like 系统需要）
 
+# 进程启动时间，用于统计冷启动到首个页面的耗时
+APP_START_TIME = time.perf_counter()
+
+
+def _drain_es_output(process, started_event):
+    """后台持续读取 Elasticsearch 子进程输出，检测启动成功标志
+    同时避免 stdout 管道写满导致子进程阻塞
+    """
+    for output in iter(process.stdout.readline, ''):
+        output = output.strip()
+        if not output:
+            continue
+        if not started_event.is_set():
+            print(output)
+            if "started" in output.lower():
+                print("✅ Elasticsearch 启动成功！")
+                started_event.set()
+    process.stdout.close()
+
+
 def start_elasticsearch():
     try:
         # 根据系统选择命令
@@ -26,22 +53,19 @@ def start_elasticsearch():
         process = subprocess.Popen(
             command,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
             shell=True,            # 依赖 shell 解析 PATH 环境变量
             text=True
         )
 
         print("正在启动 Elasticsearch...")
-        # 实时读取输出并检测启动成功标志
-        while True:
-            output = process.stdout.readline()
-            if output == '' and process.poll() is not None:
-                break
-            if output:
-                print(output.strip())
-                if "started" in output.lower():
-                    print("✅ Elasticsearch 启动成功！")
-                    break
+        # 在后台线程中读取输出，不阻塞 Web 服务启动
+        threading.Thread(
+            target=_drain_es_output,
+            args=(process, es_state.process_started),
+            name="es-output",
+            daemon=True
+        ).start()
         return process
 
     except FileNotFoundError:
@@ -52,6 +76,67 @@ def start_elasticsearch():
         print(f"启动失败: {str(e)}")
 
 
+class ServiceState:
+    """记录 Elasticsearch 的后台就绪状态"""
+
+    def __init__(self):
+        self.process_started = threading.Event()  # 子进程输出了 started
+        self.ready = threading.Event()            # 可连接且索引已就绪
+        self.error = None
+        self.ready_after = None                   # 进程启动后多少秒就绪
+        self.first_page_after = None              # 进程启动后多少秒返回首个页面
+        self._watcher = None
+        self._lock = threading.Lock()
+
+    def start_watcher(self, es_client, interval=1.0, timeout=300, check_interval=5.0):
+        """启动后台线程轮询 Elasticsearch，连接成功后检查/创建索引；
+        就绪后仍每隔 check_interval 秒探测一次，连接断开时撤销就绪状态
+        """
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = threading.Thread(
+                target=self._watch, args=(es_client, interval, timeout, check_interval),
+                name="es-readiness", daemon=True
+            )
+            self._watcher.start()
+
+    def _watch(self, es_client, interval, timeout, check_interval):
+        deadline = time.perf_counter() + timeout
+        while True:
+            if es_client.ping():
+                if not self.ready.is_set():
+                    try:
+                        es_client.create_index()
+                    except Exception as e:
+                        self.error = f"索引检查失败: {e}"
+                        print(self.error)
+                    else:
+                        self.error = None
+                        if self.ready_after is None:
+                            self.ready_after = round(time.perf_counter() - APP_START_TIME, 2)
+                            print(f"Elasticsearch 已就绪（启动后 {self.ready_after} 秒）")
+                        else:
+                            print("Elasticsearch 已恢复")
+                        self.ready.set()
+            elif self.ready.is_set():
+                # 就绪后连接断开：撤销就绪状态，恢复后重新检查索引
+                self.ready.clear()
+                self.error = "Elasticsearch 连接断开，重试中"
+                print(self.error)
+            elif self.error is None and time.perf_counter() > deadline:
+                # 超时后继续以较低频率重试，Elasticsearch 恢复后仍可自动就绪
+                self.error = f"等待 Elasticsearch 超时（{timeout} 秒），继续重试中"
+                print(self.error)
+            if self.ready.is_set():
+                time.sleep(check_interval)
+            else:
+                time.sleep(interval if self.error is None else interval * 5)
+
+    def is_ready(self):
+        return self.ready.is_set()
+
+
 app = Flask(__name__, template_folder='template', static_folder='static')
 
 # 忽略 Elasticsearch 警告
@@ -67,20 +152,135 @@ es = Esearch(host="http://localhost:9200",
 #     max_retries=10,
 #     retry_on_timeout=True
 # )
-es.create_index()  
+# 索引检查放到后台进行，Web 服务无需等待 Elasticsearch 启动（见 start_background_services）
+es_state = ServiceState()
+
+
+# 请求级指标
+HTTP_LATENCY = REGISTRY.histogram("http_request_seconds", "HTTP 请求总耗时（秒）")
+HTTP_REQUESTS = REGISTRY.counter("http_requests_total", "HTTP 请求数")
+LLM_TOKENS = REGISTRY.counter("llm_tokens_total", "大模型消耗的 token 数")
+
+
+def render(template_name, **context):
+    """渲染模板并记录渲染耗时"""
+    with STAGE_LATENCY.time(stage="template_render"):
+        return render_template(template_name, **context)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
+        HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
+
+@app.after_request
+def record_first_page(response):
+    """记录冷启动到首个页面返回的耗时"""
+    if es_state.first_page_after is None and response.mimetype == 'text/html':
+        es_state.first_page_after = round(time.perf_counter() - APP_START_TIME, 3)
+        print(f"冷启动到首个页面耗时 {es_state.first_page_after} 秒")
+    return response
+
+
+@app.route('/healthz')
+def healthz():
+    """存活检查：进程能响应即视为健康"""
+    return jsonify({
+        "status": "ok",
+        "uptime": round(time.perf_counter() - APP_START_TIME, 2)
+    })
+
+
+@app.route('/readyz')
+def readyz():
+    """就绪检查：Elasticsearch 可用且索引已就绪时返回 200，否则 503"""
+    body = {
+        "ready": es_state.is_ready(),
+        "elasticsearch": "ready" if es_state.is_ready() else ("starting" if es_state.ready_after is None else "unavailable"),
+        "ready_after": es_state.ready_after,
+        "first_page_after": es_state.first_page_after,
+    }
+    if es_state.error:
+        body["error"] = es_state.error
+    body["recommender"] = "ready" if recommender.is_ready() else "not_loaded"
+    return jsonify(body), (200 if es_state.is_ready() else 503)
+
+
+@app.route('/metrics')
+def metrics():
+    """以 Prometheus 文本格式导出进程内指标"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+# ---------- 带指纹的静态资源 ----------
+DIST_DIR = os.path.join(app.static_folder, "dist")
+ASSET_MAX_AGE = 365 * 24 * 3600  # 指纹文件内容不变，可缓存一年
+
+
+def load_asset_manifest():
+    """读取 build_static.py 生成的清单；未构建时返回空字典，回退到普通静态路径"""
+    path = os.path.join(DIST_DIR, "manifest.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+ASSET_MANIFEST = load_asset_manifest()
+
+
+@app.context_processor
+def inject_asset_url():
+    def asset_url(path):
+        hashed = ASSET_MANIFEST.get(path)
+        if hashed is None:
+            return url_for('static', filename=path)
+        return url_for('fingerprinted_asset', filename=hashed)
+    return {"asset_url": asset_url}
+
+
+@app.route('/assets/<path:filename>')
+def fingerprinted_asset(filename):
+    """按 Accept-Encoding 返回预压缩版本，并设置 immutable 长缓存"""
+    accept = request.headers.get('Accept-Encoding', '')
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    send_name, encoding = filename, None
+    for ext, name in ((".br", "br"), (".gz", "gzip")):
+        if name in accept and os.path.isfile(os.path.join(DIST_DIR, filename + ext)):
+            send_name, encoding = filename + ext, name
+            break
+    response = send_from_directory(DIST_DIR, send_name, mimetype=mimetype,
+                                   max_age=ASSET_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.cache_control.public = True
+    response.cache_control.max_age = ASSET_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
 
 @app.route('/')
 def home():
     """首页"""
-    return render_template('index.html')
+    return render('index.html')
 
 @app.route('/traditional-trace')
 def traditional_trace():
-    return render_template('TraditionalTrace.html')
+    return render('TraditionalTrace.html')
 
 @app.route('/llm-trace')
 def llm_trace():
-    return render_template('LLMTrace.html')
+    return render('LLMTrace.html')
 
 
 load_dotenv()
@@ -140,16 +340,19 @@ def deepseek_query():
         }
 
         # 调用 API（带超时和重试）
-        response = requests.post(
-            "https://api.deepseek.com/v1/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=(3.05, 60)
-        )
+        with STAGE_LATENCY.time(stage="llm_upstream"):
+            response = requests.post(
+                "https://api.deepseek.com/v1/chat/completions",
+                headers=headers,
+                json=payload,
+                timeout=(3.05, 60)
+            )
         response.raise_for_status()  # 自动处理 4XX/5XX 错误
         
         # 解析响应
         result = response.json()
+        for kind in ("prompt_tokens", "completion_tokens"):
+            LLM_TOKENS.inc(result.get('usage', {}).get(kind, 0), kind=kind)
         content = result['choices'][0]['message']['content']
 
         try:
@@ -200,18 +403,25 @@ def search_results():
             'results': results,
             'has_results': True
         })
+    elif not es_state.is_ready():
+        # Elasticsearch 尚未就绪时降级为提示信息
+        template_vars.update({
+            'has_results': False,
+            'no_results_message': "检索服务正在启动，请稍后重试"
+        })
     else:
         template_vars.update({
             'has_results': False,
             'no_results_message': f"No results found for '{query}'"
         })
     
-    return render_template('search-results.html', **template_vars)
+    return render('search-results.html', **template_vars)
 
 def perform_search(query):
     """执行Elasticsearch搜索"""
-    if not es.index_exists() :
-        print(f"索引 '{INDEX_NAME}' 未创建该索引")
+    # 就绪后索引必然存在，无需每次请求再检查一次
+    if not es_state.is_ready():
+        print("Elasticsearch 尚未就绪，跳过搜索")
         return None
     try:
         res = es.search_poetry(query)
@@ -221,8 +431,280 @@ def perform_search(query):
         return None
 
 
+# JSON 检索接口单页最大条数
+API_MAX_PAGE_SIZE = 50
+API_DEFAULT_PAGE_SIZE = 10
+
+
+def json_response(data, status=200):
+    """返回紧凑 JSON（不转义中文、无多余空白），减小传输体积"""
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return Response(body, status=status, mimetype='application/json')
+
+
+def encode_cursor(search_after):
+    """将 search_after 排序值编码为不透明游标"""
+    raw = json.dumps(search_after, ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    value = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    if not isinstance(value, list):
+        raise ValueError("cursor must decode to a list")
+    return value
+
+
+@app.route('/api/search', methods=['GET'])
+def api_search():
+    """JSON 检索接口，使用 search_after 游标分页
+    参数: q 查询文本, size 每页条数, cursor 上一页返回的 next_cursor,
+         fields 逗号分隔的返回字段
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return json_response({"error": "Missing 'q' parameter"}, 400)
+
+    try:
+        size = int(request.args.get('size', API_DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return json_response({"error": "'size' must be an integer"}, 400)
+    size = max(1, min(size, API_MAX_PAGE_SIZE))
+
+    search_after = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            search_after = decode_cursor(cursor)
+        except (ValueError, UnicodeDecodeError):
+            return json_response({"error": "Invalid 'cursor'"}, 400)
+
+    fields = None
+    if request.args.get('fields'):
+        fields = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+        unknown = [f for f in fields if f not in Esearch.SOURCE_FIELDS]
+        if unknown:
+            return json_response({"error": f"Unknown fields: {', '.join(unknown)}"}, 400)
+
+    if not es_state.is_ready():
+        return json_response({"error": "检索服务正在启动，请稍后重试"}, 503)
+
+    start_time = time.time()
+    try:
+        hits, next_after = es.search_poetry_page(query, size=size,
+                                                 search_after=search_after,
+                                                 fields=fields)
+    except Exception as e:
+        print(f"搜索出错: {e}")
+        return json_response({"error": f"搜索失败: {str(e)}"}, 502)
+
+    return json_response({
+        "query": query,
+        "results": [{
+            "id": hit['_id'],
+            "score": hit['_score'],
+            "source": hit.get('_source', {})
+        } for hit in hits],
+        "next_cursor": encode_cursor(next_after) if next_after else None,
+        "search_time": round(time.time() - start_time, 3)
+    })
+
+
+# ---------- 诗词成语推荐（向量检索） ----------
+RECOMMEND_MAX_TEXT = 20000                                        # 单次请求文本长度上限（字符）
+RECOMMEND_MAX_TOP_K = 20
+RECOMMEND_TIMEOUT = float(os.getenv("RECOMMEND_TIMEOUT", "10"))   # 单个请求的截止时间上限（秒）
+
+# 检索器在首个推荐请求时加载，整个进程共用；设置 RECOMMEND_PRELOAD=1 则服务进程启动后台服务时就开始加载
+RECOMMEND_PRELOAD = os.getenv("RECOMMEND_PRELOAD") == "1"
+recommender = RecommendService()
+
+
+@app.route('/api/recommend', methods=['POST'])
+def api_recommend():
+    """向量检索推荐: {"text": ..., "top_k": 5, "timeout": 10}
+    返回按文本块分组的推荐（Retriever.format_recommendations 的结构）
+    """
+    data = request.get_json(silent=True)
+    text = data.get("text") if isinstance(data, dict) else None
+    if not isinstance(text, str) or not text.strip():
+        return json_response({"error": "Missing 'text' string"}, 400)
+    if len(text) > RECOMMEND_MAX_TEXT:
+        return json_response({"error": f"'text' exceeds {RECOMMEND_MAX_TEXT} characters"}, 413)
+    try:
+        top_k = int(data.get("top_k", 5))
+        timeout = float(data.get("timeout", RECOMMEND_TIMEOUT))
+    except (TypeError, ValueError):
+        return json_response({"error": "'top_k' and 'timeout' must be numbers"}, 400)
+    top_k = max(1, min(top_k, RECOMMEND_MAX_TOP_K))
+    timeout = max(0.1, min(timeout, RECOMMEND_TIMEOUT))
+
+    start_time = time.time()
+    try:
+        with STAGE_LATENCY.time(stage="vector_retrieval"):
+            results = recommender.recommend(text, top_k=top_k, timeout=timeout)
+    except FutureTimeoutError:
+        if not recommender.is_ready():
+            return json_response({"error": "推荐模型正在加载，请稍后重试"}, 503)
+        return json_response({"error": f"推荐超时（{timeout} 秒）"}, 504)
+    except Exception as e:
+        print(f"推荐出错: {e}")
+        return json_response({"error": f"推荐失败: {str(e)}"}, 500)
+
+    return json_response({
+        "results": results,
+        "search_time": round(time.time() - start_time, 3)
+    })
+
+
+# ---------- 批量溯源任务 ----------
+JOBS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs_data")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))   # 单个任务并行处理的文档数
+JOB_MAX_DOCUMENTS = 10000                          # 单次提交的文档上限
+TRACE_MIN_SCORE = 10.0                             # 低于该得分的匹配视为噪声
+JOB_RECOMMEND_TIMEOUT = float(os.getenv("JOB_RECOMMEND_TIMEOUT", "120"))  # 任务中单篇文档的推荐截止时间（含首次加载模型）
+SENTENCE_PATTERN = re.compile(r'[^。！？；!?;\n]+')
+
+
+def split_sentences(text, min_len=4):
+    """按句末标点切分文本，返回 (start, end, sentence) 列表"""
+    spans = []
+    for m in SENTENCE_PATTERN.finditer(text):
+        sentence = m.group().strip()
+        if len(sentence) >= min_len:
+            spans.append((m.start(), m.end(), sentence))
+    return spans
+
+
+def trace_document(doc, size=3, min_score=TRACE_MIN_SCORE, recommend=False, top_k=5):
+    """对一篇文档逐句检索古诗出处，整篇文档的查询合并为一次 msearch
+
+    recommend=True 时再经向量检索推荐诗词成语（与 /api/recommend 相同的微批检索器），结果放在 recommendations
+    """
+    text = doc.get("text") or ""
+    spans = split_sentences(text)
+    hits_per_sentence = es.msearch_poetry([s for _, _, s in spans], size=size,
+                                          fields=["古诗名", "作者", "朝代"])
+    findings = []
+    for (start, end, sentence), hits in zip(spans, hits_per_sentence):
+        matches = [{
+            "title": hit['_source'].get("古诗名"),
+            "author": hit['_source'].get("作者"),
+            "dynasty": hit['_source'].get("朝代"),
+            "score": hit['_score']
+        } for hit in hits if hit['_score'] >= min_score]
+        if matches:
+            findings.append({"start": start, "end": end, "sentence": sentence,
+                             "matches": matches})
+    result = {
+        "id": doc.get("id") or doc.get("url"),
+        "title": doc.get("title"),
+        "findings": findings
+    }
+    if recommend:
+        result["recommendations"] = recommender.recommend(text, top_k=top_k, timeout=JOB_RECOMMEND_TIMEOUT) \
+            if text.strip() else []
+    return result
+
+
+job_manager = JobManager(JOBS_DIR, trace_document, max_workers=JOB_WORKERS,
+                         ready_event=es_state.ready)
+
+
+def start_background_services():
+    """启动 Elasticsearch 就绪检查、批量任务执行线程，以及按 RECOMMEND_PRELOAD 预加载检索器（可重复调用）
+
+    不在导入模块时启动：debug 模式下 Werkzeug 重载器的父进程与子进程都会导入本模块，
+    两边都恢复并执行同一批任务，会向同一个 results.jsonl 重复写入，预加载也会把模型与索引加载两遍。
+    因此只在实际处理请求的进程中启动：直接运行时由 __main__ 在重载器子进程中启动，其他部署方式在收到首个请求时启动
+    """
+    es_state.start_watcher(es)
+    job_manager.start()
+    if RECOMMEND_PRELOAD:
+        recommender.warm_up()  # 已在加载或已加载完成时直接返回
+
+
+@app.before_request
+def ensure_background_services():
+    start_background_services()
+
+
+def _job_or_404(job_id):
+    try:
+        return job_manager.get(job_id)
+    except ValueError:
+        return None
+
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """提交批量溯源任务: {"documents": [{"id": ..., "title": ..., "text": ...}, ...], "recommend": false, "top_k": 5}
+
+    recommend 为 true 时每篇文档在古诗出处之外再做向量检索推荐
+    """
+    data = request.get_json(silent=True)
+    documents = data.get("documents") if isinstance(data, dict) else None
+    if not isinstance(documents, list) or not documents:
+        return json_response({"error": "Missing 'documents' list"}, 400)
+    if len(documents) > JOB_MAX_DOCUMENTS:
+        return json_response({"error": f"At most {JOB_MAX_DOCUMENTS} documents per job"}, 413)
+    if not all(isinstance(d, dict) and isinstance(d.get("text"), str) for d in documents):
+        return json_response({"error": "Every document needs a 'text' string"}, 400)
+    params = {}
+    if data.get("recommend"):
+        try:
+            top_k = int(data.get("top_k", 5))
+        except (TypeError, ValueError):
+            return json_response({"error": "'top_k' must be a number"}, 400)
+        params = {"recommend": True, "top_k": max(1, min(top_k, RECOMMEND_MAX_TOP_K))}
+
+    job_id = job_manager.submit(documents, params)
+    return json_response({
+        "job_id": job_id,
+        "status_url": url_for('job_status', job_id=job_id),
+        "events_url": url_for('job_events', job_id=job_id),
+        "results_url": url_for('job_results', job_id=job_id)
+    }, 202)
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = _job_or_404(job_id)
+    if job is None:
+        return json_response({"error": "Job not found"}, 404)
+    return json_response(job)
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """以 Server-Sent Events 推送任务进度"""
+    if _job_or_404(job_id) is None:
+        return json_response({"error": "Job not found"}, 404)
+
+    def stream():
+        for job in job_manager.iter_progress(job_id):
+            yield f"data: {json.dumps(job, ensure_ascii=False)}\n\n"
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+
+@app.route('/api/jobs/<job_id>/results', methods=['GET'])
+def job_results(job_id):
+    """下载任务结果 JSONL（任务进行中也可下载已完成部分）"""
+    if _job_or_404(job_id) is None:
+        return json_response({"error": "Job not found"}, 404)
+    path = job_manager.results_path(job_id)
+    if not os.path.exists(path):
+        return Response("", mimetype='application/x-ndjson')
+    return send_file(path, mimetype='application/x-ndjson')
+
 
 if __name__ == '__main__':
     start_elasticsearch()
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        # 重载器子进程：提前启动，不必等首个请求；父进程只监视文件改动
+        start_background_services()
     app.run(debug=True, port=5000)
     # * Running on http://127.0.0.1:5000
\ No newline at end of file
@@ -0,0 +1,110 @@
+'''
+/api/recommend 并发压测：在本进程内启动多线程 Web 服务（或压测 --url 指定的已有服务），
+统计延迟 p50/p99、吞吐和状态码，并确认并发请求下检索器与模型只加载一次
+
+用法（在项目根目录运行）:
+    python FinalWeb/bench_recommend.py --requests 200 --concurrency 1 8 32
+'''
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPIDER_DIR = os.path.join(BASE_DIR, "web_spider", "web_spider")
+RECOMMEND_MAX_TEXT = 20000  # 与 app.RECOMMEND_MAX_TEXT 一致
+
+
+def load_texts(n):
+    """读取爬虫抓取的文章正文作为请求文本（文件中是逐个拼接的多行 JSON 对象）"""
+    decoder = json.JSONDecoder()
+    texts = []
+    for path in sorted(glob.glob(os.path.join(SPIDER_DIR, "*.jsonl"))):
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read()
+        pos = 0
+        while len(texts) < n:
+            while pos < len(content) and content[pos].isspace():
+                pos += 1
+            if pos >= len(content):
+                break
+            item, pos = decoder.raw_decode(content, pos)
+            if item.get("text"):
+                texts.append(item["text"][:RECOMMEND_MAX_TEXT])
+    return texts[:n]
+
+
+def start_local_server():
+    """在后台线程中启动 app（多线程 WSGI 服务），返回 (url, app 模块)"""
+    from werkzeug.serving import make_server
+    sys.path.insert(0, BASE_DIR)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as web
+    server = make_server("127.0.0.1", 0, web.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", web
+
+
+def run_round(url, texts, concurrency, top_k, timeout):
+    session_local = threading.local()
+
+    def call(text):
+        session = getattr(session_local, "session", None)
+        if session is None:
+            session = session_local.session = requests.Session()
+        start = time.perf_counter()
+        response = session.post(f"{url}/api/recommend",
+                                json={"text": text, "top_k": top_k, "timeout": timeout})
+        return time.perf_counter() - start, response.status_code
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        outcomes = list(pool.map(call, texts))
+        elapsed = time.perf_counter() - start
+    latencies = np.array([latency for latency, status in outcomes if status == 200]) * 1000
+    statuses = Counter(status for _, status in outcomes)
+    return latencies, statuses, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/api/recommend 并发压测")
+    parser.add_argument("--url", help="压测已运行的服务（默认在本进程内启动）")
+    parser.add_argument("--requests", type=int, default=200, help="每轮请求数")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=10.0, help="单个请求的截止时间（秒）")
+    args = parser.parse_args()
+
+    texts = load_texts(args.requests)
+    web = None
+    url = args.url
+    if url is None:
+        url, web = start_local_server()
+
+    # 冷启动：多个请求同时到达，检索器仍只应加载一次
+    latencies, statuses, elapsed = run_round(url, texts[:args.concurrency[-1]], args.concurrency[-1],
+                                             args.top_k, max(args.timeout, 120.0))
+    print(f"冷启动并发 {args.concurrency[-1]} 个请求：耗时 {elapsed:.2f} 秒，状态码 {dict(statuses)}")
+
+    print(f"{'并发数':>6} {'p50 (ms)':>10} {'p99 (ms)':>10} {'请求/秒':>8}  状态码")
+    for concurrency in args.concurrency:
+        latencies, statuses, elapsed = run_round(url, texts, concurrency, args.top_k, args.timeout)
+        p50, p99 = (np.percentile(latencies, 50), np.percentile(latencies, 99)) if len(latencies) else (0, 0)
+        print(f"{concurrency:>6} {p50:>10.1f} {p99:>10.1f} {len(texts) / elapsed:>8.1f}  {dict(statuses)}")
+
+    if web is not None:
+        stats = web.recommender.stats()
+        print(f"模型加载次数: {stats.get('model_loads')}，"
+              f"平均每个微批 {stats.get('batcher', {}).get('mean_batch_chunks', 0):.1f} 个文本块")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+'''
+静态资源构建：按内容哈希生成带指纹的文件名，并预压缩为 gzip / brotli
+输出到 static/dist/，同时生成 manifest.json 供模板中的 asset_url() 查找
+
+用法: python build_static.py
+'''
+import os
+import re
+import gzip
+import json
+import shutil
+import hashlib
+import posixpath
+
+try:
+    import brotli  # 可选依赖，未安装时只生成 gzip
+except ImportError:
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST_PATH = os.path.join(DIST_DIR, "manifest.json")
+
+HASH_LENGTH = 10
+# 只预压缩文本类/未压缩格式，woff/woff2/png/jpg 本身已压缩
+COMPRESSIBLE_EXTS = {".css", ".js", ".svg", ".ttf", ".eot", ".otf", ".ico", ".json", ".txt"}
+CSS_URL_PATTERN = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+def _fingerprint(rel_path, content):
+    digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+    root, ext = posixpath.splitext(rel_path)
+    return f"{root}.{digest}{ext}"
+
+
+def _rewrite_css_urls(css_rel_path, text, manifest):
+    """把 CSS 中引用的相对路径替换为指纹文件名，保留原有的 ?query 与 #片段"""
+    css_dir = posixpath.dirname(css_rel_path)
+
+    def replace(match):
+        quote, url = match.group(1), match.group(2)
+        if url.startswith(("data:", "http:", "https:", "//", "/")):
+            return match.group(0)
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        target = posixpath.normpath(posixpath.join(css_dir, path))
+        hashed = manifest.get(target)
+        if hashed is None:
+            return match.group(0)
+        return f"url({quote}{posixpath.relpath(hashed, css_dir)}{suffix}{quote})"
+
+    return CSS_URL_PATTERN.sub(replace, text)
+
+
+def _write_variants(dest_path, content):
+    """写入原文件及更小的 .gz / .br 预压缩版本"""
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    with open(dest_path, "wb") as f:
+        f.write(content)
+    if os.path.splitext(dest_path)[1].lower() not in COMPRESSIBLE_EXTS:
+        return
+    gz = gzip.compress(content, compresslevel=9, mtime=0)
+    if len(gz) < len(content):
+        with open(dest_path + ".gz", "wb") as f:
+            f.write(gz)
+    if brotli is not None:
+        br = brotli.compress(content, quality=11)
+        if len(br) < len(content):
+            with open(dest_path + ".br", "wb") as f:
+                f.write(br)
+
+
+def build():
+    if os.path.exists(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+
+    sources = []
+    for root, _, files in os.walk(STATIC_DIR):
+        for name in files:
+            abs_path = os.path.join(root, name)
+            sources.append(os.path.relpath(abs_path, STATIC_DIR).replace(os.sep, "/"))
+
+    # CSS 引用了字体和图片，需在其余资源确定指纹后再处理
+    sources.sort(key=lambda p: (p.endswith(".css"), p))
+    manifest = {}
+    raw_bytes = compressed_bytes = 0
+    for rel_path in sources:
+        with open(os.path.join(STATIC_DIR, rel_path), "rb") as f:
+            content = f.read()
+        if rel_path.endswith(".css"):
+            content = _rewrite_css_urls(rel_path, content.decode("utf-8"), manifest).encode("utf-8")
+        hashed = _fingerprint(rel_path, content)
+        manifest[rel_path] = hashed
+        dest_path = os.path.join(DIST_DIR, hashed)
+        _write_variants(dest_path, content)
+        raw_bytes += len(content)
+        best = min([dest_path] + [dest_path + ext for ext in (".br", ".gz") if os.path.exists(dest_path + ext)],
+                   key=os.path.getsize)
+        compressed_bytes += os.path.getsize(best)
+
+    with open(MANIFEST_PATH, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+    print(f"已生成 {len(manifest)} 个指纹资源 -> {DIST_DIR}")
+    print(f"原始大小 {raw_bytes / 1024:.1f} KB，预压缩后 {compressed_bytes / 1024:.1f} KB"
+          f"{'' if brotli else '（未安装 brotli，仅生成 gzip）'}")
+
+
+if __name__ == "__main__":
+    build()
@@ -0,0 +1,225 @@
+'''
+批量溯源任务：提交一批文档，由后台工作线程池处理，结果写入 JSONL 文件
+任务状态与结果均落盘，Web 进程重启后会自动恢复未完成的任务
+'''
+import os
+import json
+import time
+import uuid
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+
+
+def _atomic_write_json(path, data):
+    """先写临时文件再替换，避免进程中断留下半个 job.json"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class JobManager:
+    """批量任务管理器
+
+    每个任务一个目录：
+        job.json       任务状态（总数、已完成数、失败数等）
+        input.jsonl    提交的文档，一行一个
+        results.jsonl  处理结果，一行一个，带文档序号 index
+    """
+
+    def __init__(self, root_dir, process_fn, max_workers=4, ready_event=None):
+        self.root_dir = root_dir
+        self.process_fn = process_fn          # 单文档处理函数: (doc, **任务参数 params) -> dict
+        self.max_workers = max_workers        # 单个任务内的并行度
+        self.ready_event = ready_event        # 依赖服务就绪后才开始处理
+        self._queue = queue.Queue()
+        self._jobs = {}                       # job_id -> 状态字典（内存副本）
+        self._lock = threading.Lock()
+        self._runner = None
+        os.makedirs(root_dir, exist_ok=True)
+
+    # ---------- 对外接口 ----------
+    def start(self):
+        """恢复未完成任务并启动后台执行线程"""
+        with self._lock:
+            if self._runner is not None:
+                return
+            self._runner = threading.Thread(target=self._run, name="job-runner", daemon=True)
+        self._recover()
+        self._runner.start()
+
+    def submit(self, documents, params=None):
+        job_id = uuid.uuid4().hex
+        job_dir = self._job_dir(job_id)
+        os.makedirs(job_dir)
+        with open(os.path.join(job_dir, "input.jsonl"), "w", encoding="utf-8") as f:
+            for doc in documents:
+                f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+        job = {
+            "job_id": job_id,
+            "status": QUEUED,
+            "total": len(documents),
+            "done": 0,
+            "failed": 0,
+            "params": params or {},
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        self._save(job)
+        self._queue.put(job_id)
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        path = os.path.join(self._job_dir(job_id), "job.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def results_path(self, job_id):
+        return os.path.join(self._job_dir(job_id), "results.jsonl")
+
+    def iter_progress(self, job_id, interval=1.0):
+        """持续产出任务状态，直到任务结束（用于 SSE 推送）"""
+        last = None
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                return
+            snapshot = (job["status"], job["done"], job["failed"])
+            if snapshot != last:
+                last = snapshot
+                yield job
+            if job["status"] in (FINISHED, FAILED):
+                return
+            time.sleep(interval)
+
+    # ---------- 内部实现 ----------
+    def _job_dir(self, job_id):
+        # job_id 只允许十六进制，防止路径穿越
+        if not all(c in "0123456789abcdef" for c in job_id):
+            raise ValueError("invalid job id")
+        return os.path.join(self.root_dir, job_id)
+
+    def _save(self, job):
+        with self._lock:
+            self._jobs[job["job_id"]] = dict(job)
+        _atomic_write_json(os.path.join(self._job_dir(job["job_id"]), "job.json"), job)
+
+    def _recover(self):
+        """重启后把 queued/running 的任务重新放回队列"""
+        recovered = []
+        for name in os.listdir(self.root_dir):
+            path = os.path.join(self.root_dir, name, "job.json")
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    job = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                continue
+            if job.get("status") in (QUEUED, RUNNING):
+                recovered.append(job)
+        for job in sorted(recovered, key=lambda j: j["created_at"]):
+            job["status"] = QUEUED
+            self._save(job)
+            self._queue.put(job["job_id"])
+        if recovered:
+            print(f"恢复了 {len(recovered)} 个未完成的批量任务")
+
+    def _completed_indices(self, results_path):
+        """读取已写入的结果，返回已完成的文档序号；截掉崩溃时写了一半的最后一行"""
+        done, failed = set(), 0
+        if not os.path.exists(results_path):
+            return done, failed
+        with open(results_path, "rb+") as f:
+            valid_end = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                done.add(record["index"])
+                failed += 1 if "error" in record else 0
+                valid_end += len(line)
+            f.truncate(valid_end)
+        return done, failed
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                if self.ready_event is not None:
+                    self.ready_event.wait()
+                self._run_job(job_id)
+            except Exception as e:
+                job = self.get(job_id)
+                if job is not None:
+                    job.update(status=FAILED, error=str(e), finished_at=time.time())
+                    self._save(job)
+                print(f"批量任务 {job_id} 失败: {e}")
+
+    def _run_job(self, job_id):
+        job = self.get(job_id)
+        job_dir = self._job_dir(job_id)
+        results_path = self.results_path(job_id)
+        completed, failed = self._completed_indices(results_path)
+        job.update(status=RUNNING, done=len(completed), failed=failed)
+        job["started_at"] = job["started_at"] or time.time()
+        self._save(job)
+
+        def pending_docs():
+            with open(os.path.join(job_dir, "input.jsonl"), "r", encoding="utf-8") as f:
+                for index, line in enumerate(f):
+                    if index not in completed:
+                        yield index, json.loads(line)
+
+        last_saved = time.time()
+        with open(results_path, "a", encoding="utf-8") as out, \
+                ThreadPoolExecutor(max_workers=self.max_workers,
+                                   thread_name_prefix=f"job-{job_id[:8]}") as pool:
+            in_flight = {}
+            docs = pending_docs()
+            exhausted = False
+            while in_flight or not exhausted:
+                # 控制在途文档数，避免一次性把整个任务读入内存
+                while not exhausted and len(in_flight) < self.max_workers * 2:
+                    try:
+                        index, doc = next(docs)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    in_flight[pool.submit(self.process_fn, doc, **job["params"])] = (index, doc)
+                if not in_flight:
+                    break
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index, doc = in_flight.pop(future)
+                    try:
+                        record = {"index": index, **future.result()}
+                    except Exception as e:
+                        record = {"index": index, "error": str(e)}
+                        job["failed"] += 1
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    job["done"] += 1
+                out.flush()
+                if time.time() - last_saved >= 1.0:
+                    self._save(job)
+                    last_saved = time.time()
+
+        job.update(status=FINISHED, finished_at=time.time())
+        self._save(job)
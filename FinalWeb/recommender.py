@@ -0,0 +1,97 @@
+'''
+诗词成语推荐：进程内共享一个预热好的 rag_recommand 检索器
+
+检索器在首次请求时由专用线程加载（bge-large 只加载一次），
+编码与向量检索在 MicroBatcher 的后台线程中完成，并发请求会被合并成微批，
+Web 请求线程只负责等待结果，超过截止时间即返回
+'''
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+# rag_recommand 以目录内的 rag_config / src 为顶层模块组织
+RAG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rag_recommand")
+
+
+class RecommendService:
+    """推荐服务：懒加载检索器，按请求截止时间等待微批检索结果"""
+
+    def __init__(self, rag_dir=RAG_DIR, max_batch_size=None, max_wait_ms=None):
+        self.rag_dir = rag_dir
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-loader")
+        self._loading = None                  # Future -> (retriever, batcher)
+        self._lock = threading.Lock()
+
+    # ---------- 对外接口 ----------
+    def warm_up(self):
+        """在后台开始加载检索器，不等待完成"""
+        return self._load_future()
+
+    def is_ready(self):
+        future = self._loading
+        return future is not None and future.done() and future.exception() is None
+
+    def recommend(self, text, top_k=None, timeout=10.0):
+        """返回 format_recommendations 的结构化结果；超过 timeout 秒抛出 TimeoutError
+
+        截止时间覆盖加载检索器、排队等待微批和检索全过程
+        """
+        deadline = time.monotonic() + timeout
+        retriever, batcher = self._wait_loaded(timeout)
+        future = batcher.submit(text, top_k or self._config.TOP_K)
+        try:
+            recommendations = future.result(max(deadline - time.monotonic(), 0))
+        except TimeoutError:
+            future.cancel()  # 尚未进入微批的请求不再计算
+            raise
+        return retriever.format_recommendations(recommendations)
+
+    def stats(self):
+        if not self.is_ready():
+            return {"ready": False}
+        from src import model_registry
+        retriever, batcher = self._loading.result()
+        return {
+            "ready": True,
+            "model_loads": model_registry.load_count,
+            "batcher": batcher.stats(),
+            "cache": retriever.encoder.stats(),
+        }
+
+    # ---------- 内部实现 ----------
+    def _load_future(self):
+        with self._lock:
+            if self._loading is None:
+                self._loading = self._loader.submit(self._load)
+            return self._loading
+
+    def _wait_loaded(self, timeout):
+        future = self._load_future()
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            raise
+        except Exception:
+            # 加载失败时清除，下一个请求重新尝试
+            with self._lock:
+                if self._loading is future:
+                    self._loading = None
+            raise
+
+    def _load(self):
+        if self.rag_dir not in sys.path:
+            sys.path.insert(0, self.rag_dir)
+        import rag_config
+        os.makedirs(rag_config.LOG_DIR, exist_ok=True)  # src 下各模块导入时即创建日志文件
+        from src.retriever import Retriever
+        from src.rag_server import MicroBatcher
+        self._config = rag_config
+        start = time.perf_counter()
+        retriever = Retriever()
+        retriever.retrieve("预热")
+        print(f"推荐检索器加载耗时 {time.perf_counter() - start:.2f} 秒")
+        return retriever, MicroBatcher(retriever, self.max_batch_size, self.max_wait_ms)
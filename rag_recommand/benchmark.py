@@ -0,0 +1,834 @@
+"""RAG 系统性能基准测试
+
+用法（在 rag_recommand 目录下运行）:
+    python benchmark.py ann --index poetry --types flat ivf_flat ivf_pq hnsw
+    python benchmark.py compress --index poetry --modes float32 float16 int8 pq pca256+int8
+    python benchmark.py load --index poetry
+    python benchmark.py startup
+    python benchmark.py throughput --articles 200
+    python benchmark.py cache --articles 200
+    python benchmark.py build --index poetry --workers 0 1 4
+    python benchmark.py shards --index poetry --shards 1 2 4 8
+    python benchmark.py encoder --backends torch onnx onnx_int8
+    python benchmark.py serve --concurrency 1 8 32 --configs 1:0 16:2 64:5
+    python benchmark.py chunker --articles 1000 --units char token
+    python benchmark.py hybrid --queries 300
+    python benchmark.py dedup --queries 200
+    python benchmark.py corpus --lookups 200
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+import glob
+import argparse
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+
+import rag_config as config
+
+console = Console()
+
+SPIDER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "web_spider", "web_spider")
+
+INDEX_PATHS = {
+    "poetry": config.POETRY_INDEX_PATH,
+    "idiom": config.IDIOM_INDEX_PATH,
+}
+
+
+def load_base_vectors(index_name: str, max_vectors: int = None) -> np.ndarray:
+    """从已构建的精确索引中取出全部向量，作为各类索引的公共数据集"""
+    from src.vector_store import load_faiss_index, _innermost_index
+    wrapper = load_faiss_index(INDEX_PATHS[index_name])
+    index = _innermost_index(wrapper)  # 内层索引归外层所有，wrapper 须保持引用
+    total = index.ntotal if max_vectors is None else min(index.ntotal, max_vectors)
+    return index.reconstruct_n(0, total)
+
+
+def make_queries(base: np.ndarray, n_queries: int, noise: float, seed: int = 0) -> np.ndarray:
+    """从库中抽样向量并加入高斯噪声，模拟“相似但不相同”的查询"""
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(base), size=min(n_queries, len(base)), replace=False)
+    queries = base[picks] + rng.normal(scale=noise, size=(len(picks), base.shape[1])).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return np.ascontiguousarray(queries, dtype=np.float32)
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def latency_stats(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return float(np.percentile(latencies, 50)), float(np.percentile(latencies, 99))
+
+
+def bench_ann(args):
+    """各类 ANN 索引的召回率与延迟，以精确内积检索为基准"""
+    import faiss
+    from src.vector_store import create_faiss_index, apply_search_params
+
+    base = load_base_vectors(args.index, args.max_vectors)
+    queries = make_queries(base, args.queries, args.noise)
+    console.print(f"数据集 {len(base)} 条 x {base.shape[1]} 维，查询 {len(queries)} 条，k={args.k}")
+
+    exact = faiss.IndexFlatIP(base.shape[1])
+    exact.add(base)
+    _, truth = exact.search(queries, args.k)
+
+    rng = np.random.default_rng(0)
+    train = base[rng.choice(len(base), size=min(len(base), config.TRAIN_SAMPLE_SIZE), replace=False)]
+
+    table = Table(title=f"ANN 基准（{args.index}）")
+    for col in ["索引", "参数", f"recall@{args.k}", "p50 (ms)", "p99 (ms)", "QPS", "构建 (s)"]:
+        table.add_column(col)
+
+    for index_type in args.types:
+        t0 = time.perf_counter()
+        index = create_faiss_index(base.shape[1], index_type, train_vectors=train,
+                                   encoding="float32", pca_dim=None)
+        index.add(base)
+        build_time = time.perf_counter() - t0
+
+        if index_type.startswith("ivf"):
+            sweep = [("nprobe", n, {"nprobe": n}) for n in args.nprobe]
+        elif index_type == "hnsw":
+            sweep = [("efSearch", ef, {"ef_search": ef}) for ef in args.ef_search]
+        else:
+            sweep = [("-", "", {})]
+
+        for name, value, params in sweep:
+            apply_search_params(index, **params)
+            latencies, found = [], []
+            for q in queries:
+                t = time.perf_counter()
+                _, ids = index.search(q.reshape(1, -1), args.k)
+                latencies.append(time.perf_counter() - t)
+                found.append(ids[0])
+            p50, p99 = latency_stats(latencies)
+            table.add_row(index_type, f"{name}={value}" if value != "" else "-",
+                          f"{recall_at_k(np.array(found), truth):.4f}",
+                          f"{p50:.3f}", f"{p99:.3f}", f"{len(queries) / sum(latencies):.0f}",
+                          f"{build_time:.1f}")
+    console.print(table)
+
+
+def parse_mode(mode: str):
+    """解析压缩模式，如 "int8"、"pca256+float16" -> (encoding, pca_dim)"""
+    pca_dim = None
+    if mode.startswith("pca"):
+        pca_part, _, mode = mode.partition("+")
+        pca_dim = int(pca_part[3:])
+        mode = mode or "float32"
+    return mode, pca_dim
+
+
+def bench_compress(args):
+    """各存储精度/降维模式的内存、加载时间与召回损失，以 float32 精确检索为基准"""
+    import faiss
+    from src.vector_store import create_faiss_index
+
+    base = load_base_vectors(args.index, args.max_vectors)
+    queries = make_queries(base, args.queries, args.noise)
+    console.print(f"数据集 {len(base)} 条 x {base.shape[1]} 维，查询 {len(queries)} 条，k={args.k}")
+
+    exact = faiss.IndexFlatIP(base.shape[1])
+    exact.add(base)
+    _, truth = exact.search(queries, args.k)
+
+    rng = np.random.default_rng(0)
+    train = base[rng.choice(len(base), size=min(len(base), config.TRAIN_SAMPLE_SIZE), replace=False)]
+
+    table = Table(title=f"向量压缩基准（{args.index}）")
+    for col in ["模式", "内存 (MB)", "字节/向量", "加载 (ms)", f"recall@{args.k}", "召回损失", "p50 (ms)", "构建 (s)"]:
+        table.add_column(col)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for mode in args.modes:
+            encoding, pca_dim = parse_mode(mode)
+            t0 = time.perf_counter()
+            index = create_faiss_index(base.shape[1], "flat", train_vectors=train,
+                                       encoding=encoding, pca_dim=pca_dim)
+            index.add(base)
+            build_time = time.perf_counter() - t0
+
+            path = os.path.join(tmp_dir, f"{mode}.faiss")
+            faiss.write_index(index, path)
+            size = os.path.getsize(path)
+            load_times = []
+            for _ in range(3):
+                t = time.perf_counter()
+                faiss.read_index(path)
+                load_times.append(time.perf_counter() - t)
+
+            latencies, found = [], []
+            for q in queries:
+                t = time.perf_counter()
+                _, ids = index.search(q.reshape(1, -1), args.k)
+                latencies.append(time.perf_counter() - t)
+                found.append(ids[0])
+            recall = recall_at_k(np.array(found), truth)
+            p50, _ = latency_stats(latencies)
+            table.add_row(mode, f"{size / 2**20:.1f}", f"{size / len(base):.0f}",
+                          f"{min(load_times) * 1000:.1f}", f"{recall:.4f}", f"{1 - recall:.4f}",
+                          f"{p50:.3f}", f"{build_time:.1f}")
+    console.print(table)
+
+
+# 在独立子进程中加载索引，统计加载耗时、首次检索耗时与加载带来的内存增量
+LOAD_PROBE = """
+import json, pickle, time, sys
+import numpy as np
+import faiss
+from src.vector_store import load_faiss_index
+
+def rss():
+    return {k: int(v.split()[0]) for k, v in (l.split(":", 1) for l in open("/proc/self/status"))
+            if k in ("RssAnon", "RssFile")}
+
+mode, path = sys.argv[1], sys.argv[2]
+before = rss()
+t = time.perf_counter()
+if mode == "pickle":
+    with open(path + ".pkl", "rb") as f:
+        index = pickle.load(f)
+else:
+    index = load_faiss_index(path, mmap=(mode == "mmap"))
+load_time = time.perf_counter() - t
+q = np.random.default_rng(0).random((1, index.d), dtype=np.float32)
+t = time.perf_counter()
+index.search(q, 5)
+first_search = time.perf_counter() - t
+after = rss()
+print(json.dumps({"load": load_time, "first_search": first_search,
+                  **{k: after[k] - before[k] for k in after}}))
+"""
+
+
+def bench_load(args):
+    """冷启动加载对比：pickle / faiss 完整读取 / faiss 内存映射
+    注意：重复运行时文件可能已在页缓存中，真正的冷启动需先清空系统缓存
+    """
+    index_path = INDEX_PATHS[args.index]
+    table = Table(title=f"索引加载基准（{args.index}）")
+    for col in ["方式", "加载 (ms)", "首次检索 (ms)", "私有内存增量 (MB)", "文件映射增量 (MB)"]:
+        table.add_column(col)
+
+    variants = [("pickle", ".pkl"), ("read", ".faiss"), ("mmap", ".faiss")]
+    for mode, suffix in variants:
+        if not os.path.exists(index_path + suffix):
+            console.print(f"[yellow]跳过 {mode}：{index_path + suffix} 不存在[/yellow]")
+            continue
+        runs = []
+        for _ in range(args.repeat):
+            out = subprocess.run([sys.executable, "-c", LOAD_PROBE, mode, index_path],
+                                 capture_output=True, text=True, check=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__)))
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        best = min(runs, key=lambda r: r["load"])
+        table.add_row(mode, f"{best['load'] * 1000:.1f}", f"{best['first_search'] * 1000:.1f}",
+                      f"{best['RssAnon'] / 1024:.1f}", f"{best['RssFile'] / 1024:.1f}")
+    console.print(table)
+
+
+# 启动耗时探针：分别统计导入、加载索引、首次查询（含模型加载）的耗时和常驻内存
+STARTUP_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+
+def rss_mb():
+    for line in open("/proc/self/status"):
+        if line.startswith("VmRSS"):
+            return int(line.split()[1]) / 1024
+
+if sys.argv[1] == "legacy":
+    # 模拟改造前的路径：导入即加载 torch，检索器和向量库各加载一次模型，索引完整读入内存
+    import torch, faiss
+    from sentence_transformers import SentenceTransformer
+    import rag_config as config
+    from src.metadata_store import open_metadata
+    t_import = time.perf_counter()
+    models = [SentenceTransformer(config.MODEL_NAME, device=config.DEVICE) for _ in range(2)]
+    indexes = [(faiss.read_index(p + ".faiss"), open_metadata(p))
+               for p in (config.POETRY_INDEX_PATH, config.IDIOM_INDEX_PATH)]
+    t_ready = time.perf_counter()
+    vector = models[0].encode([sys.argv[2]], convert_to_numpy=True)
+    for index, _ in indexes:
+        index.search(vector, config.TOP_K)
+    load_count = 2
+else:
+    from src.retriever import Retriever
+    from src import model_registry
+    t_import = time.perf_counter()
+    retriever = Retriever()
+    t_ready = time.perf_counter()
+    retriever.retrieve(sys.argv[2])
+    load_count = model_registry.load_count
+t_query = time.perf_counter()
+print(json.dumps({"import": t_import - t0, "ready": t_ready - t_import, "first_query": t_query - t_ready,
+                  "total": t_query - t0, "rss": rss_mb(), "model_loads": load_count}))
+"""
+
+
+def bench_startup(args):
+    """首次查询耗时（time-to-first-query）与常驻内存：改造前路径 vs 共享模型+延迟导入"""
+    table = Table(title="启动基准")
+    for col in ["路径", "导入 (s)", "就绪 (s)", "首次查询 (s)", "总计 (s)", "RSS (MB)", "模型加载次数"]:
+        table.add_column(col)
+    for mode in ("legacy", "current"):
+        out = subprocess.run([sys.executable, "-c", STARTUP_PROBE, mode, args.text],
+                             capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        table.add_row(mode, f"{r['import']:.2f}", f"{r['ready']:.2f}", f"{r['first_query']:.2f}",
+                      f"{r['total']:.2f}", f"{r['rss']:.0f}", str(r["model_loads"]))
+    console.print(table)
+
+
+def load_articles(n_articles: int):
+    """读取爬虫抓取的文章正文（web_spider/*.jsonl）"""
+    from src.corpus import CorpusFile
+    articles = []
+    for path in sorted(glob.glob(os.path.join(SPIDER_DIR, "*.jsonl"))):
+        with CorpusFile(path) as corpus:
+            for _, _, item in corpus.iter_rows():
+                if item.get("text"):
+                    articles.append(item["text"])
+                    if len(articles) >= n_articles:
+                        return articles
+    return articles
+
+
+def bench_throughput(args):
+    """整篇文章推荐吞吐：逐块编码/检索 vs 整篇一次编码、nq=N 批量检索，并校验结果一致"""
+    from src.retriever import Retriever, TextChunker
+    articles = load_articles(args.articles)
+    retriever = Retriever()
+    retriever.retrieve("预热")
+    n_chunks = sum(len(TextChunker.split_text(text)) for text in articles)
+
+    def per_chunk(text):
+        # 改造前的路径：每个块单独编码、每个索引单独检索
+        results = []
+        for chunk in TextChunker.split_text(text):
+            chunk_results = retriever.retrieve_batch([chunk], args.k)[0]
+            if chunk_results:
+                results.append({"chunk": chunk, "recommendations": chunk_results})
+        return results
+
+    outputs, timings = {}, {}
+    for name, fn in (("逐块", per_chunk), ("批量", lambda text: retriever.recommend_for_text(text, args.k))):
+        start = time.perf_counter()
+        outputs[name] = [fn(text) for text in articles]
+        timings[name] = time.perf_counter() - start
+
+    # 逐项比较：id 与次序完全相同记为一致；分数在容差内相同、仅同分项次序不同记为并列换序
+    exact = ties = 0
+    for old, new in zip(outputs["逐块"], outputs["批量"]):
+        if len(old) != len(new) or any(o["chunk"] != n["chunk"] for o, n in zip(old, new)):
+            continue
+        pairs = [(a, b) for o, n in zip(old, new)
+                 for a, b in zip(o["recommendations"], n["recommendations"])]
+        if not all(abs(a["score"] - b["score"]) < 1e-4 for a, b in pairs):
+            continue
+        if all(a["id"] == b["id"] for a, b in pairs):
+            exact += 1
+        else:
+            ties += 1
+
+    table = Table(title=f"推荐吞吐（{len(articles)} 篇文章，{n_chunks} 个文本块）")
+    for col in ["路径", "耗时 (s)", "文章/秒", "文本块/秒"]:
+        table.add_column(col)
+    for name, elapsed in timings.items():
+        table.add_row(name, f"{elapsed:.2f}", f"{len(articles) / elapsed:.1f}", f"{n_chunks / elapsed:.1f}")
+    console.print(table)
+    console.print(f"结果完全一致 {exact} 篇，仅同分项次序不同 {ties} 篇，"
+                  f"不一致 {len(articles) - exact - ties} 篇（分数容差 1e-4）")
+
+
+def bench_cache(args):
+    """查询向量缓存：冷启动、内存命中、仅磁盘命中（模拟进程重启）三轮的耗时与命中率"""
+    from src.retriever import Retriever
+    from src import embedding_cache
+    from src.embedding_cache import EmbeddingCache
+    articles = load_articles(args.articles)
+    retriever = Retriever(persist_cache=True)  # 本基准测的就是磁盘层，查询向量需写入
+    retriever.model.encode(["预热"])
+
+    table = Table(title=f"查询向量缓存（{len(articles)} 篇文章）")
+    for col in ["轮次", "耗时 (s)", "文章/秒", "命中率", "内存命中", "磁盘命中", "未命中"]:
+        table.add_column(col)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for name, fresh in (("冷启动", True), ("内存缓存", False), ("磁盘缓存", True)):
+            if fresh:
+                # 新建缓存实例：内存层为空，磁盘层沿用同一目录
+                embedding_cache._caches[(retriever.model_name, config.ENCODER_BACKEND)] = EmbeddingCache(
+                    retriever.model_name, retriever.device, cache_dir=cache_dir)
+            cache = retriever.encoder
+            before = cache.stats()
+            start = time.perf_counter()
+            for text in articles:
+                retriever.recommend_for_text(text, args.k)
+            elapsed = time.perf_counter() - start
+            after = cache.stats()
+            delta = {key: after[key] - before[key] for key in ("requests", "memory_hits", "disk_hits", "misses")}
+            hit_rate = (delta["memory_hits"] + delta["disk_hits"]) / max(delta["requests"], 1)
+            table.add_row(name, f"{elapsed:.2f}", f"{len(articles) / elapsed:.1f}", f"{hit_rate:.1%}",
+                          str(delta["memory_hits"]), str(delta["disk_hits"]), str(delta["misses"]))
+    console.print(table)
+
+
+def bench_build(args):
+    """索引构建流水线：不同预处理进程数下的总耗时与各阶段吞吐/空闲时间（全量构建到临时目录）"""
+    from src.vector_store import VectorStore
+    data_path, process_chunk = {
+        "poetry": (config.POETRY_DATA_PATH, VectorStore._process_poetry_chunk),
+        "idiom": (config.IDIOM_DATA_PATH, VectorStore._process_idiom_chunk),
+    }[args.index]
+    store = VectorStore()
+    store.model.encode(["预热"])
+
+    table = Table(title=f"索引构建流水线（{args.index}）")
+    for col in ["预处理进程数", "总耗时 (s)", "阶段", "条数", "忙碌 (s)", "空闲 (s)", "条/秒"]:
+        table.add_column(col)
+    for workers in args.workers:
+        config.BUILD_WORKERS = workers
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            start = time.perf_counter()
+            store._build_index(data_path, os.path.join(tmp_dir, args.index), process_chunk, "构建", rebuild=True)
+            elapsed = time.perf_counter() - start
+        for i, s in enumerate(store.last_build_stats):
+            table.add_row(str(workers) if i == 0 else "", f"{elapsed:.1f}" if i == 0 else "", s["stage"],
+                          str(s["items"]), f"{s['busy']:.1f}", f"{s['idle']:.1f}", f"{s['throughput']:.0f}")
+    console.print(table)
+
+
+def bench_dedup(args):
+    """诗句去重：逐句建向量 vs 相同诗句共用一个向量（全量构建到临时目录），对比向量数、构建耗时、
+    索引/元数据大小，以及 top-k 结果中重复诗句占用的名额"""
+    import functools
+    import sqlite3
+    from src.vector_store import VectorStore
+    from src.metadata_store import metadata_path
+    store = VectorStore()
+    store.model.encode(["预热"])
+
+    table = Table(title=f"诗句去重（{config.POETRY_DATA_PATH}）")
+    for col in ["模式", "出处数", "向量数", "编码条数", "构建耗时 (s)", "索引 (MB)", "元数据 (MB)",
+                f"top-{args.k} 不同诗句数"]:
+        table.add_column(col)
+    dedup_setting = config.DEDUP_LINES
+    try:
+        for dedup in (False, True):
+            config.DEDUP_LINES = dedup
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                index_path = os.path.join(tmp_dir, "poetry")
+                process_chunk = functools.partial(VectorStore._process_poetry_chunk, dedup=dedup)
+                start = time.perf_counter()
+                store._build_index(config.POETRY_DATA_PATH, index_path, process_chunk, "构建", rebuild=True)
+                elapsed = time.perf_counter() - start
+                encoded = next(s["items"] for s in store.last_build_stats if s["stage"] == "编码")
+                conn = sqlite3.connect(metadata_path(index_path))
+                n_sources = conn.execute("SELECT COUNT(*) FROM line_sources").fetchone()[0]
+                conn.close()
+
+                # 以库中抽样的诗句为查询，统计 top-k 中有几句不同的诗句
+                index, metadata = store.load_index(index_path)
+                rng = np.random.default_rng(0)
+                texts = [text for _, text in metadata.iter_texts()]
+                queries = [texts[i] for i in rng.choice(len(texts), size=min(args.queries, len(texts)), replace=False)]
+                _, found = index.search(store._encode(queries), args.k)
+                items = dict(zip(np.unique(found).tolist(), metadata.get_many(np.unique(found).tolist())))
+                distinct = np.mean([len({items[i]["line"] for i in row if i >= 0 and items[i]}) for row in found])
+                table.add_row("去重" if dedup else "逐句", str(n_sources), str(index.ntotal), str(encoded),
+                              f"{elapsed:.1f}", f"{os.path.getsize(index_path + '.faiss') / 2 ** 20:.1f}",
+                              f"{os.path.getsize(metadata_path(index_path)) / 2 ** 20:.1f}", f"{distinct:.2f}")
+                del index, metadata
+    finally:
+        config.DEDUP_LINES = dedup_setting
+    console.print(table)
+
+
+def bench_shards(args):
+    """分片检索：把库向量按 id 哈希分到 1/2/4/8 个精确索引，并行检索并归并，对比延迟与召回"""
+    import faiss
+    from src.sharding import ShardedIndex
+    base = load_base_vectors(args.index, args.max_vectors)
+    queries = make_queries(base, args.queries, args.noise)
+    ids = np.arange(len(base), dtype=np.int64)
+
+    table = Table(title=f"分片检索（{len(base)} 条向量，{len(queries)} 条查询，k={args.k}）")
+    # 库中有完全相同的向量时同分项次序可能不同，召回率略低于 1 但分数一致
+    for col in ["分片数", f"召回率@{args.k}", "最大分数差", "单条 p50 (ms)", "单条 p99 (ms)", "批量 (条/秒)"]:
+        table.add_column(col)
+    truth = truth_scores = None
+    for num_shards in args.shards:
+        shards = []
+        for shard in range(num_shards):
+            index = faiss.IndexIDMap2(faiss.IndexFlatIP(base.shape[1]))
+            mask = ids % num_shards == shard
+            index.add_with_ids(base[mask], ids[mask])
+            shards.append(index)
+        sharded = ShardedIndex(shards, max_workers=num_shards)
+        if truth is None:
+            truth_scores, truth = sharded.search(queries, args.k)
+
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            sharded.search(query[None, :], args.k)
+            latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        scores, found = sharded.search(queries, args.k)
+        batch_time = time.perf_counter() - start
+        p50, p99 = latency_stats(latencies)
+        table.add_row(str(num_shards), f"{recall_at_k(found, truth):.4f}",
+                      f"{np.abs(scores - truth_scores).max():.1e}", f"{p50:.3f}", f"{p99:.3f}",
+                      f"{len(queries) / batch_time:.0f}")
+    console.print(table)
+
+
+def bench_encoder(args):
+    """编码后端对比：句子/秒，以及与 torch 向量的余弦一致性、检索分数与 top-k 排序一致性"""
+    from src.model_registry import get_model
+    from src.retriever import TextChunker
+    texts = [chunk for text in load_articles(args.articles) for chunk in TextChunker.split_text(text)]
+    texts = texts[:args.sentences]
+    queries = texts[:args.queries]
+
+    table = Table(title=f"编码后端（{len(texts)} 个文本块，batch={config.BATCH_SIZE}）")
+    for col in ["后端", "句子/秒", "与 torch 余弦 (min/mean)", "分数最大偏差", f"top-{args.k} 一致率"]:
+        table.add_column(col)
+    reference = None
+    for backend in args.backends:
+        model = get_model(backend=backend)
+        model.encode(texts[:config.BATCH_SIZE], batch_size=config.BATCH_SIZE)  # 预热
+        start = time.perf_counter()
+        vectors = model.encode(texts, batch_size=config.BATCH_SIZE, convert_to_numpy=True)
+        elapsed = time.perf_counter() - start
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        scores = vectors[:len(queries)] @ vectors.T
+        topk = np.argsort(-scores, axis=1)[:, :args.k]
+        if reference is None:
+            reference = (vectors, scores, topk)
+        ref_vectors, ref_scores, ref_topk = reference
+        cosine = (vectors * ref_vectors).sum(axis=1)
+        agreement = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(topk, ref_topk)])
+        table.add_row(backend, f"{len(texts) / elapsed:.1f}", f"{cosine.min():.4f} / {cosine.mean():.4f}",
+                      f"{np.abs(scores - ref_scores).max():.4f}", f"{agreement:.3f}")
+    console.print(table)
+    console.print("余弦一致性以第一个后端为基准")
+
+
+def bench_serve(args):
+    """常驻服务并发压测：不同微批配置（最大块数:最长等待 ms）下的请求延迟 p50/p99 与吞吐"""
+    from concurrent.futures import ThreadPoolExecutor
+    from src import embedding_cache
+    from src.embedding_cache import EmbeddingCache
+    from src.retriever import Retriever
+    from src.rag_client import RagClient
+    from src.rag_server import RagServer
+    articles = load_articles(args.articles)
+    retriever = Retriever()
+
+    table = Table(title=f"常驻服务压测（{len(articles)} 篇文章/轮，HTTP 长连接）")
+    for col in ["微批配置", "并发数", "p50 (ms)", "p99 (ms)", "请求/秒", "平均每批块数"]:
+        table.add_column(col)
+    for spec in args.configs:
+        max_batch, max_wait = spec.split(":")
+        for concurrency in args.concurrency:
+            # 关闭向量缓存，每轮都真实编码
+            embedding_cache._caches[(retriever.model_name, config.ENCODER_BACKEND)] = EmbeddingCache(
+                retriever.model_name, retriever.device, max_items=0, cache_dir=None)
+            server = RagServer("127.0.0.1", 0, retriever=retriever,
+                               max_batch_size=int(max_batch), max_wait_ms=float(max_wait)).start()
+            client = RagClient(server.url)
+
+            def timed(text):
+                start = time.perf_counter()
+                client.recommend(text, args.k)
+                return time.perf_counter() - start
+
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                start = time.perf_counter()
+                latencies = list(pool.map(timed, articles))
+                elapsed = time.perf_counter() - start
+            stats = server.batcher.stats()
+            server.shutdown()
+            p50, p99 = latency_stats(latencies)
+            table.add_row(spec, str(concurrency), f"{p50:.1f}", f"{p99:.1f}",
+                          f"{len(articles) / elapsed:.1f}", f"{stats['mean_batch_chunks']:.1f}")
+    console.print(table)
+    console.print("微批配置 1:0 即不合并请求，作为对照")
+
+
+def legacy_split_text(text, chunk_size=config.TEXT_CHUNK_SIZE, overlap=config.TEXT_CHUNK_OVERLAP):
+    """改造前的分块实现：每块对 9 个分隔符各做一次 rfind"""
+    if not text or len(text) <= chunk_size:
+        return [text] if text else []
+    overlap = max(0, min(overlap, chunk_size - 1))
+    chunks, start, iteration = [], 0, 0
+    while start < len(text) and iteration < len(text) * 2:
+        iteration += 1
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            punct_pos = max(text.rfind(p, start, end) for p in ['。', '！', '？', '；', '\n', '.', '!', '?', ';'])
+            if punct_pos != -1:
+                end = punct_pos + 1
+        if start >= len(text) or end <= start:
+            break
+        chunks.append(text[start:end])
+        if end >= len(text) - 1:
+            break
+        start = end - overlap
+        if start == end:
+            start += 1
+    return chunks
+
+
+def bench_chunker(args):
+    """文本分块：改造前逐块 rfind vs 一次查表扫描 + 二分，对比吞吐并校验与旧实现的输出一致"""
+    from src.retriever import TextChunker
+    articles = load_articles(args.articles)
+    n_chars = sum(len(text) for text in articles)
+    legacy = None
+
+    table = Table(title=f"文本分块（{len(articles)} 篇文章，{n_chars / 1e6:.1f}M 字符，"
+                        f"块大小 {config.TEXT_CHUNK_SIZE}，重叠 {config.TEXT_CHUNK_OVERLAP}）")
+    for col in ["实现", "耗时 (ms)", "文章/秒", "M 字符/秒", "块数", "与旧实现一致"]:
+        table.add_column(col)
+    runs = [("旧实现 (rfind)", legacy_split_text)]
+    for unit in args.units:
+        if unit == "token":
+            TextChunker.split_spans("预热", unit="token")  # 加载 tokenizer 不计入耗时
+        runs.append((f"单次扫描 ({unit})",
+                     lambda text, unit=unit: [c for _, _, c in TextChunker.split_spans(text, unit=unit)]))
+    for name, split in runs:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            outputs = [split(text) for text in articles]
+        elapsed = (time.perf_counter() - start) / args.repeat
+        if legacy is None:
+            legacy = outputs
+        same = sum(1 for old, new in zip(legacy, outputs) if old == new)
+        table.add_row(name, f"{elapsed * 1000:.1f}", f"{len(articles) / elapsed:.0f}",
+                      f"{n_chars / elapsed / 1e6:.2f}", str(sum(len(o) for o in outputs)),
+                      f"{same}/{len(articles)}")
+    console.print(table)
+
+
+def make_quote_queries(retriever, n_queries: int, seed: int = 0):
+    """从诗句库抽样构造带标注的查询：原句、嵌入文章上下文的引用、改动一字的引用"""
+    from src.retriever import TextChunker
+    rng = np.random.default_rng(seed)
+    lines = [text for _, text in retriever.poetry_metadata.iter_texts() if text and len(text) >= 5]
+    picks = rng.choice(len(lines), size=min(n_queries, len(lines)), replace=False)
+    contexts = [chunk for text in load_articles(200) for chunk in TextChunker.split_text(text)] or [""]
+    alphabet = sorted({ch for line in lines for ch in line})
+    kinds = {"原句": [], "文中引用": [], "改动一字": []}
+    for i, pick in enumerate(picks):
+        line = lines[pick]
+        context = contexts[i % len(contexts)]
+        cut = len(context) // 2
+        pos = int(rng.integers(len(line)))
+        changed = line[:pos] + alphabet[int(rng.integers(len(alphabet)))] + line[pos + 1:]
+        kinds["原句"].append((line, line))
+        kinds["文中引用"].append((context[:cut] + line + context[cut:], line))
+        kinds["改动一字"].append((context[:cut] + changed + context[cut:], line))
+    return kinds
+
+
+def bench_hybrid(args):
+    """混合检索：仅向量 / BM25+向量 RRF 融合 / 融合+可信词法命中跳过向量检索 的召回率与延迟"""
+    from src import embedding_cache
+    from src.embedding_cache import EmbeddingCache
+    from src.retriever import Retriever
+    retriever = Retriever()
+    kinds = make_quote_queries(retriever, args.queries)
+    for which in ("poetry", "idiom"):
+        retriever.lexical_index(which)
+    retriever.retrieve("预热")
+
+    modes = [("仅向量", "dense", False), ("混合 (RRF)", "hybrid", False), ("混合 + 词法短路", "hybrid", True)]
+    table = Table(title=f"混合检索（每类 {args.queries} 条查询，k={args.k}）")
+    for col in ["查询类型", "模式", f"召回率@{args.k}", "单条 p50 (ms)", "单条 p99 (ms)", "批量 (条/秒)", "短路比例"]:
+        table.add_column(col)
+    short_circuit = config.HYBRID_SHORT_CIRCUIT
+    try:
+        for kind, cases in kinds.items():
+            queries = [query for query, _ in cases]
+            for i, (name, mode, short) in enumerate(modes):
+                config.HYBRID_SHORT_CIRCUIT = short
+                # 关闭向量缓存，各模式都真实编码
+                embedding_cache._caches[(retriever.model_name, config.ENCODER_BACKEND)] = EmbeddingCache(
+                    retriever.model_name, retriever.device, max_items=0, cache_dir=None)
+                before = retriever.short_circuits
+                latencies = []
+                for query in queries:
+                    start = time.perf_counter()
+                    retriever.retrieve_batch([query], args.k, mode=mode)
+                    latencies.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                results = retriever.retrieve_batch(queries, args.k, mode=mode)
+                batch_time = time.perf_counter() - start
+                # 返回结果中有与目标诗句文字相同的句子即算命中（库中可能有重复诗句）
+                recall = np.mean([any(item.get("line") == target for item in items)
+                                  for items, (_, target) in zip(results, cases)])
+                skipped = (retriever.short_circuits - before) / (2 * len(queries))
+                p50, p99 = latency_stats(latencies)
+                table.add_row(kind if i == 0 else "", name, f"{recall:.3f}", f"{p50:.2f}", f"{p99:.2f}",
+                              f"{len(queries) / batch_time:.0f}", f"{skipped:.1%}" if mode == "hybrid" else "-")
+    finally:
+        config.HYBRID_SHORT_CIRCUIT = short_circuit
+    console.print(table)
+
+
+def bench_corpus(args):
+    """语料随机访问：顺序解析到目标文章（stream_json_data）vs 偏移索引 + mmap 只解析目标文章"""
+    import random
+    from src.corpus import CorpusFile, offsets_path
+    from src.data_processor import DataProcessor
+    table = Table(title=f"语料随机访问（每个文件 {args.lookups} 次按 url 查找）")
+    for col in ["文件", "篇数", "大小 (MB)", "建索引 (ms)", "打开 (ms)", "顺序查找 p50 (ms)",
+                "索引查找 p50 (ms)", "索引查找 p99 (ms)", "一致"]:
+        table.add_column(col)
+    for path in sorted(glob.glob(os.path.join(SPIDER_DIR, "*.jsonl"))):
+        if os.path.exists(offsets_path(path)):
+            os.remove(offsets_path(path))
+        start = time.perf_counter()
+        CorpusFile(path).close()
+        build_time = time.perf_counter() - start
+        start = time.perf_counter()
+        corpus = CorpusFile(path)
+        open_time = time.perf_counter() - start
+
+        rng = random.Random(0)
+        targets = [corpus.ids[rng.randrange(len(corpus))] for _ in range(args.lookups)]
+        indexed, found = [], []
+        for url in targets:
+            start = time.perf_counter()
+            found.append(corpus.get(url))
+            indexed.append(time.perf_counter() - start)
+        # 顺序解析代价高，只取前若干个目标
+        sequential, same = [], True
+        for url, record in zip(targets[:args.scan_lookups], found):
+            start = time.perf_counter()
+            item = next(item for item in DataProcessor.stream_json_data(path) if item.get("url") == url)
+            sequential.append(time.perf_counter() - start)
+            same &= item.get("text") == record.get("text")
+        corpus.close()
+        seq_p50, _ = latency_stats(sequential)
+        p50, p99 = latency_stats(indexed)
+        table.add_row(os.path.basename(path), str(len(corpus)), f"{os.path.getsize(path) / 2 ** 20:.1f}",
+                      f"{build_time * 1000:.1f}", f"{open_time * 1000:.2f}", f"{seq_p50:.2f}",
+                      f"{p50:.3f}", f"{p99:.3f}", "✓" if same else "✗")
+    console.print(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG 系统性能基准测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ann = subparsers.add_parser("ann", help="ANN 索引召回率/延迟对比")
+    ann.add_argument("--index", choices=list(INDEX_PATHS), default="poetry")
+    ann.add_argument("--types", nargs="+", default=["flat", "ivf_flat", "ivf_pq", "hnsw"])
+    ann.add_argument("--k", type=int, default=config.TOP_K)
+    ann.add_argument("--queries", type=int, default=1000)
+    ann.add_argument("--noise", type=float, default=0.02, help="查询向量的噪声强度")
+    ann.add_argument("--max-vectors", type=int, default=None)
+    ann.add_argument("--nprobe", type=int, nargs="+", default=[8, 16, 32, 64])
+    ann.add_argument("--ef-search", type=int, nargs="+", default=[32, 64, 128, 256])
+    ann.set_defaults(func=bench_ann)
+
+    compress = subparsers.add_parser("compress", help="向量存储精度/PCA 降维对比")
+    compress.add_argument("--index", choices=list(INDEX_PATHS), default="poetry")
+    compress.add_argument("--modes", nargs="+",
+                          default=["float32", "float16", "int8", "pq", "pca256+float32", "pca256+int8"],
+                          help="存储模式，可加 PCA 前缀，如 pca256+int8")
+    compress.add_argument("--k", type=int, default=config.TOP_K)
+    compress.add_argument("--queries", type=int, default=1000)
+    compress.add_argument("--noise", type=float, default=0.02)
+    compress.add_argument("--max-vectors", type=int, default=None)
+    compress.set_defaults(func=bench_compress)
+
+    load = subparsers.add_parser("load", help="索引冷启动加载对比（pickle / read / mmap）")
+    load.add_argument("--index", choices=list(INDEX_PATHS), default="poetry")
+    load.add_argument("--repeat", type=int, default=3)
+    load.set_defaults(func=bench_load)
+
+    startup = subparsers.add_parser("startup", help="首次查询耗时与内存（改造前 vs 当前）")
+    startup.add_argument("--text", default="春眠不觉晓，处处闻啼鸟")
+    startup.set_defaults(func=bench_startup)
+
+    throughput = subparsers.add_parser("throughput", help="整篇文章推荐吞吐（逐块 vs 批量）")
+    throughput.add_argument("--articles", type=int, default=200)
+    throughput.add_argument("--k", type=int, default=config.TOP_K)
+    throughput.set_defaults(func=bench_throughput)
+
+    cache = subparsers.add_parser("cache", help="查询向量缓存命中率与耗时")
+    cache.add_argument("--articles", type=int, default=200)
+    cache.add_argument("--k", type=int, default=config.TOP_K)
+    cache.set_defaults(func=bench_cache)
+
+    build = subparsers.add_parser("build", help="索引构建流水线吞吐（不同预处理进程数）")
+    build.add_argument("--index", choices=list(INDEX_PATHS), default="poetry")
+    build.add_argument("--workers", type=int, nargs="+", default=[0, config.BUILD_WORKERS])
+    build.set_defaults(func=bench_build)
+
+    dedup = subparsers.add_parser("dedup", help="诗句去重：向量数、构建耗时、索引大小与 top-k 中的重复")
+    dedup.add_argument("--queries", type=int, default=200)
+    dedup.add_argument("--k", type=int, default=config.TOP_K)
+    dedup.set_defaults(func=bench_dedup)
+
+    shards = subparsers.add_parser("shards", help="分片并行检索延迟（1/2/4/8 片）")
+    shards.add_argument("--index", choices=list(INDEX_PATHS), default="poetry")
+    shards.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    shards.add_argument("--k", type=int, default=config.TOP_K)
+    shards.add_argument("--queries", type=int, default=1000)
+    shards.add_argument("--noise", type=float, default=0.02)
+    shards.add_argument("--max-vectors", type=int, default=None)
+    shards.set_defaults(func=bench_shards)
+
+    encoder = subparsers.add_parser("encoder", help="编码后端吞吐与一致性（torch / onnx / onnx_int8）")
+    encoder.add_argument("--backends", nargs="+", default=["torch", "onnx", "onnx_int8"])
+    encoder.add_argument("--articles", type=int, default=200)
+    encoder.add_argument("--sentences", type=int, default=1000)
+    encoder.add_argument("--queries", type=int, default=100)
+    encoder.add_argument("--k", type=int, default=config.TOP_K)
+    encoder.set_defaults(func=bench_encoder)
+
+    serve = subparsers.add_parser("serve", help="常驻服务并发延迟/吞吐（不同微批配置）")
+    serve.add_argument("--articles", type=int, default=200)
+    serve.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    serve.add_argument("--configs", nargs="+", default=["1:0", "16:2", "64:5"])
+    serve.add_argument("--k", type=int, default=config.TOP_K)
+    serve.set_defaults(func=bench_serve)
+
+    chunker = subparsers.add_parser("chunker", help="文本分块吞吐（旧实现 vs 单次扫描）与输出一致性")
+    chunker.add_argument("--articles", type=int, default=1000)
+    chunker.add_argument("--units", nargs="+", default=["char"], choices=["char", "token"])
+    chunker.add_argument("--repeat", type=int, default=3)
+    chunker.set_defaults(func=bench_chunker)
+
+    hybrid = subparsers.add_parser("hybrid", help="混合检索（BM25 + 向量 RRF）召回率与延迟，对比仅向量检索")
+    hybrid.add_argument("--queries", type=int, default=300)
+    hybrid.add_argument("--k", type=int, default=config.TOP_K)
+    hybrid.set_defaults(func=bench_hybrid)
+
+    corpus = subparsers.add_parser("corpus", help="语料随机访问：顺序解析 vs 偏移索引 + mmap")
+    corpus.add_argument("--lookups", type=int, default=200)
+    corpus.add_argument("--scan-lookups", type=int, default=20, help="顺序解析查找的次数")
+    corpus.set_defaults(func=bench_corpus)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
 import os
 from pathlib import Path
-import torch
 # 项目根目录
 ROOT_DIR = Path(__file__).parent.absolute()
 
@@ -19,15 +18,93 @@ LOG_DIR = os.path.join(ROOT_DIR, "logs")
 
 # 模型配置
 MODEL_NAME = "BAAI/bge-large-zh-v1.5"
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# DEVICE 在首次访问时才检测（见文件末尾 __getattr__），避免导入配置就加载 torch
+# 编码后端: "torch"（sentence-transformers）| "onnx"（ONNX Runtime fp32）| "onnx_int8"（动态 int8 量化）
+ENCODER_BACKEND = "torch"
+ONNX_DIR = os.path.join(ROOT_DIR, "onnx")  # 导出的 ONNX 模型目录
+ONNX_THREADS = 0             # ONNX Runtime intra-op 线程数，0 表示使用全部 CPU 核
 BATCH_SIZE = 64
 CHUNK_SIZE = 5000  # 处理大文件时的块大小
+BUILD_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # 构建索引时预处理进程数，0 表示在解析线程内处理
+BUILD_QUEUE_SIZE = 4         # 构建流水线各阶段之间最多在途的数据块数
+
+# 向量索引配置
+# INDEX_TYPE 可选: "flat"（精确检索）| "ivf_flat" | "ivf_pq" | "hnsw"
+INDEX_TYPE = "flat"
+IVF_NLIST = 4096             # IVF 聚类中心数（训练样本不足时自动调小）
+IVF_NPROBE = 32              # 检索时探查的聚类数，越大召回越高、越慢
+PQ_M = 64                    # PQ 子向量数，需整除向量维度（bge-large 为 1024）
+PQ_NBITS = 8                 # 每个子向量的编码位数
+HNSW_M = 32                  # HNSW 每个节点的邻居数
+HNSW_EF_CONSTRUCTION = 200   # HNSW 构建时的候选队列长度
+HNSW_EF_SEARCH = 128         # HNSW 检索时的候选队列长度
+TRAIN_SAMPLE_SIZE = 100000   # IVF/PQ/SQ8/PCA 训练采样条数
+# 向量存储精度: "float32" | "float16" | "int8"（标量量化）| "pq"（乘积量化，使用 PQ_M/PQ_NBITS）
+# ivf_pq 索引本身即为 PQ 存储，忽略该项
+VECTOR_ENCODING = "float32"
+PCA_DIM = None               # 构建时拟合 PCA 降维的目标维度，None 表示不降维
+DEDUP_LINES = True           # 规范化后相同的诗句只存一个向量，元数据记录全部出处，检索结果附带 sources
+
+# 分片配置：NUM_SHARDS > 1 时每个索引拆成多个可单独重建的分片，检索时并行查询再归并
+NUM_SHARDS = 1
+SHARD_BY = "hash"            # "hash"（按 id 均匀分布）| "dynasty"（按朝代，成语按 hash）
+SHARD_SEARCH_WORKERS = 0     # 并行检索分片的线程数，0 表示每个分片一个线程
+
+# 查询向量缓存配置（键为模型名 + 文本哈希）
+EMBEDDING_CACHE_SIZE = 20000  # 内存 LRU 缓存条数（bge-large 每条约 4KB）
+EMBEDDING_CACHE_DIR = None    # 磁盘缓存目录（如 os.path.join(ROOT_DIR, "cache", "embeddings")），None 表示只用内存缓存
+EMBEDDING_CACHE_MAX_ROWS = 100000  # 磁盘缓存行数上限（bge-large 约 400MB），将超出时压缩为最近写入的 80%
+
+# 常驻服务配置（python rag_recommand.py --serve）
+SERVE_HOST = "127.0.0.1"
+SERVE_PORT = 8765
+SERVE_MAX_BATCH_SIZE = 64    # 一个微批最多合并的文本块数
+SERVE_MAX_WAIT_MS = 5        # 收到第一个请求后最多等待多久凑批（毫秒），0 表示只合并已排队的请求
+SERVE_REQUEST_TIMEOUT = 30   # 单个请求等待检索结果的上限（秒）
+
+# 语料批量扫描配置（python rag_recommand.py --scan）
+CORPUS_DIR = os.path.join(ROOT_DIR.parent, "web_spider", "web_spider")  # 爬虫输出的新闻 JSONL 目录
+CORPUS_INDEX_DIR = os.path.join(ROOT_DIR, "cache", "corpus")  # 语料偏移索引（文章 id/url → 字节范围），首次读取时建立
+SCAN_OUTPUT_PATH = os.path.join(ROOT_DIR, "scan", "scan_results.jsonl")
+SCAN_WORKERS = 2             # 扫描进程数，每个进程各自加载模型（索引为内存映射，各进程共享页缓存）；0 表示在主进程内扫描
+SCAN_BATCH_ARTICLES = 16     # 每次分发给工作进程的文章数，批内所有文本块一次批量检索
+SCAN_SKIP_DUPLICATES = True  # 近似重复的文章（转载、重复抓取）只扫描代表文章，其余只记录指向代表的链接
+
+# 文章近似重复检测（SimHash 指纹随语料偏移索引一起建立）
+SIMHASH_NGRAM = 3            # 指纹使用的字符 n-gram 长度
+SIMHASH_MIN_CHARS = 50       # 规范化后正文短于此长度的文章不计算指纹、不参与去重
+SIMHASH_BANDS = 4            # 64 位指纹切成的段数，须整除 64 且大于 SIMHASH_MAX_DISTANCE
+SIMHASH_MAX_DISTANCE = 3     # 汉明距离不超过此值视为近似重复
 
 # 检索配置
 TOP_K = 5  # 检索结果数量
 SCORE_THRESHOLD = 0.5  # 检索相似度阈值
+RETRIEVAL_MODE = "dense"     # "dense"（仅向量检索）| "hybrid"（字符 n-gram BM25 + 向量检索，RRF 融合）
+
+# 混合检索配置（词法索引在首次使用时由元数据构建，保存在 <索引>.lexical/）
+LEXICAL_NGRAM = 2            # 字符 n-gram 长度（1~3）
+BM25_K1 = 1.2
+BM25_B = 0.75
+LEXICAL_MIN_COVERAGE = 0.5   # 词法候选至少有这一比例的 n-gram 出现在查询中
+HYBRID_CANDIDATES = 20       # 每个索引的向量/词法结果各取多少条参与融合
+RRF_K = 60                   # RRF 融合常数：score = Σ 1 / (RRF_K + 名次)
+HYBRID_SHORT_CIRCUIT = True  # 词法命中足够可信时跳过该查询的向量编码与检索
+LEXICAL_CONFIDENCE = 1.0     # 可信命中的覆盖率（1.0 即整句 n-gram 全部出现在查询中）
+LEXICAL_CONFIDENT_MIN_CHARS = 4  # 可信命中的句子/成语至少这么长，避免过短文本偶然匹配
 
 # 文本分块配置
 # 分块参数调整
 TEXT_CHUNK_SIZE = 300       # 从150增加到300，避免过小块
-TEXT_CHUNK_OVERLAP = 30     # 从50减少到30，避免重叠过大
\ No newline at end of file
+TEXT_CHUNK_OVERLAP = 30     # 从50减少到30，避免重叠过大
+# 块大小/重叠的单位: "char"（字符数）| "token"（嵌入模型 tokenizer 的 token 数，块不超过模型输入长度）
+TEXT_CHUNK_UNIT = "char"
+
+
+def __getattr__(name):
+    """延迟计算的配置项"""
+    if name == "DEVICE":
+        import torch
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        globals()["DEVICE"] = device
+        return device
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -31,21 +31,69 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 console = Console()
 
-def build_indices():
-    """构建向量索引"""
+def build_indices(rebuild: bool = False, shards: List[int] = None):
+    """构建向量索引（默认增量更新，中断后再次运行从断点继续）"""
     console.print("[bold green]开始构建向量索引...[/bold green]")
     vector_store = VectorStore()
     
     # 构建诗词索引
     console.print("[bold]处理诗词数据...[/bold]")
-    vector_store.create_poetry_index()
+    vector_store.create_poetry_index(rebuild=rebuild, shards=shards)
     
     # 构建成语索引
     console.print("[bold]处理成语数据...[/bold]")
-    vector_store.create_idiom_index()
+    vector_store.create_idiom_index(rebuild=rebuild, shards=shards)
     
     console.print("[bold green]索引构建完成！[/bold green]")
 
+def migrate_indices():
+    """将旧版 pickle 索引转换为 faiss 原生格式"""
+    for index_path in (config.POETRY_INDEX_PATH, config.IDIOM_INDEX_PATH):
+        if VectorStore.migrate_legacy_index(index_path):
+            console.print(f"[green]已转换 {index_path}[/green]")
+        else:
+            console.print(f"[yellow]跳过 {index_path}（无旧版文件或已转换）[/yellow]")
+
+def export_encoder():
+    """导出 ONNX 模型及 int8 量化版本，供 ENCODER_BACKEND="onnx"/"onnx_int8" 使用"""
+    from src.onnx_encoder import export_onnx
+    out_dir = export_onnx(config.MODEL_NAME, quantize=True)
+    console.print(f"[green]ONNX 模型已导出到 {out_dir}[/green]")
+
+def serve(host: str = None, port: int = None):
+    """启动常驻检索服务：模型与索引只加载一次，并发请求合并成微批检索"""
+    from src.rag_server import RagServer
+    server = RagServer(host, port)
+    console.print(f"[bold green]RAG 服务已启动: {server.url}[/bold green]（Ctrl+C 退出）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        console.print("[yellow]服务已停止[/yellow]")
+
+def scan_corpus(paths: List[str] = None, output_path: str = None, workers: int = None, top_k: int = config.TOP_K,
+                sample: int = None, shard: List[int] = None, skip_duplicates: bool = None):
+    """多进程扫描爬虫语料，逐篇写入推荐结果；中断后以同一输出文件重新运行即可续扫"""
+    from src.corpus_scan import CorpusScanner
+    output_path = output_path or config.SCAN_OUTPUT_PATH
+    stats = CorpusScanner(output_path, workers=workers, top_k=top_k, skip_duplicates=skip_duplicates).run(
+        paths or None, sample=sample, shard=tuple(shard) if shard else None)
+
+    table = Table(title="语料扫描")
+    table.add_column("指标", style="cyan")
+    table.add_column("数值", style="green")
+    table.add_row("语料文件", str(stats["files"]))
+    table.add_row("工作进程", str(stats["workers"]))
+    table.add_row("本次扫描(篇)", str(stats["articles"]))
+    table.add_row("已完成跳过(篇)", str(stats["skipped"]))
+    table.add_row("近似重复(篇)", str(stats["duplicates"]))
+    table.add_row("失败(篇)", str(stats["failed"]))
+    table.add_row("文本块", str(stats["chunks"]))
+    table.add_row("耗时(秒)", f"{stats['seconds']:.1f}（含模型加载 {stats['warmup_seconds']:.1f}）")
+    table.add_row("吞吐(篇/秒)", f"{stats['articles_per_sec']:.2f}（加载后 {stats['steady_articles_per_sec']:.2f}）")
+    console.print(table)
+    console.print(f"[green]扫描结果已写入 {output_path}[/green]")
+    return stats
+
 def query_rag_system(query_text: str, top_k: int = config.TOP_K, output_file: str = None):
     """查询RAG系统"""
     output_file=r'red.txt'
@@ -53,6 +101,7 @@ def query_rag_system(query_text: str, top_k: int = config.TOP_K, output_file: st
     retriever = Retriever()
     recommendations = retriever.recommend_for_text(query_text, top_k=top_k)
     formatted_results = retriever.format_recommendations(recommendations)
+    retriever.encoder.log_stats()
     # with open(r'test_r.txt','r',encoding='utf8') as f:
     # 创建文件Console对象
     file_console = None
@@ -108,31 +157,70 @@ def query_rag_system(query_text: str, top_k: int = config.TOP_K, output_file: st
     
     return res_rec
 
-def evaluate_system(test_cases: List[Dict[str, Any]]):
-    """评估RAG系统"""
-    retriever = Retriever()
-    evaluator = Evaluator(retriever)
+def evaluate_system(test_cases: List[Dict[str, Any]], top_k: int = config.TOP_K, report_path: str = None,
+                    use_cache: bool = True, rounds: int = 1, cached_performance: bool = False):
+    """评估RAG系统：推荐质量（有标注时含 recall@k / MRR）与检索延迟、吞吐
+
+    use_cache 只作用于质量评估；性能测试默认使用不经缓存的检索器，cached_performance=True 时与质量评估共用
+    """
+    retriever = Retriever(use_cache=use_cache, persist_cache=True)  # 测试集反复评估，查询向量可写入磁盘缓存
+    evaluator = Evaluator(retriever, top_k=top_k, perf_retriever=retriever if cached_performance else None)
     
-    metrics = evaluator.evaluate_recommendations(test_cases)
+    report = evaluator.build_report(test_cases, rounds)
     
     console.print("[bold]评估结果:[/bold]")
-    for metric, value in metrics.items():
-        console.print(f"[cyan]{metric}:[/cyan] {value:.4f}")
+    for metric, value in {**report["quality"], **report["performance"]}.items():
+        console.print(f"[cyan]{metric}:[/cyan] {value:.4f}" if isinstance(value, float)
+                      else f"[cyan]{metric}:[/cyan] {value}")
+    cache_stats = report["cache"]
+    console.print(f"[cyan]向量缓存命中率:[/cyan] {cache_stats['hit_rate']:.2%}"
+                  f"（内存 {cache_stats['memory_hits']} / 磁盘 {cache_stats['disk_hits']} / 未命中 {cache_stats['misses']}）")
+    if report_path:
+        evaluator.write_report(report, report_path)
+        console.print(f"[green]评估报告已写入 {report_path}[/green]")
     
-    return metrics
+    return report
 
 def main():
     parser = argparse.ArgumentParser(description="古诗词成语RAG系统")
-    parser.add_argument("--build", action="store_true", help="构建向量索引")
+    parser.add_argument("--build", action="store_true", help="构建向量索引（只编码新增或变化的数据）")
+    parser.add_argument("--rebuild", action="store_true", help="全量重建向量索引")
+    parser.add_argument("--shard", type=int, nargs="+", help="只构建/重建指定编号的分片（NUM_SHARDS > 1 时）")
+    parser.add_argument("--migrate-index", action="store_true", help="将旧版 pickle 索引/.meta 元数据转换为 faiss 原生格式/SQLite")
+    parser.add_argument("--export-onnx", action="store_true", help="导出 ONNX / int8 量化编码模型")
+    parser.add_argument("--serve", action="store_true", help="启动常驻检索服务（HTTP，跨请求微批处理）")
+    parser.add_argument("--host", type=str, default=config.SERVE_HOST, help="服务监听地址")
+    parser.add_argument("--port", type=int, default=config.SERVE_PORT, help="服务监听端口")
     parser.add_argument("--query", type=str, help="查询文本")
     parser.add_argument("--evaluate", action="store_true", help="评估系统性能")
-    parser.add_argument("--test-file", type=str, help="测试文件路径")
+    parser.add_argument("--test-file", type=str,
+                        help='测试文件路径（JSON 列表：[{"text": ..., "relevant": ["期望推荐的诗句/成语", ...]}]，relevant 可省略）')
+    parser.add_argument("--report", type=str, help="评估报告（JSON）输出路径")
+    parser.add_argument("--no-cache", action="store_true", help="评估推荐质量时不使用查询向量缓存")
+    parser.add_argument("--cached-performance", action="store_true",
+                        help="性能测试也使用查询向量缓存（默认不使用，延迟与吞吐反映真实编码开销）")
+    parser.add_argument("--rounds", type=int, default=1, help="评估延迟时逐案例检索的轮数")
+    parser.add_argument("--scan", type=str, nargs="*",
+                        help="扫描爬虫语料（JSONL 文件或目录，省略时为 CORPUS_DIR），中断后重新运行从断点继续")
+    parser.add_argument("--output", type=str, help=f"扫描结果输出路径（默认 {config.SCAN_OUTPUT_PATH}）")
+    parser.add_argument("--workers", type=int, help=f"扫描进程数（默认 {config.SCAN_WORKERS}，0 表示在主进程内扫描）")
+    parser.add_argument("--sample", type=int, help="只扫描随机抽取的若干篇文章")
+    parser.add_argument("--scan-shard", type=int, nargs=2, metavar=("I", "N"),
+                        help="只扫描各语料文件按字节均分为 N 段后的第 I 段（从 0 开始），供多机/多次运行分担")
+    parser.add_argument("--keep-duplicates", action="store_true",
+                        help="扫描时不跳过近似重复的文章（默认每组只扫描代表文章）")
     parser.add_argument("--top-k", type=int, default=config.TOP_K, help="返回结果数量")
     
     args = parser.parse_args()
     
-    if args.build:
-        build_indices()
+    if args.build or args.rebuild:
+        build_indices(rebuild=args.rebuild, shards=args.shard)
+
+    if args.migrate_index:
+        migrate_indices()
+
+    if args.export_onnx:
+        export_encoder()
     
     if args.query:
         query_rag_system(args.query, top_k=args.top_k)
@@ -141,9 +229,19 @@ def main():
         if args.test_file:
             with open(args.test_file, 'r', encoding='utf-8') as f:
                 test_cases = json.load(f)
-            evaluate_system(test_cases)
+            evaluate_system(test_cases, top_k=args.top_k, report_path=args.report,
+                            use_cache=not args.no_cache, rounds=args.rounds,
+                            cached_performance=args.cached_performance)
         else:
             console.print("[bold red]评估需要提供测试文件路径 (--test-file)[/bold red]")
 
+    if args.scan is not None:
+        scan_corpus(args.scan, output_path=args.output, workers=args.workers, top_k=args.top_k,
+                    sample=args.sample, shard=args.scan_shard,
+                    skip_duplicates=False if args.keep_duplicates else None)
+
+    if args.serve:
+        serve(args.host, args.port)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,182 @@
+import os
+import mmap
+import glob
+import json
+import time
+import codecs
+import random
+import bisect
+import hashlib
+import logging
+from typing import List, Dict, Any, Iterator, Iterable, Tuple, Optional
+
+import rag_config as rag_config
+from src.near_dup import simhash
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler(os.path.join(rag_config.LOG_DIR, 'corpus.log')),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+READ_BLOCK = 1 << 20  # 每次读取的字节数
+
+
+def corpus_files(paths: List[str] = None) -> List[str]:
+    """展开语料路径：目录取其中的 *.jsonl，未指定时为爬虫输出目录"""
+    files = []
+    for path in paths or [rag_config.CORPUS_DIR]:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.jsonl"))))
+        else:
+            files.append(path)
+    return files
+
+
+def record_id(record: Dict[str, Any]) -> str:
+    """文章的标识：优先 id，爬虫数据为 url"""
+    return record.get("id") or record.get("url")
+
+
+def iter_records(path: str, start: int = 0) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+    """流式读取 JSONL 语料，逐条给出 (起始字节, 结束字节, 记录)
+
+    爬虫输出的文件是逐个拼接的多行 JSON 对象（每行一个对象的标准 JSONL 同样适用），
+    按块读入并增量解析，内存占用与文件大小无关；start 须为某条记录的起始位置
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    with open(path, "rb") as f:
+        f.seek(start)
+        buffer, pos, byte_pos, eof = "", 0, start, False
+        while True:
+            # 跳过记录之间的空白
+            skipped = pos
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            byte_pos += len(buffer[skipped:pos].encode("utf-8"))
+            record = None
+            if pos < len(buffer):
+                try:
+                    record, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise ValueError(f"{path} 第 {byte_pos} 字节处的记录无法解析")
+            elif eof:
+                return
+            if record is None:
+                # 缓冲区中的记录不完整，丢掉已解析的部分再读入一块
+                buffer, pos = buffer[pos:], 0
+                data = f.read(READ_BLOCK)
+                eof = not data
+                buffer += utf8.decode(data, final=eof)
+                continue
+            length = len(buffer[pos:end].encode("utf-8"))
+            yield byte_pos, byte_pos + length, record
+            byte_pos += length
+            pos = end
+
+
+def offsets_path(path: str) -> str:
+    """语料文件的偏移索引路径：CORPUS_INDEX_DIR 下按文件名 + 绝对路径摘要命名"""
+    path = os.path.abspath(path)
+    digest = hashlib.blake2b(path.encode("utf-8"), digest_size=6).hexdigest()
+    return os.path.join(rag_config.CORPUS_INDEX_DIR, f"{os.path.basename(path)}.{digest}.offsets.json")
+
+
+class CorpusFile:
+    """通过偏移索引随机访问语料文件
+
+    偏移索引记录每篇文章的标识、字节范围与正文的 SimHash 指纹，首次打开时顺序扫描一遍建立，
+    之后按文件大小、修改时间与指纹配置判断是否仍然有效并直接复用。文件以 mmap 映射，读取一篇文章只解析它自己的字节，
+    因此可以按标识 O(1) 查找、随机抽样，或按字节区间把文件分给多个进程
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        stat = os.stat(self.path)
+        self.size = stat.st_size
+        self.ids, self.starts, self.ends, self.fingerprints = self._load_or_build(
+            [stat.st_size, stat.st_mtime_ns], [rag_config.SIMHASH_NGRAM, rag_config.SIMHASH_MIN_CHARS])
+        self._rows = {}
+        for row, article_id in enumerate(self.ids):
+            self._rows.setdefault(article_id, row)  # 重复抓取的文章以第一次出现为准
+        self._file = open(self.path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+
+    def _load_or_build(self, signature: List[int], fingerprint_config: List[int]):
+        sidecar = offsets_path(self.path)
+        if os.path.exists(sidecar):
+            with open(sidecar, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["signature"] == signature and meta.get("fingerprint_config") == fingerprint_config:
+                return meta["ids"], meta["starts"], meta["ends"], meta["fingerprints"]
+            logger.info(f"{self.path} 或指纹配置已变化，重建偏移索引")
+
+        start = time.perf_counter()
+        ids, starts, ends, fingerprints = [], [], [], []
+        for record_start, record_end, record in iter_records(self.path):
+            ids.append(record_id(record))
+            starts.append(record_start)
+            ends.append(record_end)
+            fingerprints.append(simhash(record.get("text")))
+        os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+        tmp_path = f"{sidecar}.tmp{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"path": self.path, "signature": signature, "fingerprint_config": fingerprint_config,
+                       "ids": ids, "starts": starts, "ends": ends, "fingerprints": fingerprints}, f, ensure_ascii=False)
+        os.replace(tmp_path, sidecar)
+        logger.info(f"偏移索引 {sidecar} 构建完成：{len(ids)} 篇，耗时 {time.perf_counter() - start:.2f} 秒")
+        return ids, starts, ends, fingerprints
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __enter__(self) -> "CorpusFile":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def row_of(self, article_id: str) -> Optional[int]:
+        """文章标识（id/url）对应的序号，不存在时返回 None"""
+        return self._rows.get(article_id)
+
+    def read(self, row: int) -> Dict[str, Any]:
+        """解析第 row 篇文章（只读取它自己的字节）"""
+        return json.loads(self._mm[self.starts[row]:self.ends[row]])
+
+    def get(self, article_id: str) -> Optional[Dict[str, Any]]:
+        row = self.row_of(article_id)
+        return None if row is None else self.read(row)
+
+    def read_span(self, start: int, end: int) -> Dict[str, Any]:
+        """按字节范围解析文章（范围来自偏移索引或 iter_records）"""
+        return json.loads(self._mm[start:end])
+
+    def iter_rows(self, rows: Iterable[int] = None) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+        """按序号读取文章，给出与 iter_records 相同的 (起始字节, 结束字节, 记录)"""
+        for row in range(len(self)) if rows is None else rows:
+            yield self.starts[row], self.ends[row], self.read(row)
+
+    def sample(self, n: int, seed: int = 0) -> List[int]:
+        """随机抽取 n 篇文章的序号（升序，读取时顺序访问文件）"""
+        return sorted(random.Random(seed).sample(range(len(self)), min(n, len(self))))
+
+    def shard_rows(self, shard: int, num_shards: int) -> range:
+        """把文件按字节数均分为 num_shards 段，返回第 shard 段包含的文章序号（以文章起点归段）"""
+        if not 0 <= shard < num_shards:
+            raise ValueError(f"分段编号须在 0~{num_shards - 1} 之间: {shard}")
+        bounds = [bisect.bisect_left(self.starts, self.size * i // num_shards) for i in (shard, shard + 1)]
+        return range(bounds[0], bounds[1] if shard + 1 < num_shards else len(self))
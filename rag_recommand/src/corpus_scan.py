@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import random
+import logging
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from typing import List, Dict, Any, Iterator, Set, Tuple
+
+from tqdm import tqdm
+
+import rag_config as rag_config
+from src.corpus import CorpusFile, corpus_files
+from src.model_registry import spawn_pool
+from src.near_dup import find_duplicates
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler(os.path.join(rag_config.LOG_DIR, 'corpus_scan.log')),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+# 工作进程内常驻的检索器与已映射的语料文件
+_worker = {"corpora": {}}
+
+
+def _init_worker(settings: Dict[str, Any]) -> None:
+    """工作进程初始化：沿用主进程的配置（含运行时修改），加载并预热检索器"""
+    for name, value in settings.items():
+        setattr(rag_config, name, value)
+    os.makedirs(rag_config.LOG_DIR, exist_ok=True)
+    from src.retriever import Retriever
+    retriever = Retriever()
+    retriever.retrieve("预热")
+    _worker["retriever"] = retriever
+
+
+def _read_article(path: str, start: int, end: int) -> Dict[str, Any]:
+    """工作进程按字节范围从映射的语料文件中解析文章，主进程只分发偏移"""
+    corpora = _worker["corpora"]
+    if path not in corpora:
+        corpora[path] = CorpusFile(path)
+    return corpora[path].read_span(start, end)
+
+
+def scan_articles(articles: List[Tuple[str, int, int, str]], top_k: int) -> List[Dict[str, Any]]:
+    """在工作进程中处理一批文章 (文件, 起始字节, 结束字节, 标识)：所有文本块一次批量检索，返回每篇文章的结果记录"""
+    from src.retriever import TextChunker
+    from src.rag_server import summarize
+    retriever = _worker["retriever"]
+    records = [_read_article(path, start, end) for path, start, end, _ in articles]
+    spans = [TextChunker.split_spans(record.get("text") or "") for record in records]
+    results = retriever.retrieve_batch([chunk for article_spans in spans for _, _, chunk in article_spans], top_k)
+    outputs, offset = [], 0
+    for (path, start, end, article_id), record, article_spans in zip(articles, records, spans):
+        rows = results[offset:offset + len(article_spans)]
+        offset += len(article_spans)
+        recommendations = [{"chunk": chunk, "start": s, "end": e, "recommendations": recs}
+                           for (s, e, chunk), recs in zip(article_spans, rows) if recs]
+        formatted = retriever.format_recommendations(recommendations)
+        outputs.append({
+            "file": path,
+            "offset": start,            # 文章在语料文件中的字节范围 [offset, offset + length)
+            "length": end - start,
+            "id": article_id,
+            "title": record.get("title"),
+            "chunks": len(article_spans),
+            # 文本块在正文中的位置 text[start:end]，块文本可由位置还原，不再重复保存
+            "findings": [{"start": f["start"], "end": f["end"], "recommendations": f["recommendations"]}
+                         for f in formatted],
+            "summary": summarize(formatted),
+        })
+    return outputs
+
+
+class CorpusScanner:
+    """语料批量扫描：按偏移索引把文章分批分发给常驻检索器的工作进程，逐篇写入结果 JSONL
+
+    只向工作进程传递文章的字节范围，由工作进程从内存映射的文件中解析。
+    近似重复的文章（SimHash 指纹相近）只扫描每组的代表文章，其余写入 duplicate_of 指向代表的结果。
+    结果以 (文件, 字节偏移) 标识文章；再次运行同一输出文件时跳过已完成的文章，从中断处继续
+    """
+
+    def __init__(self, output_path: str, workers: int = None, batch_articles: int = None,
+                 top_k: int = rag_config.TOP_K, skip_duplicates: bool = None):
+        self.output_path = output_path
+        self.workers = rag_config.SCAN_WORKERS if workers is None else workers
+        self.batch_articles = batch_articles or rag_config.SCAN_BATCH_ARTICLES
+        self.top_k = top_k
+        self.skip_duplicates = rag_config.SCAN_SKIP_DUPLICATES if skip_duplicates is None else skip_duplicates
+
+    def completed(self) -> Set[Tuple[str, int]]:
+        """读取已写入的结果，返回已完成文章的 (文件, 字节偏移)；截掉中断时写了一半的最后一行
+
+        指向的代表文章没有成功结果的重复链接不算完成，重新处理
+        """
+        done, links = set(), {}
+        if not os.path.exists(self.output_path):
+            return done
+        with open(self.output_path, "rb+") as f:
+            valid_end = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                if "duplicate_of" in record:
+                    links[(record["file"], record["offset"])] = (record["duplicate_of"]["file"],
+                                                                 record["duplicate_of"]["offset"])
+                elif "error" not in record:  # 出错的文章下次重试
+                    done.add((record["file"], record["offset"]))
+                valid_end += len(line)
+            f.truncate(valid_end)
+        done.update(key for key, canonical in links.items() if canonical in done)
+        return done
+
+    @staticmethod
+    def _targets(corpora: List[CorpusFile], sample: int = None, shard: Tuple[int, int] = None,
+                 seed: int = 0) -> List[Tuple[CorpusFile, List[int]]]:
+        """待扫描的文章：各文件按字节区间取第 shard[0] 段（共 shard[1] 段），再在全部文件中随机抽取 sample 篇"""
+        targets = [(corpus, list(corpus.shard_rows(*shard)) if shard else list(range(len(corpus))))
+                   for corpus in corpora]
+        if sample is not None:
+            flat = [(i, row) for i, (_, rows) in enumerate(targets) for row in rows]
+            picked = sorted(random.Random(seed).sample(flat, min(sample, len(flat))))
+            targets = [(corpus, [row for j, row in picked if j == i]) for i, (corpus, _) in enumerate(targets)]
+        return targets
+
+    @staticmethod
+    def _duplicate_links(targets: List[Tuple[CorpusFile, List[int]]]) -> Dict[Tuple[int, int], Dict[str, Any]]:
+        """待扫描文章中的近似重复：{(文件序号, 文章序号): 结果记录}，按扫描顺序第一次出现的文章为代表"""
+        duplicates = find_duplicates(((i, row), corpus.fingerprints[row])
+                                     for i, (corpus, rows) in enumerate(targets) for row in rows)
+        links = {}
+        for (i, row), ((j, canonical_row), distance) in duplicates.items():
+            corpus, canonical = targets[i][0], targets[j][0]
+            links[(i, row)] = {
+                "file": corpus.path,
+                "offset": corpus.starts[row],
+                "length": corpus.ends[row] - corpus.starts[row],
+                "id": corpus.ids[row],
+                "title": corpus.read(row).get("title"),
+                # 推荐结果与代表文章相同，下游按 (file, offset) 取代表文章的结果
+                "duplicate_of": {"file": canonical.path, "offset": canonical.starts[canonical_row],
+                                 "id": canonical.ids[canonical_row]},
+                "distance": distance,
+            }
+        return links
+
+    def _batches(self, targets: List[Tuple[CorpusFile, List[int]]], done: Set[Tuple[str, int]],
+                 stats: Dict[str, int], links: Dict[Tuple[int, int], Dict[str, Any]]) -> Iterator[List]:
+        batch = []
+        for i, (corpus, rows) in enumerate(targets):
+            for row in rows:
+                start, end = corpus.starts[row], corpus.ends[row]
+                if (corpus.path, start) in done:
+                    stats["skipped"] += 1
+                    continue
+                if (i, row) in links:
+                    continue
+                batch.append((corpus.path, start, end, corpus.ids[row]))
+                if len(batch) >= self.batch_articles:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def run(self, paths: List[str] = None, sample: int = None, shard: Tuple[int, int] = None,
+            seed: int = 0) -> Dict[str, Any]:
+        """扫描语料，返回统计：篇数、跳过、失败、文本块数、耗时、篇/秒
+
+        sample 为随机抽取的篇数；shard=(i, n) 时只扫描各文件按字节均分的第 i 段，
+        便于多台机器或多次运行分担同一批语料
+        """
+        files = corpus_files(paths)
+        corpora = [CorpusFile(path) for path in files]  # 偏移索引不存在或已过期时在此建立
+        targets = self._targets(corpora, sample, shard, seed)
+        os.makedirs(os.path.dirname(os.path.abspath(self.output_path)), exist_ok=True)
+        done = self.completed()
+        stats = {"articles": 0, "skipped": 0, "failed": 0, "duplicates": 0, "chunks": 0}
+        settings = {name: value for name, value in vars(rag_config).items() if name.isupper()}
+
+        start_time = time.perf_counter()
+        pool = None
+        if self.workers > 0:
+            pool = spawn_pool(self.workers, initializer=_init_worker, initargs=(settings,))
+        else:
+            _init_worker(settings)
+        load_time = 0.0
+        progress = tqdm(desc="扫描语料", unit="篇")
+        try:
+            with open(self.output_path, "a", encoding="utf-8") as out:
+                links = self._duplicate_links(targets) if self.skip_duplicates else {}
+                # 重复文章不检索，只写指向代表文章的链接；链接在代表文章的结果写入之后才写，
+                # 代表文章失败或扫描中断时链接不会落盘，续扫时随代表文章一起重新处理
+                pending = {}
+                for record in links.values():
+                    if (record["file"], record["offset"]) in done:
+                        continue
+                    canonical = (record["duplicate_of"]["file"], record["duplicate_of"]["offset"])
+                    pending.setdefault(canonical, []).append(record)
+
+                def write_links(canonical):
+                    for link in pending.pop(canonical, []):
+                        out.write(json.dumps(link, ensure_ascii=False) + "\n")
+                        stats["duplicates"] += 1
+
+                for canonical in [key for key in pending if key in done]:
+                    write_links(canonical)
+                out.flush()
+                batches = self._batches(targets, done, stats, links)
+                in_flight = {}
+                exhausted = False
+                while in_flight or not exhausted:
+                    # 控制在途批数，避免把整个语料读入内存
+                    while not exhausted and len(in_flight) < max(self.workers, 1) * 2:
+                        batch = next(batches, None)
+                        if batch is None:
+                            exhausted = True
+                            break
+                        if pool is None:
+                            in_flight[_completed_future(scan_articles, batch, self.top_k)] = batch
+                        else:
+                            in_flight[pool.submit(scan_articles, batch, self.top_k)] = batch
+                    if not in_flight:
+                        break
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        batch = in_flight.pop(future)
+                        try:
+                            records = future.result()
+                        except Exception as e:
+                            logger.error(f"扫描失败（{len(batch)} 篇）: {e}")
+                            records = [{"file": path, "offset": start, "length": end - start,
+                                        "id": article_id, "error": str(e)}
+                                       for path, start, end, article_id in batch]
+                            stats["failed"] += len(batch)
+                        for record in records:
+                            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                            stats["chunks"] += record.get("chunks", 0)
+                            if "error" not in record:
+                                write_links((record["file"], record["offset"]))
+                        stats["articles"] += len(records)
+                        if not load_time:
+                            # 首批结果返回前的时间主要是各工作进程加载模型
+                            load_time = time.perf_counter() - start_time
+                        progress.update(len(records))
+                    out.flush()
+        finally:
+            progress.close()
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            for corpus in corpora:
+                corpus.close()
+
+        elapsed = time.perf_counter() - start_time
+        stats.update(files=len(files), workers=self.workers, seconds=elapsed, warmup_seconds=load_time,
+                     articles_per_sec=stats["articles"] / elapsed if elapsed else 0.0,
+                     steady_articles_per_sec=stats["articles"] / (elapsed - load_time)
+                     if elapsed > load_time else 0.0)
+        logger.info(f"扫描完成：{stats['articles']} 篇（跳过已完成 {stats['skipped']} 篇，近似重复 {stats['duplicates']} 篇，"
+                    f"失败 {stats['failed']} 篇），"
+                    f"耗时 {elapsed:.1f} 秒，{stats['articles_per_sec']:.1f} 篇/秒")
+        return stats
+
+
+def _completed_future(fn, *args):
+    """不使用进程池时在当前进程内执行，结果包装成已完成的 Future"""
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
@@ -1,6 +1,8 @@
 import json
 import os
+import hashlib
 import logging
+import unicodedata
 from typing import List, Dict, Any, Generator
 from tqdm import tqdm
 import re
@@ -25,14 +27,19 @@ class DataProcessor:
         """流式读取大型JSON文件"""
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
-                # 检查文件是否以[开头(列表)
-                first_char = f.read(1)
+                # 检查文件是否以[开头(列表)，忽略开头的空白
+                head = f.read(4096).lstrip()
+                first_char = head[:1]
                 f.seek(0)
                 
                 if first_char == '[':
                     # 如果是JSON数组，使用ijson流式解析
                     import ijson
                     yield from ijson.items(f, 'item')
+                elif head.split('\n', 1)[0].strip() == '{':
+                    # 多行格式化的对象首尾相接（如爬虫输出的 jsonl），按多值流解析
+                    import ijson
+                    yield from ijson.items(f, '', multiple_values=True)
                 else:
                     # 如果是每行一个JSON对象
                     for line in f:
@@ -47,8 +54,31 @@ class DataProcessor:
             raise
     
     @staticmethod
-    def process_poetry_data(data_item: Dict[str, Any]) -> Dict[str, Any]:
-        """处理诗词数据项"""
+    def content_id(data_item: Dict[str, Any]) -> str:
+        """由数据内容生成稳定的 id（与进程、运行次数无关，内容变化则 id 变化）"""
+        canonical = json.dumps(data_item, ensure_ascii=False, sort_keys=True, default=str)  # ijson 解析出的小数为 Decimal
+        return hashlib.blake2b(canonical.encode("utf-8"), digest_size=8).hexdigest()
+
+    @staticmethod
+    def vector_id(doc_id: str) -> int:
+        """将文档 id 映射为 FAISS 索引中的 63 位非负整数 id"""
+        digest = hashlib.blake2b(str(doc_id).encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") & 0x7FFFFFFFFFFFFFFF
+
+    @staticmethod
+    def item_vector_id(item: Dict[str, Any]) -> int:
+        """记录的向量 id：去重的诗句按规范化文本（vector_key）取 id，同一句话在各首诗中共用一个向量"""
+        return DataProcessor.vector_id(item.get("vector_key") or item["id"])
+
+    @staticmethod
+    def line_key(line: str) -> str:
+        """诗句去重用的规范化文本：NFKC 统一全角/半角，去掉空白与标点"""
+        line = unicodedata.normalize("NFKC", line)
+        return "".join(ch for ch in line if not ch.isspace() and not unicodedata.category(ch).startswith("P"))
+
+    @staticmethod
+    def process_poetry_data(data_item: Dict[str, Any], dedup: bool = False) -> Dict[str, Any]:
+        """处理诗词数据项；dedup=True 时为每句附上 vector_key，规范化后相同的诗句只编码一次"""
         # processed_item = {
         #     "id": hash(str(data_item)),  # 生成唯一ID
         #     "type": "poetry",
@@ -83,18 +113,23 @@ class DataProcessor:
                     lines.append(clean_line)
                     
         # 为每句创建索引项，保留诗的元数据
+        poem_id = DataProcessor.content_id(data_item)
+        full_content = '\n'.join(content_lines) if isinstance(content_lines, list) else content_lines
         for i, line in enumerate(lines):
             line_item = {
-                "id": f"{hash(str(data_item))}-{i}",  # 生成唯一ID
+                "id": f"{poem_id}-{i}",               # 生成唯一ID
                 "type": "poetry_line",
                 "line": line,                        # 单句内容
                 "line_index": i,                     # 句子在原诗中的位置
                 "title": data_item.get("古诗名", ""),  # 保留原诗标题
                 "author": data_item.get("作者", ""),   # 保留作者
                 "dynasty": data_item.get("朝代", ""),  # 保留朝代
-                "full_content": '\n'.join(content_lines) if isinstance(content_lines, list) else content_lines,
+                "full_content": full_content,
                 "text_for_embedding": line           # 以单句作为向量化对象
             }
+            key = DataProcessor.line_key(line) if dedup else ""
+            if key:
+                line_item["vector_key"] = f"line:{key}"
             poetry_lines.append(line_item)
         
         return poetry_lines
@@ -103,7 +138,7 @@ class DataProcessor:
     def process_idiom_data(data_item: Dict[str, Any]) -> Dict[str, Any]:
         """处理成语数据项"""
         processed_item = {
-            "id": hash(str(data_item)),  # 生成唯一ID
+            "id": DataProcessor.content_id(data_item),  # 生成唯一ID
             "type": "idiom",
             "idiom": data_item.get("成语", ""),
             "pinyin": data_item.get("拼音", ""),
@@ -0,0 +1,333 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional
+
+import numpy as np
+
+import rag_config as rag_config
+from src.model_registry import get_model
+
+try:
+    import fcntl  # 可选：多进程共用磁盘缓存时加文件锁，Windows 下不可用
+except ImportError:
+    fcntl = None
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler(os.path.join(rag_config.LOG_DIR, 'embedding_cache.log')),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+KEY_BYTES = 16
+
+
+class DiskEmbeddingStore:
+    """磁盘缓存层
+
+    vectors[-<代号>].f32  向量按行顺序追加（float32），读取时内存映射
+    keys[-<代号>].bin     每行向量对应的文本哈希，与向量文件行号对齐
+    meta.json             模型名、向量维度与当前代号
+    lock                  进程间追加/压缩互斥
+
+    行数将超过 max_rows 时压缩：保留最近写入的 COMPACT_KEEP 比例的行，写成新一代文件后替换 meta.json，
+    其他进程在下次同步时发现代号变化，重新读取
+    """
+
+    COMPACT_KEEP = 0.8
+    COPY_ROWS = 4096  # 压缩时每次复制的行数
+
+    def __init__(self, directory: str, model_name: str, dimension: int, max_rows: int = None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.model_name = model_name
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.lock_path = os.path.join(directory, "lock")
+        self.dimension = dimension
+        self.row_bytes = dimension * 4
+        self.max_rows = rag_config.EMBEDDING_CACHE_MAX_ROWS if max_rows is None else max_rows
+        self.generation = None  # 当前文件的代号，每次压缩加一
+        self._rows = {}         # 文本哈希 -> 行号
+        self._count = 0         # 文件中已对齐的行数
+        self._vectors = None    # np.memmap，行数增加后重新映射
+        self._lock = threading.Lock()
+
+        with self._file_lock():
+            meta = self._read_meta()
+            if meta is None:
+                self._write_meta(0)
+            elif meta["dimension"] != dimension:
+                raise ValueError(f"磁盘缓存 {directory} 的向量维度为 {meta['dimension']}，与模型输出 {dimension} 不符")
+            self._sync()
+        logger.info(f"磁盘缓存 {directory} 已有 {len(self._rows)} 条向量")
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _file_lock(self):
+        return _FileLock(self.lock_path)
+
+    def _paths(self, generation: int):
+        suffix = f"-{generation}" if generation else ""  # 第 0 代沿用未压缩过的旧文件名
+        return (os.path.join(self.directory, f"vectors{suffix}.f32"),
+                os.path.join(self.directory, f"keys{suffix}.bin"))
+
+    def _read_meta(self) -> Optional[Dict]:
+        if not os.path.exists(self.meta_path):
+            return None
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_meta(self, generation: int) -> None:
+        tmp_path = f"{self.meta_path}.tmp{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model_name": self.model_name, "dimension": self.dimension, "generation": generation},
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, self.meta_path)
+
+    def _sync(self) -> int:
+        """读入其他进程追加的键；截掉崩溃时只写了一半的尾部，返回对齐后的行数（须持有文件锁）"""
+        generation = self._read_meta().get("generation", 0)
+        if generation != self.generation:
+            # 首次打开，或其他进程已压缩：行号全部失效，从新一代文件重新读取
+            self.generation = generation
+            self.vectors_path, self.keys_path = self._paths(generation)
+            for path in (self.vectors_path, self.keys_path):
+                open(path, "ab").close()
+            self._rows, self._count, self._vectors = {}, 0, None
+        rows = min(os.path.getsize(self.keys_path) // KEY_BYTES,
+                   os.path.getsize(self.vectors_path) // self.row_bytes)
+        known = self._count
+        for path, size in ((self.keys_path, rows * KEY_BYTES), (self.vectors_path, rows * self.row_bytes)):
+            if os.path.getsize(path) > size:
+                os.truncate(path, size)
+        if rows > known:
+            with open(self.keys_path, "rb") as f:
+                f.seek(known * KEY_BYTES)
+                data = f.read((rows - known) * KEY_BYTES)
+            for i in range(rows - known):
+                self._rows.setdefault(data[i * KEY_BYTES:(i + 1) * KEY_BYTES], known + i)
+        self._count = rows
+        return rows
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        with self._lock:
+            found = {key: self._rows[key] for key in keys if key in self._rows}
+            if not found:
+                return {}
+            if self._vectors is None or len(self._vectors) <= max(found.values()):
+                # 重新映射前先同步：其他进程压缩后旧文件已删除，行号需按新文件重新取
+                with self._file_lock():
+                    self._sync()
+                    self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                              shape=(self._count, self.dimension)) if self._count else None
+                found = {key: self._rows[key] for key in keys if key in self._rows}
+                if not found:
+                    return {}
+            vectors = self._vectors[list(found.values())]
+        return dict(zip(found, vectors))
+
+    def put_many(self, keys: List[bytes], vectors: np.ndarray) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock():
+            start = self._sync()
+            new = [i for i, key in enumerate(keys) if key not in self._rows]
+            if not new:
+                return
+            if self.max_rows and start + len(new) > self.max_rows:
+                self._compact([keys[i] for i in new], vectors[new])
+                return
+            # 先写向量再写键，中途崩溃时键不会指向不存在的向量
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors[new].tobytes())
+            with open(self.keys_path, "ab") as f:
+                f.write(b"".join(keys[i] for i in new))
+            for offset, i in enumerate(new):
+                self._rows[keys[i]] = start + offset
+
+    def _compact(self, new_keys: List[bytes], new_vectors: np.ndarray) -> None:
+        """保留最近写入的行并追加本次的新向量，写成新一代文件（须持有文件锁）"""
+        limit = max(int(self.max_rows * self.COMPACT_KEEP), 1)
+        new_keys, new_vectors = new_keys[-limit:], new_vectors[-limit:]
+        keep = min(self._count, limit - len(new_keys))
+        first = self._count - keep
+        old_paths = (self.vectors_path, self.keys_path)
+        vectors_path, keys_path = self._paths(self.generation + 1)
+        with open(self.vectors_path, "rb") as src, open(vectors_path, "wb") as dst:
+            src.seek(first * self.row_bytes)
+            for row in range(first, self._count, self.COPY_ROWS):
+                dst.write(src.read(min(self.COPY_ROWS, self._count - row) * self.row_bytes))
+            dst.write(new_vectors.tobytes())
+        with open(self.keys_path, "rb") as src, open(keys_path, "wb") as dst:
+            src.seek(first * KEY_BYTES)
+            dst.write(src.read(keep * KEY_BYTES))
+            dst.write(b"".join(new_keys))
+        # meta.json 替换后新文件才生效，中途崩溃时旧一代文件仍完整可用
+        self._write_meta(self.generation + 1)
+        for path in old_paths:
+            os.remove(path)
+        self._sync()
+        logger.info(f"磁盘缓存 {self.directory} 已压缩：保留 {keep} 条，新增 {len(new_keys)} 条（上限 {self.max_rows}）")
+
+
+class _FileLock:
+    """进程间互斥的追加锁（无 fcntl 的平台上退化为仅进程内互斥）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.path, "ab")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class EmbeddingCache:
+    """文本向量缓存：内存 LRU + 可选的磁盘层，键为模型名（含编码后端）+ 文本哈希
+
+    提供与 SentenceTransformer.encode 相同的调用方式，未命中的文本才交给模型编码，
+    全部命中时不需要加载模型。磁盘层对所有调用可读，但只有 persist=True 的调用
+    （评估等会重复出现的文本）才写入，临时查询与语料扫描不会让磁盘缓存随语料增长
+    """
+
+    def __init__(self, model_name: str = None, device: str = None,
+                 max_items: int = rag_config.EMBEDDING_CACHE_SIZE,
+                 cache_dir: Optional[str] = rag_config.EMBEDDING_CACHE_DIR, backend: str = None,
+                 persist: bool = False):
+        self.model_name = model_name or rag_config.MODEL_NAME
+        self.device = device
+        self.backend = backend or rag_config.ENCODER_BACKEND
+        self.max_items = max_items
+        self.persist = persist  # encode 未指定 persist 时的默认值
+        # 不同后端（尤其 int8 量化）的向量有细微差别，分开缓存
+        self.cache_key = self.model_name if self.backend == "torch" else f"{self.model_name}@{self.backend}"
+        self.cache_dir = None
+        if cache_dir:
+            digest = hashlib.sha1(self.cache_key.encode("utf-8")).hexdigest()[:12]
+            self.cache_dir = os.path.join(cache_dir, digest)
+        self._memory = OrderedDict()
+        self._disk = None
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> bytes:
+        return hashlib.blake2b(f"{self.cache_key}\0{text}".encode("utf-8"), digest_size=KEY_BYTES).digest()
+
+    def _disk_store(self, dimension: int = None) -> Optional[DiskEmbeddingStore]:
+        """磁盘层在维度已知后才打开（已有缓存从 meta.json 读取维度）"""
+        with self._lock:
+            if self._disk is None and self.cache_dir:
+                meta_path = os.path.join(self.cache_dir, "meta.json")
+                if dimension is None and os.path.exists(meta_path):
+                    with open(meta_path, "r", encoding="utf-8") as f:
+                        dimension = json.load(f)["dimension"]
+                if dimension is not None:
+                    self._disk = DiskEmbeddingStore(self.cache_dir, self.cache_key, dimension)
+        return self._disk
+
+    def _remember(self, key: bytes, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def encode(self, texts: List[str], batch_size: int = rag_config.BATCH_SIZE,
+               convert_to_numpy: bool = True, persist: bool = None, **kwargs) -> np.ndarray:
+        """编码一组文本，返回 (len(texts), dim) 的 float32 数组
+
+        persist 为 True 时新编码的向量写入磁盘层（None 时取实例的默认值）；
+        kwargs 只转交给模型，不参与缓存键，不要传入会改变向量结果的参数
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        keys = [self._key(text) for text in texts]
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            self.memory_hits += sum(1 for key in keys if key in found)
+
+        pending = [key for key in dict.fromkeys(keys) if key not in found]
+        disk = self._disk_store() if pending else None
+        if disk is not None:
+            from_disk = disk.get_many(pending)
+            found.update(from_disk)
+            with self._lock:
+                self.disk_hits += sum(1 for key in keys if key in from_disk)
+                for key, vector in from_disk.items():
+                    self._remember(key, vector)
+
+        # 同一批中重复的文本只编码一次
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            model = get_model(self.model_name, self.device, self.backend)
+            vectors = model.encode(list(missing.values()), batch_size=batch_size,
+                                   convert_to_numpy=True, **kwargs).astype(np.float32, copy=False)
+            new = dict(zip(missing, vectors))
+            found.update(new)
+            with self._lock:
+                self.misses += sum(1 for key in keys if key in new)
+                for key, vector in new.items():
+                    self._remember(key, vector)
+            disk = self._disk_store(vectors.shape[1]) if (self.persist if persist is None else persist) else None
+            if disk is not None:
+                disk.put_many(list(new), vectors)
+
+        return np.stack([found[key] for key in keys])
+
+    def stats(self) -> Dict[str, float]:
+        total = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "requests": total,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / total if total else 0.0,
+            "memory_items": len(self._memory),
+            "disk_items": len(self._disk) if self._disk is not None else 0,
+        }
+
+    def log_stats(self) -> None:
+        s = self.stats()
+        logger.info(f"向量缓存命中率 {s['hit_rate']:.1%}（内存 {s['memory_hits']}，磁盘 {s['disk_hits']}，"
+                    f"未命中 {s['misses']}，共 {s['requests']} 次）")
+
+
+# 进程内共享的缓存：(模型名, 编码后端) -> EmbeddingCache
+_caches = {}
+_lock = threading.Lock()
+
+
+def get_embedding_cache(model_name: str = None, device: str = None) -> EmbeddingCache:
+    """获取进程内共享的向量缓存，同一模型的检索器、评估器共用一份"""
+    model_name = model_name or rag_config.MODEL_NAME
+    key = (model_name, rag_config.ENCODER_BACKEND)
+    with _lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = EmbeddingCache(model_name, device)
+    return cache
@@ -1,11 +1,14 @@
 import os
+import json
+import time
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Sequence
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 
 import rag_config as rag_config
-from src.retriever import Retriever
+from src.retriever import Retriever, TextChunker
+from src.data_processor import DataProcessor
+from src.vector_store import reconstruct_vectors
 
 # 配置日志
 logging.basicConfig(
@@ -18,85 +21,207 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+def content_key(item: Dict[str, Any]) -> str:
+    """检索结果（诗句/成语）用于与标注比对的规范化文本"""
+    return DataProcessor.line_key(item["line"] if item["type"] == "poetry_line" else item["idiom"])
+
+
 class Evaluator:
-    """评估RAG系统的性能"""
-    
-    def __init__(self, retriever: Retriever):
+    """评估RAG系统的推荐质量与检索性能
+
+    测试案例为 {"text": 文本, "relevant": [期望推荐的诗句/成语, ...]}，relevant 可省略；
+    有标注的案例计算 recall@k 与 MRR。所有案例的文本块一次批量检索，
+    语义相关性直接使用索引中存储的命中向量，只需编码案例原文。
+    性能测试默认使用不读写查询向量缓存的检索器：同一批文本反复检索，经缓存时测到的只是缓存命中的耗时
+    """
+
+    def __init__(self, retriever: Retriever, top_k: int = rag_config.TOP_K, ks: Sequence[int] = (1, 5, 10),
+                 perf_retriever: Retriever = None):
         self.retriever = retriever
-        self.model = retriever.model
-    
+        self.model = retriever.encoder  # 与检索器共用向量缓存
+        self.top_k = top_k
+        self.ks = sorted(set(ks))
+        self._perf_retriever = perf_retriever
+
+    @property
+    def perf_retriever(self) -> Retriever:
+        """性能测试使用的检索器，未指定时为不使用缓存的独立检索器（索引为内存映射，模型进程内共用）"""
+        if self._perf_retriever is None:
+            self._perf_retriever = self.retriever if not self.retriever.use_cache else \
+                Retriever(self.retriever.model_name, self.retriever.device, use_cache=False)
+        return self._perf_retriever
+
+    def hit_vectors(self, items: List[Dict[str, Any]]) -> np.ndarray:
+        """从诗词/成语索引取回检索结果的向量，顺序与 items 一致"""
+        vectors = None
+        for item_type, index in (("poetry_line", self.retriever.poetry_index), ("idiom", self.retriever.idiom_index)):
+            rows = [i for i, item in enumerate(items) if item["type"] == item_type]
+            if not rows:
+                continue
+            found = reconstruct_vectors(index, [items[i]["vector_id"] for i in rows])
+            if vectors is None:
+                vectors = np.zeros((len(items), found.shape[1]), dtype=np.float32)
+            vectors[rows] = found
+        return vectors if vectors is not None else np.zeros((0, 0), dtype=np.float32)
+
+    def _relevance_batch(self, texts: List[str], case_items: List[List[Dict[str, Any]]]) -> List[Dict[str, float]]:
+        """各案例原文与其推荐结果的余弦相似度：原文一次批量编码，推荐项向量从索引取回"""
+        empty = {"avg_similarity": 0.0, "max_similarity": 0.0, "min_similarity": 0.0}
+        all_items = [item for items in case_items for item in items]
+        if not all_items:
+            return [dict(empty) for _ in texts]
+        text_vectors = self.model.encode(texts, batch_size=rag_config.BATCH_SIZE, convert_to_numpy=True,
+                                         persist=self.retriever.persist_cache)
+        rec_vectors = self.hit_vectors(all_items)
+        # PCA 降维索引重建的向量不再是单位长度，统一归一化后按余弦计算
+        text_vectors = text_vectors / np.maximum(np.linalg.norm(text_vectors, axis=1, keepdims=True), 1e-12)
+        rec_vectors = rec_vectors / np.maximum(np.linalg.norm(rec_vectors, axis=1, keepdims=True), 1e-12)
+        relevance, offset = [], 0
+        for text_vector, items in zip(text_vectors, case_items):
+            if not items:
+                relevance.append(dict(empty))
+                continue
+            similarities = rec_vectors[offset:offset + len(items)] @ text_vector
+            offset += len(items)
+            relevance.append({
+                "avg_similarity": float(np.mean(similarities)),
+                "max_similarity": float(np.max(similarities)),
+                "min_similarity": float(np.min(similarities))
+            })
+        return relevance
+
     def calculate_semantic_relevance(self, text: str, recommendations: List[Dict[str, Any]]) -> Dict[str, float]:
-        """计算推荐的语义相关性"""
-        if not recommendations:
-            return {"avg_similarity": 0.0, "max_similarity": 0.0, "min_similarity": 0.0}
-        
-        # 获取原始文本的嵌入向量
-        text_embedding = self.model.encode([text], convert_to_numpy=True)
-        
-        # 收集所有推荐项的嵌入向量
-        rec_texts = []
-        for rec in recommendations:
-            for item in rec["recommendations"]:
-                if item["type"] == "诗词":
-                    rec_texts.append(item["content"])
-                else:  # idiom
-                    rec_texts.append(f"{item['idiom']} {item['explanation']}")
-        
-        if not rec_texts:
-            return {"avg_similarity": 0.0, "max_similarity": 0.0, "min_similarity": 0.0}
-        
-        # 计算推荐项的嵌入向量
-        rec_embeddings = self.model.encode(rec_texts, convert_to_numpy=True)
-        
-        # 计算相似度
-        similarities = cosine_similarity(text_embedding, rec_embeddings)[0]
-        
-        return {
-            "avg_similarity": float(np.mean(similarities)),
-            "max_similarity": float(np.max(similarities)),
-            "min_similarity": float(np.min(similarities))
-        }
-    
+        """计算推荐的语义相关性（recommendations 为 recommend_for_text 的结果）"""
+        items = [item for rec in recommendations for item in rec["recommendations"]]
+        return self._relevance_batch([text], [items])[0]
+
+    def _retrieve_cases(self, test_cases: List[Dict[str, Any]], top_k: int) -> List[List[List[Dict[str, Any]]]]:
+        """所有案例的全部文本块一次批量检索，按案例拆分为 [块][结果]"""
+        case_chunks = [TextChunker.split_text(case["text"]) for case in test_cases]
+        results = self.retriever.retrieve_batch([chunk for chunks in case_chunks for chunk in chunks], top_k)
+        per_case, offset = [], 0
+        for chunks in case_chunks:
+            per_case.append(results[offset:offset + len(chunks)])
+            offset += len(chunks)
+        return per_case
+
+    @staticmethod
+    def _ranking(chunk_results: List[List[Dict[str, Any]]]) -> List[str]:
+        """把一个案例各文本块的结果合并为一个排序列表：同一诗句/成语取最高分，按分数降序
+
+        混合检索的结果按 rrf_score 排序，这里也以它为准
+        """
+        best = {}
+        for results in chunk_results:
+            for item in results:
+                key = content_key(item)
+                best[key] = max(best.get(key, -np.inf), item.get("rrf_score", item["score"]))
+        return sorted(best, key=best.get, reverse=True)
+
     def evaluate_recommendations(self, test_cases: List[Dict[str, Any]]) -> Dict[str, float]:
         """评估一组测试案例的推荐质量"""
+        # 按最大的 k 检索一次：各块的前 top_k 项即推荐结果，合并排序后用于 recall@k / MRR
+        per_case = self._retrieve_cases(test_cases, max([self.top_k] + self.ks))
+        case_items = [[item for results in chunk_results for item in results[:self.top_k]]
+                      for chunk_results in per_case]
+        relevance = self._relevance_batch([case["text"] for case in test_cases], case_items)
+
         metrics = {
-            "avg_similarity": [],
+            "avg_similarity": [r["avg_similarity"] for r in relevance],
             "poetry_ratio": [],
             "idiom_ratio": [],
-            "recommendation_count": []
+            "recommendation_count": [len(items) for items in case_items],
         }
-        
-        for case in test_cases:
-            text = case["text"]
-            recommendations = self.retriever.recommend_for_text(text)
-            formatted_recs = self.retriever.format_recommendations(recommendations)
-            
-            # 计算语义相关性
-            relevance = self.calculate_semantic_relevance(text, recommendations)
-            metrics["avg_similarity"].append(relevance["avg_similarity"])
-            
-            # 统计诗词和成语的比例
-            poetry_count = 0
-            idiom_count = 0
-            total_recs = 0
-            
-            for rec in formatted_recs:
-                for item in rec["recommendations"]:
-                    total_recs += 1
-                    if item["type"] == "诗词":
-                        poetry_count += 1
-                    else:
-                        idiom_count += 1
-            
-            if total_recs > 0:
-                metrics["poetry_ratio"].append(poetry_count / total_recs)
-                metrics["idiom_ratio"].append(idiom_count / total_recs)
-            metrics["recommendation_count"].append(total_recs)
-        
-        # 计算平均指标
-        return {
-            "avg_semantic_relevance": np.mean(metrics["avg_similarity"]).item(),
+        recalls = {k: [] for k in self.ks}
+        reciprocal_ranks = []
+        for case, items, chunk_results in zip(test_cases, case_items, per_case):
+            if items:
+                poetry_count = sum(1 for item in items if item["type"] == "poetry_line")
+                metrics["poetry_ratio"].append(poetry_count / len(items))
+                metrics["idiom_ratio"].append(1 - poetry_count / len(items))
+
+            relevant = {DataProcessor.line_key(text) for text in case.get("relevant", [])}
+            if not relevant:
+                continue
+            ranking = self._ranking(chunk_results)
+            for k in self.ks:
+                recalls[k].append(len(relevant.intersection(ranking[:k])) / len(relevant))
+            rank = next((i + 1 for i, key in enumerate(ranking) if key in relevant), None)
+            reciprocal_ranks.append(1 / rank if rank else 0.0)
+
+        result = {
+            "avg_semantic_relevance": np.mean(metrics["avg_similarity"]).item() if test_cases else 0,
             "avg_poetry_ratio": np.mean(metrics["poetry_ratio"]).item() if metrics["poetry_ratio"] else 0,
             "avg_idiom_ratio": np.mean(metrics["idiom_ratio"]).item() if metrics["idiom_ratio"] else 0,
-            "avg_rec_count": np.mean(metrics["recommendation_count"]).item()
-        }
\ No newline at end of file
+            "avg_rec_count": np.mean(metrics["recommendation_count"]).item() if test_cases else 0,
+            "labeled_cases": len(reciprocal_ranks),
+        }
+        if reciprocal_ranks:
+            for k in self.ks:
+                result[f"recall@{k}"] = np.mean(recalls[k]).item()
+            result["mrr"] = np.mean(reciprocal_ranks).item()
+        return result
+
+    def measure_performance(self, test_cases: List[Dict[str, Any]], rounds: int = 1) -> Dict[str, float]:
+        """检索性能：逐案例检索的延迟分位数，以及全部案例一次批量检索的吞吐（使用 perf_retriever）"""
+        retriever = self.perf_retriever
+        case_chunks = [TextChunker.split_text(case["text"]) for case in test_cases]
+        retriever.retrieve("预热")  # 模型加载不计入延迟
+        latencies = []
+        for _ in range(rounds):
+            for chunks in case_chunks:
+                start = time.perf_counter()
+                retriever.retrieve_batch(chunks, self.top_k)
+                latencies.append(time.perf_counter() - start)
+        all_chunks = [chunk for chunks in case_chunks for chunk in chunks]
+        start = time.perf_counter()
+        retriever.retrieve_batch(all_chunks, self.top_k)
+        batch_time = time.perf_counter() - start
+
+        latencies = np.array(latencies) * 1000 if latencies else np.zeros(1)
+        return {
+            "latency_p50_ms": float(np.percentile(latencies, 50)),
+            "latency_p95_ms": float(np.percentile(latencies, 95)),
+            "latency_p99_ms": float(np.percentile(latencies, 99)),
+            "latency_mean_ms": float(latencies.mean()),
+            "cases_per_sec": len(test_cases) / batch_time if batch_time else 0.0,
+            "chunks_per_sec": len(all_chunks) / batch_time if batch_time else 0.0,
+            "chunks": len(all_chunks),
+        }
+
+    def build_report(self, test_cases: List[Dict[str, Any]], rounds: int = 1) -> Dict[str, Any]:
+        """完整评估报告（可序列化为 JSON，用于跟踪回归）"""
+        # 先测性能：perf_retriever 与 retriever 为同一个（使用缓存）时，避免质量评估预热的缓存让延迟偏低
+        performance = self.measure_performance(test_cases, rounds)
+        quality = self.evaluate_recommendations(test_cases)
+        return {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {
+                "model": self.retriever.model_name,
+                "encoder_backend": rag_config.ENCODER_BACKEND,
+                "index_type": rag_config.INDEX_TYPE,
+                "vector_encoding": rag_config.VECTOR_ENCODING,
+                "retrieval_mode": rag_config.RETRIEVAL_MODE,
+                "dedup_lines": rag_config.DEDUP_LINES,
+                "top_k": self.top_k,
+                "chunk_size": rag_config.TEXT_CHUNK_SIZE,
+                "chunk_overlap": rag_config.TEXT_CHUNK_OVERLAP,
+                "chunk_unit": rag_config.TEXT_CHUNK_UNIT,
+                # 性能数据是否经过查询向量缓存；为 true 时延迟与吞吐主要反映缓存命中，不宜与未缓存的报告对比
+                "performance_query_cache": self.perf_retriever.use_cache,
+                "quality_query_cache": self.retriever.use_cache,
+            },
+            "cases": len(test_cases),
+            "quality": quality,
+            "performance": performance,
+            "cache": self.retriever.encoder.stats(),
+        }
+
+    @staticmethod
+    def write_report(report: Dict[str, Any], path: str) -> None:
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logger.info(f"评估报告已写入 {path}")
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import shutil
+import logging
+from typing import List, Tuple, Iterable
+
+import numpy as np
+
+import rag_config as rag_config
+from src.metadata_store import metadata_path
+from src.sharding import read_manifest, shard_path
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler(os.path.join(rag_config.LOG_DIR, 'lexical_index.log')),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+# 码位上限（0x10FFFF + 1），n-gram 按 n 个码位拼成一个整数键，n <= 3 时不超出 int64
+CODE_SPACE = 0x110000
+ARRAYS = ["keys", "indptr", "docs", "tf", "idf", "doc_ids", "doc_chars", "doc_grams", "doc_terms"]
+
+
+def lexical_dir(index_path: str) -> str:
+    return f"{index_path}.lexical"
+
+
+def source_signature(index_path: str) -> List[List]:
+    """元数据文件的大小与修改时间，元数据变化（重建、增量更新）后词法索引随之重建"""
+    manifest = read_manifest(index_path)
+    paths = [metadata_path(shard_path(index_path, i)) for i in range(manifest["num_shards"])] \
+        if manifest is not None else [metadata_path(index_path)]
+    signature = []
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+def gram_keys(code_points: np.ndarray, ngram: int) -> np.ndarray:
+    """把码位序列的每个长度为 ngram 的窗口编码成一个 int64 键"""
+    if len(code_points) < ngram:
+        return np.zeros(0, dtype=np.int64)
+    code_points = code_points.astype(np.int64)
+    keys = code_points[:len(code_points) - ngram + 1].copy()
+    for offset in range(1, ngram):
+        keys = keys * CODE_SPACE + code_points[offset:len(code_points) - ngram + 1 + offset]
+    return keys
+
+
+def _code_points(text: str) -> np.ndarray:
+    # surrogatepass：孤立代理项（JSON 中的 "\ud800" 转义）按其码位编码，不抛出 UnicodeEncodeError
+    return np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+
+
+class LexicalIndex:
+    """字符 n-gram 倒排索引，BM25 打分
+
+    文档为诗句（line）与成语（idiom），与向量索引共用向量 id。倒排表按 CSR 存储：
+        keys     升序的 n-gram 键；indptr[t]:indptr[t+1] 为第 t 个 n-gram 的倒排区间
+        docs/tf  倒排中的文档序号与词频
+        doc_*    每个文档的向量 id、字符数、n-gram 总数、不同 n-gram 数
+    各数组以 .npy 保存，加载时内存映射
+    """
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r"))
+        self.ngram = self.meta["ngram"]
+        self.n_docs = len(self.doc_ids)
+        k1, b = rag_config.BM25_K1, rag_config.BM25_B
+        avgdl = max(self.meta["avgdl"], 1e-9)
+        # BM25 分母中与文档长度有关的部分，每个文档预先算好
+        self._norm = (k1 * (1 - b + b * np.asarray(self.doc_grams, dtype=np.float32) / avgdl)).astype(np.float32)
+
+    # ---------- 构建 ----------
+    @staticmethod
+    def build(directory: str, docs: Iterable[Tuple[int, str]], ngram: int = None,
+              signature: List = None) -> "LexicalIndex":
+        """由 (向量 id, 文本) 构建索引，全部操作在 numpy 上批量完成"""
+        ngram = ngram or rag_config.LEXICAL_NGRAM
+        if not 1 <= ngram <= 3:
+            raise ValueError(f"LEXICAL_NGRAM 须在 1~3 之间: {ngram}")
+        start = time.perf_counter()
+        ids, texts = [], []
+        for vid, text in docs:
+            ids.append(vid)
+            texts.append(text or "")
+        doc_ids = np.array(ids, dtype=np.int64)
+        doc_chars = np.array([len(text) for text in texts], dtype=np.int32)
+
+        # 所有文档以 \0 连接后一次取 n-gram，丢弃跨越分隔符的窗口
+        joined = _code_points("\0".join(texts))
+        keys = gram_keys(joined, ngram)
+        valid = np.ones(len(keys), dtype=bool)
+        for offset in range(ngram):
+            valid &= joined[offset:len(joined) - ngram + 1 + offset] != 0
+        starts = np.concatenate([[0], np.cumsum(doc_chars[:-1] + 1)]) if len(texts) else np.zeros(0, np.int64)
+        positions = np.flatnonzero(valid)
+        gram_docs = np.searchsorted(starts, positions, side="right") - 1
+        keys = keys[valid]
+
+        # (n-gram, 文档) 去重并计数得到词频，按 n-gram 排序即为倒排表
+        order = np.lexsort((gram_docs, keys))
+        keys, gram_docs = keys[order], gram_docs[order]
+        boundary = np.ones(len(keys), dtype=bool)
+        boundary[1:] = (keys[1:] != keys[:-1]) | (gram_docs[1:] != gram_docs[:-1])
+        pair_starts = np.flatnonzero(boundary)
+        tf = np.diff(np.append(pair_starts, len(keys))).astype(np.uint16)
+        pair_keys, pair_docs = keys[pair_starts], gram_docs[pair_starts].astype(np.int32)
+        term_starts = np.flatnonzero(np.concatenate([[True], pair_keys[1:] != pair_keys[:-1]])) \
+            if len(pair_keys) else np.zeros(0, dtype=np.int64)
+        unique_keys = pair_keys[term_starts]
+        indptr = np.append(term_starts, len(pair_keys)).astype(np.int64)
+        df = np.diff(indptr)
+        n_docs = len(texts)
+        idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        doc_grams = np.maximum(doc_chars - ngram + 1, 0).astype(np.int32)
+        doc_terms = np.bincount(pair_docs, minlength=n_docs).astype(np.int32)
+
+        tmp_dir = f"{directory}.tmp{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        arrays = {"keys": unique_keys, "indptr": indptr, "docs": pair_docs, "tf": tf, "idf": idf,
+                  "doc_ids": doc_ids, "doc_chars": doc_chars, "doc_grams": doc_grams, "doc_terms": doc_terms}
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"ngram": ngram, "n_docs": n_docs, "avgdl": float(doc_grams.mean()) if n_docs else 0.0,
+                       "signature": signature or []}, f)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp_dir, directory)
+        logger.info(f"词法索引 {directory} 构建完成：{n_docs} 条文档，{len(unique_keys)} 个 {ngram}-gram，"
+                    f"耗时 {time.perf_counter() - start:.1f} 秒")
+        return LexicalIndex(directory)
+
+    @staticmethod
+    def load_or_build(index_path: str, metadata) -> "LexicalIndex":
+        """加载与元数据一致的词法索引；不存在或元数据已变化时重新构建"""
+        directory = lexical_dir(index_path)
+        signature = source_signature(index_path)
+        meta_path = os.path.join(directory, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["signature"] == signature and meta["ngram"] == rag_config.LEXICAL_NGRAM:
+                return LexicalIndex(directory)
+            logger.info(f"元数据或 n-gram 配置已变化，重建词法索引 {directory}")
+        return LexicalIndex.build(directory, metadata.iter_texts(), signature=signature)
+
+    # ---------- 检索 ----------
+    def search_one(self, query: str, k: int, min_coverage: float = rag_config.LEXICAL_MIN_COVERAGE):
+        """返回 BM25 最高的 k 个文档：(向量 id, BM25 分数, 覆盖率, 字符数)，按分数降序
+
+        覆盖率 = 文档中出现在查询里的不同 n-gram 数 / 文档的不同 n-gram 数，原句引用时为 1；
+        覆盖率低于 min_coverage 的文档只是零散共用了几个字，不作为候选
+        """
+        query_keys = np.unique(gram_keys(_code_points(query), self.ngram))
+        terms = np.searchsorted(self.keys, query_keys)
+        found = terms < len(self.keys)
+        terms = terms[found]
+        terms = terms[np.asarray(self.keys[terms]) == query_keys[found]]
+        if not len(terms):
+            return (np.zeros(0, np.int64), np.zeros(0, np.float32),
+                    np.zeros(0, np.float32), np.zeros(0, np.int32))
+
+        # 展开所有命中 n-gram 的倒排区间
+        starts, ends = np.asarray(self.indptr[terms]), np.asarray(self.indptr[terms + 1])
+        lengths = ends - starts
+        postings = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        docs = np.asarray(self.docs[postings])
+        tf = np.asarray(self.tf[postings], dtype=np.float32)
+        weights = np.repeat(np.asarray(self.idf[terms]), lengths)
+        contrib = weights * tf * (rag_config.BM25_K1 + 1) / (tf + self._norm[docs])
+
+        # 命中文档多时直接按文档序号计数，少时先去重再计数
+        if len(docs) * 8 > self.n_docs:
+            matched = np.bincount(docs, minlength=self.n_docs)
+            candidates = np.flatnonzero(matched)
+            scores = np.bincount(docs, contrib, minlength=self.n_docs)[candidates]
+            matched = matched[candidates]
+        else:
+            candidates, inverse = np.unique(docs, return_inverse=True)
+            scores = np.bincount(inverse, contrib)
+            matched = np.bincount(inverse)
+        coverage = matched / np.maximum(np.asarray(self.doc_terms[candidates]), 1)
+        keep = coverage >= min_coverage
+        candidates, scores, coverage = candidates[keep], scores[keep], coverage[keep]
+        if len(candidates) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            candidates, scores, coverage = candidates[top], scores[top], coverage[top]
+        order = np.argsort(-scores, kind="stable")
+        candidates = candidates[order]
+        return (np.asarray(self.doc_ids[candidates]), scores[order].astype(np.float32),
+                coverage[order].astype(np.float32), np.asarray(self.doc_chars[candidates]))
+
+    def search(self, queries: List[str], k: int, min_coverage: float = rag_config.LEXICAL_MIN_COVERAGE):
+        return [self.search_one(query, k, min_coverage) for query in queries]
@@ -0,0 +1,300 @@
+import os
+import sqlite3
+import shutil
+import threading
+import logging
+from typing import List, Dict, Any, Iterable, Iterator, Set, Tuple
+
+import rag_config as rag_config
+from src.data_processor import DataProcessor
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler(os.path.join(rag_config.LOG_DIR, 'metadata_store.log')),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+# 诗词按“诗-句”两张表规范化存储，整首诗的内容只存一份；
+# 句子表/成语表的 id 即向量在 FAISS 索引中的 id（由内容哈希得到，见 DataProcessor.vector_id）。
+# 诗句去重（DEDUP_LINES）后一个向量对应多处出处：lines 每个向量一行（记录其中一处），
+# line_sources 为倒排表，记录每个向量在各首诗中的全部出处
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS poems (
+    id INTEGER PRIMARY KEY,
+    title TEXT, author TEXT, dynasty TEXT, full_content TEXT
+);
+CREATE TABLE IF NOT EXISTS lines (
+    id INTEGER PRIMARY KEY,
+    doc_id TEXT, poem_id INTEGER, line_index INTEGER, line TEXT
+);
+CREATE INDEX IF NOT EXISTS lines_poem_id ON lines (poem_id);
+CREATE TABLE IF NOT EXISTS line_sources (
+    doc_id TEXT PRIMARY KEY,
+    id INTEGER, poem_id INTEGER, line_index INTEGER
+);
+CREATE INDEX IF NOT EXISTS line_sources_id ON line_sources (id);
+CREATE TABLE IF NOT EXISTS idioms (
+    id INTEGER PRIMARY KEY,
+    doc_id TEXT, idiom TEXT, pinyin TEXT, explanation TEXT, source TEXT, example TEXT,
+    usage TEXT, emotion TEXT, synonyms TEXT, antonyms TEXT, text_for_embedding TEXT
+);
+"""
+
+IDIOM_FIELDS = ["idiom", "pinyin", "explanation", "source", "example", "usage",
+                "emotion", "synonyms", "antonyms", "text_for_embedding"]
+
+# SQLite 单条语句的参数个数有上限，批量查询时分批
+MAX_SQL_PARAMS = 900
+
+
+def metadata_path(index_path: str) -> str:
+    return f"{index_path}.sqlite"
+
+
+def read_info(path: str) -> Dict[str, str]:
+    """读取元数据文件的 info 表（文件不存在时返回空字典）"""
+    if not os.path.exists(path):
+        return {}
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return dict(conn.execute("SELECT key, value FROM info"))
+    except sqlite3.DatabaseError:
+        return {}
+    finally:
+        conn.close()
+
+
+class MetadataWriter:
+    """构建索引时按块写入元数据，写完后原子替换为正式文件
+
+    resume=True 时接着上次中断留下的临时文件写；base=True 时以现有正式文件为底做增量修改
+    """
+
+    def __init__(self, path: str, resume: bool = False, base: bool = False):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        if not (resume and os.path.exists(self.tmp_path)):
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+            if base and os.path.exists(path):
+                shutil.copyfile(path, self.tmp_path)
+        # 构建流水线中由写入线程写、主线程收尾，同一时刻只有一个线程使用连接
+        self.conn = sqlite3.connect(self.tmp_path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+
+    def ids(self) -> Set[int]:
+        """当前已写入的全部向量 id"""
+        return {r[0] for r in self.conn.execute("SELECT id FROM lines UNION ALL SELECT id FROM idioms")}
+
+    @staticmethod
+    def _poetry_rows(items: List[Dict[str, Any]], ids: List[int]):
+        """诗句记录对应的 poems、lines、line_sources 行"""
+        poem_rows, line_rows, source_rows = [], [], []
+        for vid, item in zip(ids, items):
+            if item["type"] == "poetry_line":
+                # 同一首诗的各句 id 形如 "<诗id>-<句序号>"，共享一条 poems 记录
+                poem_id = DataProcessor.vector_id(item["id"].rsplit("-", 1)[0])
+                poem_rows.append((poem_id, item["title"], item["author"],
+                                  item["dynasty"], item["full_content"]))
+                line_rows.append((vid, item["id"], poem_id, item["line_index"], item["line"]))
+                source_rows.append((item["id"], vid, poem_id, item["line_index"]))
+        return poem_rows, line_rows, source_rows
+
+    def add(self, items: List[Dict[str, Any]], ids: List[int]) -> None:
+        """写入一块元数据，ids 为每条记录对应的向量 id（重复写入同一 id 时覆盖）"""
+        poem_rows, line_rows, source_rows = self._poetry_rows(items, ids)
+        idiom_rows = [(vid, str(item["id"]), *[item.get(f, "") for f in IDIOM_FIELDS])
+                      for vid, item in zip(ids, items) if item["type"] != "poetry_line"]
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO poems VALUES (?, ?, ?, ?, ?)", poem_rows)
+            self.conn.executemany("INSERT OR REPLACE INTO lines VALUES (?, ?, ?, ?, ?)", line_rows)
+            self.conn.executemany("INSERT OR REPLACE INTO line_sources VALUES (?, ?, ?, ?)", source_rows)
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO idioms VALUES ({', '.join('?' * (len(IDIOM_FIELDS) + 2))})", idiom_rows)
+
+    def add_sources(self, items: List[Dict[str, Any]], ids: List[int]) -> None:
+        """只记录出处：诗句的向量已存在（重复诗句或增量构建时未变化的记录）"""
+        poem_rows, _, source_rows = self._poetry_rows(items, ids)
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO poems VALUES (?, ?, ?, ?, ?)", poem_rows)
+            self.conn.executemany("INSERT OR REPLACE INTO line_sources VALUES (?, ?, ?, ?)", source_rows)
+
+    def clear_sources(self) -> None:
+        """清空出处表；构建时会遍历全部数据，重新记录每一处出处"""
+        with self.conn:
+            self.conn.execute("DELETE FROM line_sources")
+
+    def remove(self, ids: Iterable[int]) -> None:
+        """删除指定向量 id 的记录，并清理不再有句子引用的诗"""
+        ids = list(ids)
+        with self.conn:
+            for i in range(0, len(ids), MAX_SQL_PARAMS):
+                batch = ids[i:i + MAX_SQL_PARAMS]
+                marks = ", ".join("?" * len(batch))
+                self.conn.execute(f"DELETE FROM lines WHERE id IN ({marks})", batch)
+                self.conn.execute(f"DELETE FROM line_sources WHERE id IN ({marks})", batch)
+                self.conn.execute(f"DELETE FROM idioms WHERE id IN ({marks})", batch)
+            # lines 中记录的那处出处已删除（所在的诗被删改）而句子仍在别处出现时，改记其余出处中最早的一处
+            self.conn.execute(
+                "UPDATE lines SET (doc_id, poem_id, line_index) = ("
+                "SELECT doc_id, poem_id, line_index FROM line_sources s WHERE s.id = lines.id ORDER BY s.rowid LIMIT 1) "
+                "WHERE doc_id NOT IN (SELECT doc_id FROM line_sources s WHERE s.id = lines.id) "
+                "AND id IN (SELECT id FROM line_sources)")
+            self.conn.execute("DELETE FROM poems WHERE id NOT IN (SELECT poem_id FROM lines) "
+                              "AND id NOT IN (SELECT poem_id FROM line_sources)")
+
+    @property
+    def count(self) -> int:
+        return self.conn.execute("SELECT (SELECT COUNT(*) FROM lines) + (SELECT COUNT(*) FROM idioms)").fetchone()[0]
+
+    def set_info(self, key: str, value: str) -> None:
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO info VALUES (?, ?)", (key, value))
+
+    def close(self) -> None:
+        count = self.count
+        poems = self.conn.execute("SELECT COUNT(*) FROM poems").fetchone()[0]
+        self.set_info("count", str(count))
+        self.conn.close()
+        os.replace(self.tmp_path, self.path)
+        logger.info(f"元数据已写入 {self.path}，共 {count} 条，{poems} 首诗")
+
+    def discard(self) -> None:
+        """放弃本次修改，删除临时文件"""
+        self.conn.close()
+        os.remove(self.tmp_path)
+
+
+class MetadataStore:
+    """只读元数据存储，按行号懒加载，只取检索命中的 top-k 条"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._count = int(self._conn().execute("SELECT value FROM info WHERE key = 'count'").fetchone()[0])
+        # 旧版元数据没有出处表
+        self._has_sources = self._conn().execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'line_sources'").fetchone() is not None
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite 连接不能跨线程共享，每个线程各自打开
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro&immutable=1", uri=True,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA mmap_size=268435456")  # 通过内存映射读取，多进程共享页缓存
+            self._local.conn = conn
+        return conn
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        item = self.get_many([row])[0]
+        if item is None:
+            raise IndexError(row)
+        return item
+
+    def ids(self) -> Set[int]:
+        """全部向量 id"""
+        return {r[0] for r in self._conn().execute("SELECT id FROM lines UNION ALL SELECT id FROM idioms")}
+
+    def iter_texts(self) -> Iterator[Tuple[int, str]]:
+        """逐条给出 (向量 id, 检索用原文)：诗句为该句，成语为成语本身（供构建词法索引）"""
+        yield from self._conn().execute("SELECT id, line FROM lines UNION ALL SELECT id, idiom FROM idioms")
+
+    def get_many(self, rows: Iterable[int]) -> List[Dict[str, Any]]:
+        """按行号批量查询，返回顺序与 rows 一致（不存在的行号对应 None）
+
+        诗句附带 sources：该句在各首诗中的全部出处（去重后一个向量可能对应多处）
+        """
+        rows = [int(r) for r in rows]
+        found, sources = {}, {}
+        conn = self._conn()
+        for i in range(0, len(rows), MAX_SQL_PARAMS):
+            batch = rows[i:i + MAX_SQL_PARAMS]
+            marks = ", ".join("?" * len(batch))
+            for r in conn.execute(
+                    "SELECT l.id, l.doc_id, l.line, l.line_index, p.title, p.author, p.dynasty, p.full_content "
+                    f"FROM lines l JOIN poems p ON p.id = l.poem_id WHERE l.id IN ({marks})", batch):
+                found[r[0]] = {
+                    "id": r[1],
+                    "type": "poetry_line",
+                    "line": r[2],
+                    "line_index": r[3],
+                    "title": r[4],
+                    "author": r[5],
+                    "dynasty": r[6],
+                    "full_content": r[7],
+                    "text_for_embedding": r[2],
+                }
+            if self._has_sources:
+                for r in conn.execute(
+                        "SELECT s.id, s.doc_id, s.line_index, p.title, p.author, p.dynasty FROM line_sources s "
+                        f"JOIN poems p ON p.id = s.poem_id WHERE s.id IN ({marks}) ORDER BY s.rowid", batch):
+                    sources.setdefault(r[0], []).append({"id": r[1], "line_index": r[2], "title": r[3],
+                                                         "author": r[4], "dynasty": r[5]})
+            for r in conn.execute(
+                    f"SELECT id, doc_id, {', '.join(IDIOM_FIELDS)} FROM idioms WHERE id IN ({marks})", batch):
+                found[r[0]] = {"id": r[1], "type": "idiom", **dict(zip(IDIOM_FIELDS, r[2:]))}
+        for vid, item_sources in sources.items():
+            if vid in found:
+                found[vid]["sources"] = item_sources
+        return [found.get(r) for r in rows]
+
+
+class ListMetadata:
+    """旧版 torch.save 列表元数据的适配器，提供与 MetadataStore 相同的接口"""
+
+    def __init__(self, items: List[Dict[str, Any]]):
+        self.items = items
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        return self.items[row]
+
+    def get_many(self, rows: Iterable[int]) -> List[Dict[str, Any]]:
+        return [self.items[r] if 0 <= r < len(self.items) else None for r in rows]
+
+    def iter_texts(self) -> Iterator[Tuple[int, str]]:
+        for row, item in enumerate(self.items):
+            yield row, item.get("line") if item["type"] == "poetry_line" else item.get("idiom")
+
+
+def open_metadata(index_path: str):
+    """优先打开 SQLite 元数据，不存在时回退到旧版 .meta 文件"""
+    path = metadata_path(index_path)
+    if os.path.exists(path):
+        return MetadataStore(path)
+    legacy_path = f"{index_path}.meta"
+    if os.path.exists(legacy_path):
+        import torch
+        logger.warning(f"正在读取旧版元数据 {legacy_path}，可运行 rag_recommand.py --migrate-index 转换")
+        return ListMetadata(torch.load(legacy_path))
+    raise FileNotFoundError(f"元数据文件不存在: {path}")
+
+
+def migrate_legacy_metadata(index_path: str) -> bool:
+    """将旧版 .meta 列表转换为 SQLite 元数据，返回是否进行了转换"""
+    path, legacy_path = metadata_path(index_path), f"{index_path}.meta"
+    if os.path.exists(path) or not os.path.exists(legacy_path):
+        return False
+    import torch
+    items = torch.load(legacy_path)
+    writer = MetadataWriter(path)
+    # 旧版索引没有 id 映射，向量 id 即行号
+    for start in range(0, len(items), rag_config.CHUNK_SIZE):
+        chunk = items[start:start + rag_config.CHUNK_SIZE]
+        writer.add(chunk, list(range(start, start + len(chunk))))
+    writer.close()
+    return True
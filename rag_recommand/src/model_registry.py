@@ -0,0 +1,70 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import rag_config as rag_config
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler(os.path.join(rag_config.LOG_DIR, 'model_registry.log')),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+# 进程内共享的模型：(模型名, 设备, 编码后端) -> 模型实例
+_models = {}
+_lock = threading.Lock()
+# 实际加载模型的次数，用于确认没有重复加载
+load_count = 0
+
+
+def get_model(model_name: str = None, device: str = None, backend: str = None):
+    """获取（必要时加载）嵌入模型，同一进程内每个模型只加载一次
+
+    backend 为 "onnx"/"onnx_int8" 时返回 ONNX Runtime 编码器（仅 CPU），encode 接口相同
+    """
+    global load_count
+    model_name = model_name or rag_config.MODEL_NAME
+    backend = backend or rag_config.ENCODER_BACKEND
+    device = "cpu" if backend != "torch" else (device or rag_config.DEVICE)
+    key = (model_name, device, backend)
+    model = _models.get(key)
+    if model is not None:
+        return model
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            start = time.perf_counter()
+            if backend == "torch":
+                # 延迟导入：只有真正需要编码时才加载 torch / sentence_transformers
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(model_name, device=device)
+            elif backend in ("onnx", "onnx_int8"):
+                from src.onnx_encoder import OnnxEncoder
+                model = OnnxEncoder(model_name, quantize=backend == "onnx_int8")
+            else:
+                raise ValueError(f"不支持的编码后端: {backend}")
+            _models[key] = model
+            load_count += 1
+            logger.info(f"加载模型 {model_name}（{backend}/{device}）耗时 {time.perf_counter() - start:.2f} 秒")
+    return model
+
+
+def loaded_models():
+    return list(_models)
+
+
+def spawn_pool(max_workers: int, initializer=None, initargs=()) -> ProcessPoolExecutor:
+    """创建以 spawn 方式启动的进程池
+
+    父进程可能已加载 torch 等多线程库，fork 出的子进程可能死锁，因此统一用 spawn
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=initializer, initargs=initargs)
@@ -0,0 +1,120 @@
+import os
+import logging
+from typing import List, Dict, Iterable, Tuple, Optional, Hashable
+
+import numpy as np
+
+import rag_config as rag_config
+from src.data_processor import DataProcessor
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler(os.path.join(rag_config.LOG_DIR, 'near_dup.log')),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_BITS = 64
+_BASE = np.uint64(0x100000001B3)  # 滚动哈希的乘数（FNV-1a 64 位素数）
+_BIT_SHIFTS = np.arange(FINGERPRINT_BITS, dtype=np.uint64)
+
+
+def _mix64(x: np.ndarray) -> np.ndarray:
+    """splitmix64 的末尾混合，把 n-gram 键打散为各位近似独立的 64 位哈希"""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def simhash(text: str, ngram: int = None) -> Optional[int]:
+    """文章正文的 64 位 SimHash 指纹
+
+    正文按 line_key 规范化（NFKC、去空白与标点）后取字符 n-gram，每个 n-gram 哈希为 64 位，
+    各位按 n-gram 出现次数投票。内容相近的文章指纹的汉明距离小；正文短于 SIMHASH_MIN_CHARS 时
+    指纹不可靠，返回 None
+    """
+    ngram = ngram or rag_config.SIMHASH_NGRAM
+    text = DataProcessor.line_key(text or "")
+    if len(text) < max(rag_config.SIMHASH_MIN_CHARS, ngram):
+        return None
+    # surrogatepass：孤立代理项（JSON 中的 "\ud800" 转义）按其码位编码，不抛出 UnicodeEncodeError
+    code_points = np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32).astype(np.uint64)
+    # 多项式滚动哈希得到每个 n-gram 的键，uint64 溢出即取模 2^64
+    keys = code_points[:len(code_points) - ngram + 1].copy()
+    with np.errstate(over="ignore"):
+        for offset in range(1, ngram):
+            keys = keys * _BASE + code_points[offset:len(code_points) - ngram + 1 + offset]
+        hashes = _mix64(keys)
+    bits = (hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)
+    votes = bits.sum(axis=0) * 2 > len(hashes)
+    return int(np.bitwise_or.reduce(np.where(votes, np.uint64(1) << _BIT_SHIFTS, np.uint64(0))))
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class SimHashIndex:
+    """SimHash 分段索引：64 位指纹切成 bands 段，任一段完全相同的指纹才比较汉明距离
+
+    bands > max_distance 时，由鸽巢原理，距离不超过 max_distance 的两个指纹至少有一段相同，
+    因此查找不漏且只需比较少量候选，不必与全部指纹两两比较
+    """
+
+    def __init__(self, bands: int = None, max_distance: int = None):
+        self.bands = bands or rag_config.SIMHASH_BANDS
+        self.max_distance = rag_config.SIMHASH_MAX_DISTANCE if max_distance is None else max_distance
+        if FINGERPRINT_BITS % self.bands:
+            raise ValueError(f"SIMHASH_BANDS 须整除 {FINGERPRINT_BITS}: {self.bands}")
+        if self.max_distance >= self.bands:
+            raise ValueError(f"SIMHASH_MAX_DISTANCE 须小于 SIMHASH_BANDS，否则分段查找会漏掉近似重复: "
+                             f"{self.max_distance} >= {self.bands}")
+        self.band_bits = FINGERPRINT_BITS // self.bands
+        self._mask = (1 << self.band_bits) - 1
+        self._tables = [{} for _ in range(self.bands)]
+        self._fingerprints = {}
+
+    def __len__(self) -> int:
+        return len(self._fingerprints)
+
+    def _band_keys(self, fingerprint: int) -> List[int]:
+        return [(fingerprint >> (i * self.band_bits)) & self._mask for i in range(self.bands)]
+
+    def add(self, key: Hashable, fingerprint: int) -> None:
+        self._fingerprints[key] = fingerprint
+        for table, band in zip(self._tables, self._band_keys(fingerprint)):
+            table.setdefault(band, []).append(key)
+
+    def query(self, fingerprint: int) -> List[Tuple[Hashable, int]]:
+        """距离不超过 max_distance 的已入库指纹：[(键, 汉明距离)]，按距离升序"""
+        candidates = set()
+        for table, band in zip(self._tables, self._band_keys(fingerprint)):
+            candidates.update(table.get(band, ()))
+        matches = [(key, hamming(fingerprint, self._fingerprints[key])) for key in candidates]
+        return sorted((match for match in matches if match[1] <= self.max_distance), key=lambda match: match[1])
+
+
+def find_duplicates(items: Iterable[Tuple[Hashable, Optional[int]]], bands: int = None,
+                    max_distance: int = None) -> Dict[Hashable, Tuple[Hashable, int]]:
+    """按给定顺序为 (键, 指纹) 分组：每组第一次出现的文章为代表，之后的近似重复指向距离最近的代表
+
+    返回 {重复文章的键: (代表文章的键, 汉明距离)}；只有代表入库，重复不会串联成链。指纹为 None 的文章不参与
+    """
+    index = SimHashIndex(bands, max_distance)
+    duplicates = {}
+    for key, fingerprint in items:
+        if fingerprint is None:
+            continue
+        matches = index.query(fingerprint)
+        if matches:
+            duplicates[key] = matches[0]
+        else:
+            index.add(key, fingerprint)
+    logger.info(f"近似重复检测：{len(index)} 篇代表文章，{len(duplicates)} 篇重复")
+    return duplicates
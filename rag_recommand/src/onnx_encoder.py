@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from typing import List
+
+import numpy as np
+
+import rag_config as rag_config
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler(os.path.join(rag_config.LOG_DIR, 'onnx_encoder.log')),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+FP32_FILE = "model.onnx"
+INT8_FILE = "model.int8.onnx"
+CONFIG_FILE = "encoder.json"
+MODEL_INPUTS = ["input_ids", "attention_mask", "token_type_ids"]
+
+
+def export_dir(model_name: str) -> str:
+    digest = hashlib.sha1(model_name.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(rag_config.ONNX_DIR, digest)
+
+
+def _pooling_mode(pooling) -> str:
+    # 新版 sentence-transformers 直接保存 pooling_mode 字符串，旧版通过 get_pooling_mode_str() 获取
+    mode = getattr(pooling, "pooling_mode", None)
+    return mode if isinstance(mode, str) else pooling.get_pooling_mode_str()
+
+
+def export_onnx(model_name: str = None, quantize: bool = True) -> str:
+    """把 sentence-transformers 模型的 Transformer 部分导出为 ONNX（需要 torch），
+    池化与归一化在推理时用 numpy 完成；quantize=True 时另存一份动态 int8 量化模型。返回导出目录
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    model_name = model_name or rag_config.MODEL_NAME
+    out_dir = export_dir(model_name)
+    os.makedirs(out_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer, pooling = model[0], model[1]
+    pooling_mode = _pooling_mode(pooling)
+    if pooling_mode not in ("cls", "mean", "max"):
+        raise ValueError(f"ONNX 后端暂不支持 {pooling_mode} 池化")
+    normalize = any(type(module).__name__ == "Normalize" for module in model)
+
+    sample = model.tokenizer(["示例文本", "用于导出模型的第二条示例文本"], padding=True, return_tensors="pt")
+    input_names = [name for name in MODEL_INPUTS if name in sample]
+
+    class _Wrapper(torch.nn.Module):
+        """按位置参数接收输入，只输出 last_hidden_state"""
+
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, *inputs):
+            return self.auto_model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    fp32_path = os.path.join(out_dir, FP32_FILE)
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    with torch.no_grad():
+        torch.onnx.export(_Wrapper(transformer.auto_model).eval(), tuple(sample[name] for name in input_names),
+                          fp32_path, input_names=input_names, output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic_axes, opset_version=17, dynamo=False)
+    model.tokenizer.save_pretrained(out_dir)
+    with open(os.path.join(out_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({"model_name": model_name, "pooling_mode": pooling_mode, "normalize": normalize,
+                   "max_seq_length": model.max_seq_length, "input_names": input_names,
+                   "pad_token": model.tokenizer.pad_token, "pad_token_id": model.tokenizer.pad_token_id,
+                   "dimension": model.encode(["维度"]).shape[1]}, f, ensure_ascii=False, indent=2)
+    logger.info(f"已导出 ONNX 模型 {fp32_path}，耗时 {time.perf_counter() - start:.1f} 秒")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(fp32_path, os.path.join(out_dir, INT8_FILE), weight_type=QuantType.QInt8)
+        logger.info(f"已生成 int8 动态量化模型 {os.path.join(out_dir, INT8_FILE)}")
+    return out_dir
+
+
+class OnnxEncoder:
+    """基于 ONNX Runtime 的 CPU 编码器，encode 的调用方式与 SentenceTransformer 相同
+
+    推理时只依赖 onnxruntime 与 tokenizers，不加载 torch/transformers；模型未导出时首次使用会自动导出
+    """
+
+    def __init__(self, model_name: str = None, quantize: bool = False, threads: int = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        self.model_name = model_name or rag_config.MODEL_NAME
+        self.quantize = quantize
+        model_dir = export_dir(self.model_name)
+        model_path = os.path.join(model_dir, INT8_FILE if quantize else FP32_FILE)
+        if not os.path.exists(model_path) or not os.path.exists(os.path.join(model_dir, CONFIG_FILE)):
+            logger.info(f"未找到 {model_path}，开始导出")
+            export_onnx(self.model_name, quantize=quantize)
+        with open(os.path.join(model_dir, CONFIG_FILE), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = threads or rag_config.ONNX_THREADS or os.cpu_count() or 1
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+        logger.info(f"ONNX Runtime 编码器就绪: {model_path}（intra-op 线程 {options.intra_op_num_threads}）")
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dimension"]
+
+    get_embedding_dimension = get_sentence_embedding_dimension
+
+    def _pool(self, hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        mode = self.config["pooling_mode"]
+        if mode == "cls":
+            return hidden[:, 0]
+        mask = mask[:, :, None].astype(hidden.dtype)
+        if mode == "mean":
+            return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return np.where(mask > 0, hidden, -1e9).max(axis=1)
+
+    def encode(self, texts: List[str], batch_size: int = rag_config.BATCH_SIZE,
+               convert_to_numpy: bool = True, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        """编码一组文本，返回 (len(texts), dim) 的 float32 数组（按长度排序分批，减少填充）"""
+        if isinstance(texts, str):
+            texts = [texts]
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        vectors = np.empty((len(texts), self.config["dimension"]), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            batch = order[start:start + batch_size]
+            encodings = self.tokenizer.encode_batch([texts[i] for i in batch])
+            inputs = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            feeds = {name: inputs[name] for name in self.config["input_names"]}
+            hidden = self.session.run(["last_hidden_state"], feeds)[0]
+            vectors[batch] = self._pool(hidden, inputs["attention_mask"])
+        if self.config["normalize"]:
+            vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors
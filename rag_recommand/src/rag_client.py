@@ -0,0 +1,75 @@
+import json
+import threading
+import http.client
+from urllib.parse import urlsplit
+from typing import Dict, Any, List
+
+import rag_config as rag_config
+
+
+class RagClient:
+    """RAG 常驻服务（python rag_recommand.py --serve）的客户端
+
+    只依赖标准库；每个线程复用一条长连接，可在多线程中共用同一个实例
+    """
+
+    def __init__(self, url: str = None, timeout: float = None):
+        url = url or f"http://{rag_config.SERVE_HOST}:{rag_config.SERVE_PORT}"
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout or rag_config.SERVE_REQUEST_TIMEOUT + 5
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def _request(self, method: str, path: str, payload: Dict[str, Any] = None) -> Dict[str, Any]:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = json.loads(response.read() or b"{}")
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # 服务端关闭了空闲的长连接，重连一次
+                self.close()
+                if attempt:
+                    raise
+            except Exception:
+                self.close()
+                raise
+        if response.status != 200:
+            raise RuntimeError(f"RAG 服务返回 {response.status}: {data.get('error')}")
+        return data
+
+    def recommend(self, text: str, top_k: int = rag_config.TOP_K) -> Dict[str, Any]:
+        """返回 {"results": 格式化的分块推荐, "summary": {"诗词": [...], "成语": [...]}}"""
+        return self._request("POST", "/recommend", {"text": text, "top_k": top_k})
+
+    def recommend_summary(self, text: str, top_k: int = rag_config.TOP_K) -> Dict[str, List[str]]:
+        """与 query_rag_system 的返回值相同"""
+        return self.recommend(text, top_k)["summary"]
+
+    def health(self) -> Dict[str, Any]:
+        return self._request("GET", "/health")
+
+    def available(self) -> bool:
+        try:
+            self.health()
+            return True
+        except (OSError, RuntimeError, ValueError, http.client.HTTPException):
+            # HTTPException：端口上不是本服务（如非 HTTP 监听者返回 BadStatusLine）
+            return False
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Tuple
+
+import rag_config as rag_config
+from src.retriever import Retriever, TextChunker
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler(os.path.join(rag_config.LOG_DIR, 'rag_server.log')),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+def summarize(formatted_results: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+    """把格式化结果汇总为去重的诗句/成语列表（与 query_rag_system 的返回值相同）"""
+    res_rec = {"诗词": {}, "成语": {}}
+    for result in formatted_results:
+        for rec in result["recommendations"]:
+            res_rec["诗词" if rec["type"] == "poetry_line" else "成语"].setdefault(rec["content"])
+    return {key: list(values) for key, values in res_rec.items()}
+
+
+_STOP = object()  # 关闭信号
+
+
+class _Request:
+    __slots__ = ("spans", "chunks", "top_k", "future")
+
+    def __init__(self, spans: List[Tuple[int, int, str]], top_k: int):
+        self.spans = spans
+        self.chunks = [chunk for _, _, chunk in spans]
+        self.top_k = top_k
+        self.future = Future()
+
+
+class MicroBatcher:
+    """跨请求的动态微批处理
+
+    各请求的文本块进入同一队列；后台线程取到第一个请求后最多再等 max_wait_ms，
+    凑满 max_batch_size 个文本块或等待超时即合并为一批，一次编码、每个索引一次检索。
+    检索器只在后台线程中使用，无需加锁
+    """
+
+    def __init__(self, retriever: Retriever, max_batch_size: int = None, max_wait_ms: float = None):
+        self.retriever = retriever
+        self.max_batch_size = max_batch_size or rag_config.SERVE_MAX_BATCH_SIZE
+        self.max_wait = (rag_config.SERVE_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000
+        self._queue = queue.Queue()
+        self._carry = None  # 放不进上一批、留到下一批的请求
+        self.requests = 0
+        self.batches = 0
+        self.batched_chunks = 0
+        self._thread = threading.Thread(target=self._run, name="rag-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str, top_k: int = rag_config.TOP_K) -> Future:
+        """提交一篇文本，返回 Future，结果与 Retriever.recommend_for_text 相同"""
+        request = _Request(TextChunker.split_spans(text), top_k)
+        if not request.chunks:
+            request.future.set_result([])
+        else:
+            self._queue.put(request)
+        return request.future
+
+    def close(self) -> None:
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "chunks": self.batched_chunks,
+            "mean_batch_chunks": self.batched_chunks / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize(),
+        }
+
+    def _collect(self):
+        """取下一批请求；收到关闭信号时返回 None"""
+        first = self._carry if self._carry is not None else self._queue.get()
+        self._carry = None
+        if first is _STOP:
+            return None
+        batch, size = [first], len(first.chunks)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is _STOP or size + len(request.chunks) > self.max_batch_size:
+                # 单个请求超过上限时独占一批（retrieve_batch 内部仍按 BATCH_SIZE 编码）
+                self._carry = request
+                break
+            batch.append(request)
+            size += len(request.chunks)
+        # 调用方已放弃（取消）的请求不再计算
+        return [request for request in batch if request.future.set_running_or_notify_cancel()]
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            if batch is None:
+                break
+            if not batch:
+                continue
+            chunks = [chunk for request in batch for chunk in request.chunks]
+            # 按最大的 top_k 检索再逐请求截断：合并排序后的前 k 项与单独按 k 检索相同
+            top_k = max(request.top_k for request in batch)
+            try:
+                results = self.retriever.retrieve_batch(chunks, top_k)
+            except Exception as e:
+                logger.exception(f"批量检索失败（{len(batch)} 个请求，{len(chunks)} 个文本块）")
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            self.requests += len(batch)
+            self.batches += 1
+            self.batched_chunks += len(chunks)
+            offset = 0
+            for request in batch:
+                rows = results[offset:offset + len(request.chunks)]
+                offset += len(request.chunks)
+                request.future.set_result([{"chunk": chunk, "start": start, "end": end,
+                                            "recommendations": recs[:request.top_k]}
+                                           for (start, end, chunk), recs in zip(request.spans, rows) if recs])
+
+
+class RagRequestHandler(BaseHTTPRequestHandler):
+    """GET /health 返回服务状态；POST /recommend 接收 {"text": ..., "top_k": ...}"""
+
+    protocol_version = "HTTP/1.1"  # 支持长连接，客户端可复用连接
+    server_version = "RagServer/1.0"
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send_json(404, {"error": f"未知路径 {self.path}"})
+            return
+        rag_server = self.server.rag_server
+        self._send_json(200, {"status": "ok", "batcher": rag_server.batcher.stats(),
+                              "cache": rag_server.retriever.encoder.stats()})
+
+    def do_POST(self):
+        if self.path != "/recommend":
+            self._send_json(404, {"error": f"未知路径 {self.path}"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            text = payload["text"]
+            top_k = int(payload.get("top_k", rag_config.TOP_K))
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": f"请求格式错误: {e}"})
+            return
+
+        rag_server = self.server.rag_server
+        future = rag_server.batcher.submit(text, top_k)
+        try:
+            recommendations = future.result(timeout=rag_server.request_timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            self._send_json(504, {"error": f"检索超时（{rag_server.request_timeout} 秒）"})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+        formatted_results = rag_server.retriever.format_recommendations(recommendations)
+        self._send_json(200, {"results": formatted_results, "summary": summarize(formatted_results)})
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+
+class RagServer:
+    """常驻检索服务：进程内只有一个预热好的 Retriever，所有请求经 MicroBatcher 合并处理"""
+
+    def __init__(self, host: str = None, port: int = None, retriever: Retriever = None,
+                 max_batch_size: int = None, max_wait_ms: float = None, request_timeout: float = None):
+        self.retriever = retriever or Retriever()
+        start = time.perf_counter()
+        self.retriever.retrieve("预热")  # 提前加载模型，首个请求不承担加载耗时
+        logger.info(f"检索器预热耗时 {time.perf_counter() - start:.2f} 秒")
+        self.batcher = MicroBatcher(self.retriever, max_batch_size, max_wait_ms)
+        self.request_timeout = request_timeout or rag_config.SERVE_REQUEST_TIMEOUT
+        self.httpd = ThreadingHTTPServer((host or rag_config.SERVE_HOST,
+                                          rag_config.SERVE_PORT if port is None else port), RagRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.rag_server = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self) -> None:
+        logger.info(f"RAG 服务已启动 {self.url}（微批上限 {self.batcher.max_batch_size} 块，"
+                    f"最长等待 {self.batcher.max_wait * 1000:g} ms）")
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.httpd.server_close()
+            self.batcher.close()
+
+    def start(self) -> "RagServer":
+        """在后台线程中运行（供基准测试等进程内使用）"""
+        self._thread = threading.Thread(target=self.serve_forever, name="rag-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def shutdown(self) -> None:
+        self.httpd.shutdown()
+        if self._thread is not None:
+            self._thread.join()
@@ -1,12 +1,17 @@
 import os
 import logging
+import threading
 import numpy as np
-from typing import List, Dict, Any, Tuple
-from sentence_transformers import SentenceTransformer
-from faiss import IndexFlatIP
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from typing import List, Dict, Any, Tuple, Optional
 
 import rag_config as rag_config
 from src.vector_store import VectorStore
+from src.data_processor import DataProcessor
+from src.lexical_index import LexicalIndex
+from src.model_registry import get_model
+from src.embedding_cache import EmbeddingCache, get_embedding_cache
 
 # 配置日志
 logging.basicConfig(
@@ -19,127 +24,311 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 句末分隔符：全文转为码位数组后一次向量化比较，得到所有可断句的位置
+SENTENCE_END_CHARS = "。！？；\n.!?;"
+SENTENCE_END_CODES = np.array([ord(c) for c in SENTENCE_END_CHARS], dtype=np.uint32)
+
+
+def code_points(text: str) -> np.ndarray:
+    """文本的码位数组，下标与 str 下标一一对应
+
+    UTF-32 编码后每个码位 4 字节；孤立代理项（如 JSON 中的 "\\ud800" 转义）是合法的 str，
+    用 surrogatepass 原样编码为其码位，不会抛出 UnicodeEncodeError
+    """
+    return np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+
+
+@lru_cache(maxsize=None)
+def _get_tokenizer(model_name: str):
+    """按 token 计算块大小时使用与嵌入模型相同的 tokenizer（只加载 tokenizer，不加载模型）"""
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(model_name)
+
+
 class TextChunker:
-    """文本分块器"""
-    
+    """文本分块器
+
+    先一次扫描找出全部句末位置，再在位置数组上二分确定每块的边界，
+    返回 (start, end, text) 片段，推荐结果可以对应回原文位置
+    """
+
+    @staticmethod
+    def sentence_ends(text: str) -> List[int]:
+        """所有句末分隔符之后的位置（升序），块在这些位置断开"""
+        return (np.flatnonzero(np.isin(code_points(text), SENTENCE_END_CODES)) + 1).tolist()
+
+    @staticmethod
+    def _token_positions(text: str, unit: str) -> Optional[List[int]]:
+        """unit 为 "token" 时返回 positions，positions[i] 为 text[:i] 中的 token 数；按字符计时返回 None"""
+        if unit == "char":
+            return None
+        if unit != "token":
+            raise ValueError(f"不支持的分块单位: {unit}")
+        tokenizer = _get_tokenizer(rag_config.MODEL_NAME)
+        offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True,
+                            verbose=False)["offset_mapping"]
+        counts = np.zeros(len(text) + 1, dtype=np.int64)
+        np.add.at(counts, [token_end for _, token_end in offsets], 1)
+        return np.cumsum(counts).tolist()
+
     @staticmethod
-    def split_text(text: str, chunk_size: int = rag_config.TEXT_CHUNK_SIZE, 
-                overlap: int = rag_config.TEXT_CHUNK_OVERLAP) -> List[str]:
-        """将文本分成重叠的块"""
+    def split_spans(text: str, chunk_size: int = rag_config.TEXT_CHUNK_SIZE,
+                    overlap: int = rag_config.TEXT_CHUNK_OVERLAP,
+                    unit: str = rag_config.TEXT_CHUNK_UNIT) -> List[Tuple[int, int, str]]:
+        """将文本分成重叠的块，返回 (start, end, text[start:end]) 列表
+
+        chunk_size / overlap 的单位由 unit 决定（"char" 字符数，"token" 模型 token 数）。
+        每块尽量在块内最后一个句末分隔符处结束；下一块从本块结尾回退 overlap 个单位开始
+        """
         # 参数检查和安全处理
         if text is None:
             return []
-        
         if not isinstance(text, str):
             text = str(text)
-            
-        # 空文本或小于块大小的文本直接返回
-        if not text or len(text) <= chunk_size:
-            return [text] if text else []
-        
+        if not text:
+            return []
+
+        n = len(text)
+        positions = TextChunker._token_positions(text, unit)
+        # 小于块大小的文本直接返回
+        if (n if positions is None else positions[n]) <= chunk_size:
+            return [(0, n, text)]
+
         # 确保overlap小于chunk_size
-        overlap = min(overlap, chunk_size - 1)
-        if overlap < 0:
-            overlap = 0
-        
-        chunks = []
+        overlap = max(0, min(overlap, chunk_size - 1))
+        ends = TextChunker.sentence_ends(text)
+        spans = []
         start = 0
-        
-        # 添加安全措施防止无限循环
-        max_iterations = len(text) * 2  # 安全上限
-        iteration = 0
-        
-        while start < len(text) and iteration < max_iterations:
-            iteration += 1
-            
-            # 计算当前块的结束位置
-            end = min(start + chunk_size, len(text))
-            
-            # 如果不是最后一个块且不在句子边界，尝试找到最近的句子边界
-            if end < len(text):
-                # 在当前块中查找最后一个分隔符
-                punct_pos = -1
-                for punct in ['。', '！', '？', '；', '\n', '.', '!', '?', ';']:
-                    pos = text.rfind(punct, start, end)
-                    if pos > punct_pos:  # 找到更靠后的标点符号
-                        punct_pos = pos
-                
-                # 如果找到合适的分隔位置，调整块的结束位置
-                if punct_pos != -1:
-                    end = punct_pos + 1
-            
-            # 确保start和end在有效范围内
-            if start >= len(text) or end <= start:
-                break
-                
-            # 添加当前块到结果列表
-            chunks.append(text[start:end])
-            if end>=len(text)-1:
+        while start < n:
+            # 从 start 起不超过 chunk_size 个单位的最远位置（token 模式下对齐到 token 结尾）
+            if positions is None:
+                end = min(start + chunk_size, n)
+            else:
+                end = bisect_right(positions, positions[start] + chunk_size) - 1
+                if end < n:
+                    end = bisect_left(positions, positions[end])
+            if end < n:
+                # 块内最后一个句末位置；落在重叠区内（下一块无法前进）的不采用，直接在窗口末尾截断
+                i = bisect_right(ends, end) - 1
+                if i >= 0 and (ends[i] - overlap > start if positions is None
+                               else positions[ends[i]] - overlap > positions[start]):
+                    end = ends[i]
+            spans.append((start, end, text[start:end]))
+            # 只剩最后一个字符（通常是句末标点后的引号）时不再单独成块
+            if end >= n - 1:
                 break
-            # 更新start位置，考虑重叠
-            start = end - overlap
-            
-            # 防止无进展
-            if start == end:
-                start += 1
-        
-        return chunks
+            # 下一块从本块结尾回退 overlap 个单位开始
+            if positions is None:
+                next_start = end - overlap
+            else:
+                next_start = bisect_left(positions, positions[end] - overlap)
+            start = next_start if next_start > start else end
+        return spans
+
+    @staticmethod
+    def split_text(text: str, chunk_size: int = rag_config.TEXT_CHUNK_SIZE,
+                   overlap: int = rag_config.TEXT_CHUNK_OVERLAP,
+                   unit: str = rag_config.TEXT_CHUNK_UNIT) -> List[str]:
+        """将文本分成重叠的块，只返回块文本"""
+        return [chunk for _, _, chunk in TextChunker.split_spans(text, chunk_size, overlap, unit)]
 
 
 class Retriever:
     """检索器，用于查询相关的诗词或成语"""
     
-    def __init__(self, model_name: str = rag_config.MODEL_NAME, device: str = rag_config.DEVICE):
-        self.model = SentenceTransformer(model_name)
-        self.model.to(device)
-        self.device = device
+    def __init__(self, model_name: str = rag_config.MODEL_NAME, device: str = None, use_cache: bool = True,
+                 persist_cache: bool = False):
+        self.model_name = model_name
+        self.device = device  # 为 None 时由模型注册表按后端决定（torch 后端才检测 CUDA）
+        # use_cache=False 时查询向量不读写缓存（评估延迟时反映真实的编码开销）
+        self.use_cache = use_cache
+        self._uncached = None if use_cache else EmbeddingCache(model_name, device, max_items=0, cache_dir=None)
+        # 查询向量是否写入磁盘缓存：只有评估这类会重复运行的固定文本才写，临时查询与语料扫描不写
+        self.persist_cache = persist_cache
         
-        # 加载索引
-        vector_store = VectorStore(model_name, device)
-        self.poetry_index, self.poetry_metadata = vector_store.load_index(rag_config.POETRY_INDEX_PATH)
-        self.idiom_index, self.idiom_metadata = vector_store.load_index(rag_config.IDIOM_INDEX_PATH)
+        # 加载索引（内存映射，不依赖模型）；模型在首次编码时从进程级注册表获取
+        self._index_paths = (rag_config.POETRY_INDEX_PATH, rag_config.IDIOM_INDEX_PATH)
+        self.poetry_index, self.poetry_metadata = VectorStore.load_index(rag_config.POETRY_INDEX_PATH)
+        self.idiom_index, self.idiom_metadata = VectorStore.load_index(rag_config.IDIOM_INDEX_PATH)
+        # 按朝代分片时，同一诗句在其出现的每个朝代的分片中各有一个向量：诗词索引多取候选，结果按诗句合并
+        self._line_copies = len(self.poetry_metadata.shards) \
+            if getattr(self.poetry_metadata, "shard_by", None) == "dynasty" else 1
+        # 词法索引只在混合检索时加载
+        self._lexical = {}
+        self._lexical_lock = threading.Lock()
+        self.short_circuits = 0  # 混合检索中因词法命中可信而跳过向量检索的查询数
+        self._stats_lock = threading.Lock()  # 同一检索器由微批线程与 Web 请求线程共用，计数须加锁
+
+    @property
+    def model(self):
+        return get_model(self.model_name, self.device)
+
+    @property
+    def encoder(self):
+        """带缓存的编码器，重复出现的文本不再经过模型"""
+        if self._uncached is not None:
+            return self._uncached
+        return get_embedding_cache(self.model_name, self.device)
     
     def retrieve(self, query: str, top_k: int = rag_config.TOP_K, 
                 score_threshold: float = rag_config.SCORE_THRESHOLD) -> List[Dict[str, Any]]:
         """检索与查询相关的诗词和成语"""
-        # 查询向量化
-        query_vector = self.model.encode([query], convert_to_numpy=True)
-        
-        # 检索诗词
-        poetry_scores, poetry_indices = self.poetry_index.search(query_vector, top_k)
-        poetry_results = [
-            {**self.poetry_metadata[idx], "score": float(score)}
-            for score, idx in zip(poetry_scores[0], poetry_indices[0])
-            if score >= score_threshold
-        ]
-        
-        # 检索成语
-        idiom_scores, idiom_indices = self.idiom_index.search(query_vector, top_k)
-        idiom_results = [
-            {**self.idiom_metadata[idx], "score": float(score)}
-            for score, idx in zip(idiom_scores[0], idiom_indices[0])
-            if score >= score_threshold
-        ]
-        
-        # 合并结果并按相似度排序
-        all_results = poetry_results + idiom_results
-        all_results.sort(key=lambda x: x["score"], reverse=True)
+        return self.retrieve_batch([query], top_k, score_threshold)[0]
+
+    def retrieve_batch(self, queries: List[str], top_k: int = rag_config.TOP_K,
+                       score_threshold: float = rag_config.SCORE_THRESHOLD,
+                       mode: str = None) -> List[List[Dict[str, Any]]]:
+        """批量检索：所有查询一次编码，每个索引只做一次 nq=len(queries) 的检索
+
+        mode 默认取 RETRIEVAL_MODE；为 "hybrid" 时同时做字符 n-gram BM25 检索，两路结果按 RRF 融合
+        """
+        if not queries:
+            return []
+        mode = mode or rag_config.RETRIEVAL_MODE
+        if mode == "hybrid":
+            return self._retrieve_hybrid(queries, top_k, score_threshold)
+        if mode != "dense":
+            raise ValueError(f"不支持的检索模式: {mode}")
+
+        poetry_hits, idiom_hits = self._dense_hits(queries, top_k, score_threshold)
+        poetry_results = self._collect_batch(self.poetry_metadata, poetry_hits)
+        idiom_results = self._collect_batch(self.idiom_metadata, idiom_hits)
         
-        return all_results[:top_k]
+        results = []
+        for poetry, idiom in zip(poetry_results, idiom_results):
+            # 合并结果并按相似度排序
+            all_results = poetry + idiom
+            all_results.sort(key=lambda x: x["score"], reverse=True)
+            results.append(self._merge_line_copies(all_results)[:top_k])
+        return results
+
+    def _dense_hits(self, queries: List[str], top_k: int, score_threshold: float):
+        """向量检索，返回 (诗词, 成语) 两个索引各自每条查询的 [(向量 id, {"score": 相似度}), ...]"""
+        if not queries:
+            return [], []
+        # 查询向量化
+        query_vectors = self.encoder.encode(queries, batch_size=rag_config.BATCH_SIZE, convert_to_numpy=True,
+                                            persist=self.persist_cache)
+        hits = []
+        for index, k in ((self.poetry_index, top_k * self._line_copies), (self.idiom_index, top_k)):
+            scores, indices = index.search(query_vectors, k)
+            # -1 表示结果不足 k 条的占位
+            hits.append([[(int(idx), {"score": float(score)}) for score, idx in zip(row_scores, row_indices)
+                          if idx != -1 and score >= score_threshold]
+                         for row_scores, row_indices in zip(scores, indices)])
+        return hits
+
+    def lexical_index(self, which: str) -> LexicalIndex:
+        """"poetry"/"idiom" 的词法索引，首次使用时加载（元数据变化后自动重建）"""
+        with self._lexical_lock:
+            if which not in self._lexical:
+                index_path, metadata = {
+                    "poetry": (self._index_paths[0], self.poetry_metadata),
+                    "idiom": (self._index_paths[1], self.idiom_metadata),
+                }[which]
+                self._lexical[which] = LexicalIndex.load_or_build(index_path, metadata)
+            return self._lexical[which]
+
+    @staticmethod
+    def _confident(lexical_hits) -> bool:
+        """词法命中是否足够可信（整句/整个成语出现在查询中），可信时不必再做向量检索"""
+        _, _, coverage, chars = lexical_hits
+        return bool(np.any((coverage >= rag_config.LEXICAL_CONFIDENCE) &
+                           (chars >= rag_config.LEXICAL_CONFIDENT_MIN_CHARS)))
+
+    def _retrieve_hybrid(self, queries: List[str], top_k: int,
+                         score_threshold: float) -> List[List[Dict[str, Any]]]:
+        """BM25 与向量检索各取候选，按名次做 RRF 融合
+
+        结果的 score 为向量相似度（仅词法命中时为覆盖率），另附 rrf_score、lexical_score 与 match
+        （"dense" / "lexical" / "both"），按 rrf_score 排序
+        """
+        n_candidates = max(top_k, rag_config.HYBRID_CANDIDATES)
+        lexical = [self.lexical_index(which).search(queries, k)
+                   for which, k in (("poetry", n_candidates * self._line_copies), ("idiom", n_candidates))]
+
+        # 词法命中可信的查询跳过向量编码与检索
+        dense_rows = [q for q in range(len(queries))
+                      if not (rag_config.HYBRID_SHORT_CIRCUIT and
+                              any(self._confident(index_hits[q]) for index_hits in lexical))]
+        with self._stats_lock:
+            self.short_circuits += len(queries) - len(dense_rows)
+        dense = [dict(zip(dense_rows, index_hits))
+                 for index_hits in self._dense_hits([queries[q] for q in dense_rows], n_candidates,
+                                                    score_threshold)] if dense_rows else [{}, {}]
+
+        per_index = []
+        for metadata, dense_hits, lexical_hits in zip((self.poetry_metadata, self.idiom_metadata), dense, lexical):
+            fused_rows = []
+            for q in range(len(queries)):
+                fused = {}
+                for rank, (vid, fields) in enumerate(dense_hits.get(q, [])):
+                    fused[vid] = {"score": fields["score"], "rrf_score": 1 / (rag_config.RRF_K + rank + 1),
+                                  "match": "dense"}
+                ids, _, coverage, _ = lexical_hits[q]
+                for rank, (vid, cov) in enumerate(zip(ids.tolist(), coverage.tolist())):
+                    entry = fused.setdefault(vid, {"score": cov, "rrf_score": 0.0, "match": "lexical"})
+                    entry["rrf_score"] += 1 / (rag_config.RRF_K + rank + 1)
+                    entry["lexical_score"] = cov
+                    if entry["match"] == "dense":
+                        entry["match"] = "both"
+                fused_rows.append(list(fused.items()))
+            per_index.append(self._collect_batch(metadata, fused_rows))
+
+        results = []
+        for poetry, idiom in zip(*per_index):
+            all_results = poetry + idiom
+            all_results.sort(key=lambda x: (x["rrf_score"], x["score"]), reverse=True)
+            results.append(self._merge_line_copies(all_results)[:top_k])
+        return results
+
+    def _merge_line_copies(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """按朝代分片时把同一诗句的多个向量合并为一条：保留排名最前的一条，各分片的出处合并到 sources"""
+        if self._line_copies == 1:
+            return results
+        merged, kept = [], {}
+        for item in results:
+            if item["type"] != "poetry_line":
+                merged.append(item)
+                continue
+            sources = item.get("sources") or [{"id": item["id"], "line_index": item["line_index"],
+                                               "title": item["title"], "author": item["author"],
+                                               "dynasty": item["dynasty"]}]
+            key = DataProcessor.line_key(item["line"])
+            if key in kept:
+                kept[key]["sources"].extend(sources)
+                continue
+            item["sources"] = list(sources)
+            kept[key] = item
+            merged.append(item)
+        return merged
+
+    @staticmethod
+    def _collect_batch(metadata, hits) -> List[List[Dict[str, Any]]]:
+        """一次查询所有查询命中的元数据，再按查询拆分；hits[q] 为 [(向量 id, 附加字段), ...]
+
+        结果附带 vector_id，可据此从索引取回向量（见 vector_store.reconstruct_vectors）
+        """
+        rows = sorted({idx for row in hits for idx, _ in row})
+        items = dict(zip(rows, metadata.get_many(rows)))
+        return [[{**items[idx], **fields, "vector_id": idx} for idx, fields in row if items[idx] is not None]
+                for row in hits]
     
     def recommend_for_text(self, text: str, top_k: int = rag_config.TOP_K) -> List[Dict[str, Any]]:
         """为长文本提供诗词和成语推荐"""
         # 将文本分块
-        chunks = TextChunker.split_text(text)
+        spans = TextChunker.split_spans(text)
         
         all_recommendations = []
         
-        # 为每个块检索相关内容
-        for chunk in chunks:
-            chunk_results = self.retrieve(chunk, top_k)
+        # 整篇文本的所有块一次编码、一次检索
+        chunks = [chunk for _, _, chunk in spans]
+        for (start, end, chunk), chunk_results in zip(spans, self.retrieve_batch(chunks, top_k)):
             if chunk_results:
                 all_recommendations.append({
                     "chunk": chunk,
+                    "start": start,  # 块在原文中的位置 text[start:end]
+                    "end": end,
                     "recommendations": chunk_results
                 })
         
@@ -161,6 +350,10 @@ class Retriever:
                         "source": f"{item['title']} **** {item['dynasty']} **** {item['author']}",
                         "score": f"{item['score']:.4f}"
                     }
+                    if len(item.get("sources", [])) > 1:
+                        # 同一句出现在多首诗中（去重后共用一个向量），列出全部出处
+                        formatted["sources"] = [f"{s['title']} **** {s['dynasty']} **** {s['author']}"
+                                                for s in item["sources"]]
                 else:  # idiom
                     formatted = {
                         "type":"idiom",
@@ -179,6 +372,8 @@ class Retriever:
             
             formatted_results.append({
                 "original_text": chunk,
+                "start": rec.get("start"),
+                "end": rec.get("end"),
                 "recommendations": chunk_recs
             })
         
@@ -0,0 +1,144 @@
+import os
+import json
+import heapq
+import logging
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
+
+import numpy as np
+
+import rag_config as rag_config
+from src.data_processor import DataProcessor
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler(os.path.join(rag_config.LOG_DIR, 'sharding.log')),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+# 分片方式: "hash"（按向量 id 均匀分布）| "dynasty"（同一朝代的诗在同一分片，无朝代的记录按 hash）
+SHARD_METHODS = {"hash", "dynasty"}
+
+
+def manifest_path(index_path: str) -> str:
+    return f"{index_path}.shards.json"
+
+
+def shard_path(index_path: str, shard: int) -> str:
+    """分片 i 的索引路径，各分片有独立的 .faiss/.sqlite/.build，可单独重建"""
+    return f"{index_path}.shard{shard}"
+
+
+def read_manifest(index_path: str):
+    path = manifest_path(index_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(index_path: str, num_shards: int, shard_by: str) -> None:
+    tmp_path = f"{manifest_path(index_path)}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"num_shards": num_shards, "shard_by": shard_by}, f)
+    os.replace(tmp_path, manifest_path(index_path))
+
+
+def shard_of(item: Dict[str, Any], num_shards: int, shard_by: str = "hash") -> int:
+    """记录所属的分片（只依赖记录内容，与构建顺序无关）"""
+    if shard_by == "dynasty" and item.get("dynasty"):
+        return DataProcessor.vector_id(item["dynasty"]) % num_shards
+    # 与向量 id 取模一致，检索时可由向量 id 直接定位分片
+    return DataProcessor.item_vector_id(item) % num_shards
+
+
+def process_shard_chunk(process_chunk, shard: int, num_shards: int, shard_by: str,
+                        chunk: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """预处理一个数据块并只保留属于该分片的记录（模块级函数，可传给预处理进程池）"""
+    items = process_chunk(chunk)
+    if shard_by == "dynasty":
+        # 同一诗句可能分属不同朝代的分片，去重键加上朝代，避免多个分片出现相同的向量 id；
+        # 检索时由 Retriever 按诗句合并各分片的结果与出处
+        for item in items:
+            if item.get("vector_key") and item.get("dynasty"):
+                item["vector_key"] += f"@{item['dynasty']}"
+    return [item for item in items if shard_of(item, num_shards, shard_by) == shard]
+
+
+class ShardedIndex:
+    """多个分片索引的组合，接口与 faiss 索引的 search 相同
+
+    查询并行分发到各分片（faiss 检索时释放 GIL，线程即可并行），
+    各分片返回按分数降序的 top-k，再逐查询用堆归并出全局 top-k
+    """
+
+    def __init__(self, shards: List, max_workers: int = None):
+        self.shards = shards
+        self.d = shards[0].d
+        workers = max_workers or rag_config.SHARD_SEARCH_WORKERS or len(shards)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shard-search") \
+            if len(shards) > 1 and workers > 1 else None
+
+    @property
+    def ntotal(self) -> int:
+        return sum(shard.ntotal for shard in self.shards)
+
+    def search(self, queries: np.ndarray, k: int):
+        if self._pool is None:
+            results = [shard.search(queries, k) for shard in self.shards]
+        else:
+            results = list(self._pool.map(lambda shard: shard.search(queries, k), self.shards))
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for q in range(len(queries)):
+            rows = [zip(shard_scores[q], shard_ids[q]) for shard_scores, shard_ids in results]
+            merged = heapq.merge(*rows, key=lambda hit: -hit[0])
+            top = list(islice(((s, i) for s, i in merged if i != -1), k))
+            if top:
+                scores[q, :len(top)], ids[q, :len(top)] = zip(*top)
+        return scores, ids
+
+
+class ShardedMetadata:
+    """多个分片元数据的组合：hash 分片可由向量 id 直接定位分片，其余方式逐分片查询"""
+
+    def __init__(self, shards: List, shard_by: str):
+        self.shards = shards
+        self.shard_by = shard_by
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards)
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        item = self.get_many([row])[0]
+        if item is None:
+            raise IndexError(row)
+        return item
+
+    def iter_texts(self) -> Iterator[Tuple[int, str]]:
+        for shard in self.shards:
+            yield from shard.iter_texts()
+
+    def get_many(self, rows: Iterable[int]) -> List[Dict[str, Any]]:
+        rows = [int(r) for r in rows]
+        found = {}
+        if self.shard_by == "hash":
+            routed = {}
+            for row in rows:
+                routed.setdefault(row % len(self.shards), []).append(row)
+            for shard, shard_rows in routed.items():
+                found.update(zip(shard_rows, self.shards[shard].get_many(shard_rows)))
+        else:
+            pending = rows
+            for shard in self.shards:
+                if not pending:
+                    break
+                found.update((r, item) for r, item in zip(pending, shard.get_many(pending)) if item is not None)
+                pending = [r for r in pending if r not in found]
+        return [found.get(r) for r in rows]
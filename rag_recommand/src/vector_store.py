@@ -1,14 +1,24 @@
 import os
-import torch
 import logging
 import numpy as np
 from typing import List, Dict, Any
 from tqdm import tqdm
-from sentence_transformers import SentenceTransformer
-from faiss import IndexFlatIP, write_index, read_index
+import json
+import time
+import contextlib
+import queue
 import pickle
+import shutil
+import threading
+import functools
+from concurrent.futures import Future
 import rag_config as rag_config
 from src.data_processor import DataProcessor
+from src.model_registry import get_model, spawn_pool
+from src.metadata_store import (MetadataWriter, MetadataStore, open_metadata, metadata_path, read_info,
+                                migrate_legacy_metadata)
+from src.sharding import (ShardedIndex, ShardedMetadata, SHARD_METHODS, read_manifest, write_manifest,
+                          manifest_path, shard_path, process_shard_chunk)
 
 # 配置日志
 logging.basicConfig(
@@ -21,168 +31,692 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 需要先训练再添加向量的索引类型
+TRAINED_INDEX_TYPES = {"ivf_flat", "ivf_pq"}
+# 需要训练的存储精度（int8 需统计取值范围，pq 需训练码本）
+TRAINED_ENCODINGS = {"int8", "pq"}
+# 存储精度对应的 faiss 编码描述
+ENCODING_CODES = {"float32": "Flat", "float16": "SQfp16", "int8": "SQ8"}
+
+
+def _encoding_code(encoding: str, dimension: int) -> str:
+    if encoding == "pq":
+        if dimension % rag_config.PQ_M != 0:
+            raise ValueError(f"PQ_M={rag_config.PQ_M} 不能整除向量维度 {dimension}")
+        return f"PQ{rag_config.PQ_M}x{rag_config.PQ_NBITS}"
+    if encoding not in ENCODING_CODES:
+        raise ValueError(f"不支持的存储精度: {encoding}")
+    return ENCODING_CODES[encoding]
+
+
+def index_factory_string(index_type: str, dimension: int, nlist: int = rag_config.IVF_NLIST,
+                         encoding: str = rag_config.VECTOR_ENCODING,
+                         pca_dim: int = rag_config.PCA_DIM) -> str:
+    """将配置中的索引类型、存储精度和降维翻译为 faiss.index_factory 描述串"""
+    prefix = ""
+    if pca_dim:
+        prefix = f"PCA{pca_dim},"
+        dimension = pca_dim
+    if index_type == "flat":
+        return prefix + _encoding_code(encoding, dimension)
+    if index_type == "ivf_flat":
+        return prefix + f"IVF{nlist},{_encoding_code(encoding, dimension)}"
+    if index_type == "ivf_pq":
+        return prefix + f"IVF{nlist},{_encoding_code('pq', dimension)}"
+    if index_type == "hnsw":
+        code = _encoding_code(encoding, dimension)
+        return prefix + (f"HNSW{rag_config.HNSW_M}" if code == "Flat" else f"HNSW{rag_config.HNSW_M}_{code}")
+    raise ValueError(f"不支持的索引类型: {index_type}")
+
+
+def needs_training(index_type: str = rag_config.INDEX_TYPE, encoding: str = rag_config.VECTOR_ENCODING,
+                   pca_dim: int = rag_config.PCA_DIM) -> bool:
+    return index_type in TRAINED_INDEX_TYPES or encoding in TRAINED_ENCODINGS or bool(pca_dim)
+
+
+def _innermost_index(index):
+    """剥掉 id 映射、PCA 等预变换包装，返回实际存储向量的索引"""
+    import faiss
+    index = faiss.downcast_index(index)
+    while isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2, faiss.IndexPreTransform)):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def create_faiss_index(dimension: int, index_type: str = rag_config.INDEX_TYPE,
+                       train_vectors: np.ndarray = None,
+                       encoding: str = rag_config.VECTOR_ENCODING,
+                       pca_dim: int = rag_config.PCA_DIM):
+    """按配置创建（并在需要时训练）内积度量的 FAISS 索引"""
+    import faiss
+    nlist = rag_config.IVF_NLIST
+    if needs_training(index_type, encoding, pca_dim):
+        if train_vectors is None or len(train_vectors) == 0:
+            raise ValueError(f"{index_type}/{encoding}/PCA{pca_dim} 索引需要训练样本")
+    if index_type in TRAINED_INDEX_TYPES:
+        # faiss 建议每个聚类至少 39 个训练点，样本不足时缩小 nlist
+        nlist = max(1, min(nlist, len(train_vectors) // 39))
+    factory_string = index_factory_string(index_type, dimension, nlist, encoding, pca_dim)
+    index = faiss.index_factory(dimension, factory_string, faiss.METRIC_INNER_PRODUCT)
+    if index_type == "hnsw":
+        _innermost_index(index).hnsw.efConstruction = rag_config.HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        logger.info(f"训练 {factory_string} 索引，样本数 {len(train_vectors)}")
+        index.train(np.ascontiguousarray(train_vectors, dtype=np.float32))
+    return index
+
+
+def apply_search_params(index, nprobe: int = rag_config.IVF_NPROBE,
+                        ef_search: int = rag_config.HNSW_EF_SEARCH) -> None:
+    """设置检索参数（对不支持该参数的索引类型自动忽略）"""
+    import faiss
+    params = faiss.ParameterSpace()
+    for name, value in (("nprobe", nprobe), ("efSearch", ef_search)):
+        try:
+            params.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass
+
+
+def _mmap_flags() -> int:
+    """内存映射加载标志：IO_FLAG_MMAP_IFC（faiss>=1.8）会直接映射向量存储区，
+    多个进程共享同一份页缓存；旧版本退回 IO_FLAG_MMAP
+    """
+    import faiss
+    return getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def load_faiss_index(index_path: str, mmap: bool = True):
+    """加载向量索引：优先以内存映射方式读取 faiss 原生格式，兼容旧的 pickle 文件
+    需要继续 add/remove 的场景应传 mmap=False（映射加载的索引为只读）
+    """
+    import faiss
+    faiss_path, pkl_path = f"{index_path}.faiss", f"{index_path}.pkl"
+    if os.path.exists(faiss_path):
+        index = None
+        if mmap:
+            try:
+                index = faiss.read_index(faiss_path, _mmap_flags())
+            except RuntimeError as e:
+                logger.warning(f"索引不支持内存映射，改为完整读取: {e}")
+        if index is None:
+            index = faiss.read_index(faiss_path)
+    elif os.path.exists(pkl_path):
+        logger.warning(f"正在读取旧版 pickle 索引 {pkl_path}，"
+                       f"可运行 rag_recommand.py --migrate-index 转换为 faiss 原生格式")
+        with open(pkl_path, "rb") as f:
+            index = pickle.load(f)
+    else:
+        raise FileNotFoundError(f"索引文件不存在: {faiss_path}")
+    apply_search_params(index)
+    return index
+
+
+def index_config_signature(model_name: str) -> str:
+    """影响索引内容与结构的配置，与现有索引不一致时必须全量重建"""
+    return json.dumps({
+        "model": model_name,
+        "index_type": rag_config.INDEX_TYPE,
+        "encoding": rag_config.VECTOR_ENCODING,
+        "pca_dim": rag_config.PCA_DIM,
+        "ivf_nlist": rag_config.IVF_NLIST,
+        "pq": [rag_config.PQ_M, rag_config.PQ_NBITS],
+        "hnsw_m": rag_config.HNSW_M,
+        "dedup_lines": rag_config.DEDUP_LINES,
+    }, sort_keys=True)
+
+
+def remove_vectors(index, ids: set):
+    """从带 id 映射的索引中删除向量；HNSW 等不支持删除的索引取出保留的向量重建"""
+    import faiss
+    if not ids:
+        return index
+    remove = np.fromiter(ids, dtype=np.int64, count=len(ids))
+    try:
+        index.remove_ids(remove)
+        return index
+    except RuntimeError:
+        pass
+    all_ids = faiss.vector_to_array(index.id_map)
+    keep = np.flatnonzero(~np.isin(all_ids, remove))
+    vectors = index.index.reconstruct_n(0, index.ntotal)[keep]
+    logger.info(f"索引不支持直接删除，以保留的 {len(keep)} 条向量重建")
+    train_vectors = vectors[:rag_config.TRAIN_SAMPLE_SIZE] if needs_training() else None
+    rebuilt = faiss.IndexIDMap2(create_faiss_index(index.d, train_vectors=train_vectors))
+    rebuilt.add_with_ids(vectors, all_ids[keep])
+    return rebuilt
+
+
+def reconstruct_vectors(index, ids) -> np.ndarray:
+    """按向量 id 取出索引中存储的向量，免去重新编码（量化、降维索引得到的是近似重建的向量）"""
+    import faiss
+    ids = np.asarray(ids, dtype=np.int64)
+    if isinstance(index, ShardedIndex):
+        vectors = np.zeros((len(ids), index.d), dtype=np.float32)
+        for shard in index.shards:
+            mask = np.isin(ids, faiss.vector_to_array(shard.id_map))
+            if mask.any():
+                vectors[mask] = reconstruct_vectors(shard, ids[mask])
+        return vectors
+    if not len(ids):
+        return np.zeros((0, index.d), dtype=np.float32)
+    try:
+        return index.reconstruct_batch(ids)
+    except RuntimeError:
+        # IVF 索引需先建立 id 到倒排列表位置的直接映射
+        ivf = faiss.try_extract_index_ivf(_innermost_index(index))
+        if ivf is None:
+            raise
+        ivf.make_direct_map()
+        return index.reconstruct_batch(ids)
+
+
+class BuildCheckpoint:
+    """构建断点：每处理完一个数据块，把新编码的向量追加到构建目录并记录进度
+
+        vectors.f32    新编码的向量（float32，按行追加）
+        ids.i64        对应的向量 id
+        progress.json  配置签名、是否全量、已处理块数、行数、向量维度
+    """
+
+    def __init__(self, build_dir: str, signature: str, full: bool):
+        self.build_dir = build_dir
+        self.vectors_path = os.path.join(build_dir, "vectors.f32")
+        self.ids_path = os.path.join(build_dir, "ids.i64")
+        self.progress_path = os.path.join(build_dir, "progress.json")
+        self.signature = signature
+        self.full = full
+        self.chunks_done = self.rows = 0
+        self.dimension = None
+        self.resumed = False
+
+        progress = None
+        if os.path.exists(self.progress_path):
+            with open(self.progress_path, "r", encoding="utf-8") as f:
+                progress = json.load(f)
+        # 配置一致才能续建；要求全量重建时不接着增量构建的断点继续
+        if progress and progress["signature"] == signature and (progress["full"] or not full):
+            self.full = progress["full"]
+            self.chunks_done, self.rows, self.dimension = progress["chunks_done"], progress["rows"], progress["dimension"]
+            self.resumed = True
+            # 截掉最后一次记录进度之后写入的部分
+            row_bytes = (self.dimension or 0) * 4
+            for path, size in ((self.vectors_path, self.rows * row_bytes), (self.ids_path, self.rows * 8)):
+                if os.path.getsize(path) > size:
+                    os.truncate(path, size)
+        else:
+            self.reset()
+            self.full = full
+
+    def clear(self) -> None:
+        """构建完成（或数据无变化）后删除构建目录"""
+        shutil.rmtree(self.build_dir, ignore_errors=True)
+
+    def reset(self) -> None:
+        self.clear()
+        os.makedirs(self.build_dir)
+        for path in (self.vectors_path, self.ids_path):
+            open(path, "wb").close()
+        self.chunks_done = self.rows = 0
+        self.dimension = None
+        self.resumed = False
+
+    def ids(self) -> np.ndarray:
+        return np.fromfile(self.ids_path, dtype=np.int64, count=self.rows)
+
+    def vectors(self) -> np.ndarray:
+        if not self.rows:
+            return np.zeros((0, self.dimension or 0), dtype=np.float32)
+        return np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.rows, self.dimension))
+
+    def append(self, ids: List[int], vectors: np.ndarray) -> None:
+        with open(self.vectors_path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self.ids_path, "ab") as f:
+            f.write(np.asarray(ids, dtype=np.int64).tobytes())
+        self.rows += len(ids)
+        self.dimension = vectors.shape[1]
+
+    def commit(self, chunks_done: int) -> None:
+        """向量与元数据都已写入后再记录进度"""
+        self.chunks_done = chunks_done
+        tmp_path = f"{self.progress_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"signature": self.signature, "full": self.full, "chunks_done": chunks_done,
+                       "rows": self.rows, "dimension": self.dimension}, f)
+        os.replace(tmp_path, self.progress_path)
+
+
+def _preprocess_chunk(process_chunk, chunk: List[Dict[str, Any]]):
+    """在工作进程中预处理一个数据块，返回 ([(向量 id, 记录)], 耗时)"""
+    start = time.perf_counter()
+    pairs = [(DataProcessor.item_vector_id(item), item) for item in process_chunk(chunk)]
+    return pairs, time.perf_counter() - start
+
+
+class StageStats:
+    """流水线单个阶段的统计：处理条数、忙碌时间、空闲（等待上下游）时间"""
+
+    def __init__(self, name: str, workers: int = 1, pooled: bool = False):
+        self.name = name
+        self.workers = workers
+        self.pooled = pooled
+        self.items = 0
+        self.busy = 0.0
+        self.idle = 0.0
+
+    def summary(self, wall: float) -> Dict[str, Any]:
+        if self.pooled:
+            # 进程池各工作进程只统计忙碌时间，其余时间即为空闲
+            self.idle = max(0.0, wall * self.workers - self.busy)
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "items": self.items,
+            "busy": self.busy,
+            "idle": self.idle,
+            "throughput": self.items / self.busy if self.busy else 0.0,
+        }
+
+
+class BuildPipeline:
+    """并行构建流水线
+
+        解析线程   ijson 流式解析、分块，提交给预处理进程池
+        预处理     进程池中拆句/整理字段、计算向量 id（BUILD_WORKERS=0 时在解析线程内完成）
+        编码       主线程按块过滤出新记录（向量尚不存在的）并编码
+        写入线程   把向量、元数据、出处与断点进度落盘
+
+    阶段之间用有界队列衔接，最多 BUILD_QUEUE_SIZE 个数据块在途，内存占用不随数据量增长
+    """
+
+    def __init__(self, data_path: str, process_chunk, filter_new, encode, persist,
+                 workers: int = None, queue_size: int = None):
+        self.data_path = data_path
+        self.process_chunk = process_chunk
+        self.filter_new = filter_new      # pairs -> (新记录, 新向量 id, 向量已存在的 pairs)
+        self.encode = encode              # texts -> np.ndarray
+        self.persist = persist            # (块序号, 新记录, 新向量 id, 向量, 向量已存在的 pairs) -> None
+        self.workers = rag_config.BUILD_WORKERS if workers is None else workers
+        self.queue_size = queue_size or rag_config.BUILD_QUEUE_SIZE
+        self._stop = threading.Event()
+
+    def _put(self, q: queue.Queue, item) -> float:
+        """放入有界队列，返回阻塞等待的时间；流水线停止时放弃"""
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        return time.perf_counter() - start
+
+    def _read(self, pool, chunk_queue: queue.Queue, stats: StageStats) -> None:
+        try:
+            data_gen = DataProcessor.stream_json_data(self.data_path)
+            chunk_gen = DataProcessor.chunk_data(data_gen, rag_config.CHUNK_SIZE)
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                chunk = next(chunk_gen, None)
+                if chunk is None:
+                    break
+                if pool is None:
+                    result = _preprocess_chunk(self.process_chunk, chunk)
+                    start += result[1]  # 预处理耗时计入预处理阶段
+                else:
+                    result = pool.submit(_preprocess_chunk, self.process_chunk, chunk)
+                stats.busy += time.perf_counter() - start
+                stats.items += len(chunk)
+                stats.idle += self._put(chunk_queue, result)
+            self._put(chunk_queue, None)
+        except Exception as e:
+            self._put(chunk_queue, e)
+
+    def _write(self, write_queue: queue.Queue, stats: StageStats, errors: list) -> None:
+        while True:
+            start = time.perf_counter()
+            job = write_queue.get()
+            stats.idle += time.perf_counter() - start
+            if job is None:
+                return
+            if errors:
+                continue  # 出错后只排空队列，不再写入
+            start = time.perf_counter()
+            try:
+                self.persist(*job)
+            except Exception as e:
+                errors.append(e)
+                self._stop.set()
+            stats.busy += time.perf_counter() - start
+            stats.items += len(job[2])
+
+    def run(self, desc: str) -> List[Dict[str, Any]]:
+        """运行流水线，返回各阶段统计"""
+        parse = StageStats("解析")
+        preprocess = StageStats("预处理", max(self.workers, 1), pooled=self.workers > 0)
+        encode = StageStats("编码")
+        write = StageStats("写入")
+        chunk_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        errors = []
+        pool = None
+        if self.workers > 0:
+            pool = spawn_pool(self.workers)
+        reader = threading.Thread(target=self._read, args=(pool, chunk_queue, parse),
+                                  name="build-reader", daemon=True)
+        writer = threading.Thread(target=self._write, args=(write_queue, write, errors),
+                                  name="build-writer", daemon=True)
+        wall_start = time.perf_counter()
+        reader.start()
+        writer.start()
+        failed = True
+        try:
+            progress = tqdm(desc=desc, unit="块")
+            chunk_no = 0
+            while not errors:
+                start = time.perf_counter()
+                result = chunk_queue.get()
+                if isinstance(result, Future):
+                    result = result.result()
+                encode.idle += time.perf_counter() - start
+                if result is None:
+                    break
+                if isinstance(result, Exception):
+                    raise result
+                pairs, cost = result
+                preprocess.busy += cost
+                preprocess.items += len(pairs)
+
+                start = time.perf_counter()
+                chunk_no += 1
+                new_items, new_ids, existing = self.filter_new(pairs)
+                embeddings = self.encode([item["text_for_embedding"] for item in new_items]) if new_items else None
+                encode.busy += time.perf_counter() - start
+                encode.items += len(new_items)
+                encode.idle += self._put(write_queue, (chunk_no, new_items, new_ids, embeddings, existing))
+                progress.update(1)
+            progress.close()
+            failed = False
+        finally:
+            if failed:
+                self._stop.set()
+            # 写入线程会一直消费到结束标记，这里不会长时间阻塞
+            write_queue.put(None)
+            writer.join()
+            self._stop.set()
+            reader.join()
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        if errors:
+            raise errors[0]
+
+        wall = time.perf_counter() - wall_start
+        summaries = [stage.summary(wall) for stage in (parse, preprocess, encode, write)]
+        logger.info(f"构建流水线总耗时 {wall:.1f} 秒")
+        for s in summaries:
+            logger.info(f"  {s['stage']}（{s['workers']} 路）: {s['items']} 条，忙碌 {s['busy']:.1f} 秒，"
+                        f"空闲 {s['idle']:.1f} 秒，{s['throughput']:.0f} 条/秒")
+        return summaries
+
+
 class VectorStore:
     """向量存储类，用于处理文档嵌入和检索"""
     
-    def __init__(self, model_name: str = rag_config.MODEL_NAME, device: str = rag_config.DEVICE):
-        self.model = SentenceTransformer(model_name)
-        self.model.to(device)
-        self.device = device
-    
-    def create_poetry_index(self) -> None:
-        """创建诗词向量索引"""
-        logger.info("开始创建诗词向量索引...")
-        
-        # 确保索引目录存在
-        os.makedirs(os.path.dirname(rag_config.INDEX_DIR), exist_ok=True)
-        
-        # 收集所有文档和元数据
-        documents = []
-        metadata = []
-        
-        # 流式处理诗词数据
-        data_gen = DataProcessor.stream_json_data(rag_config.POETRY_DATA_PATH)
-        chunk_gen = DataProcessor.chunk_data(data_gen, rag_config.CHUNK_SIZE)
-        
-        # 为索引创建目录
-        index_dir = os.path.dirname(rag_config.POETRY_INDEX_PATH)
-        if not os.path.exists(index_dir):
-            os.makedirs(index_dir)
-        
-        # 初始化索引
-        first_chunk = True
-        dimension = None
-        
-        for chunk in tqdm(chunk_gen, desc="处理诗词数据块"):
-            # breakpoint()
-            processed_chunk=[]
-            texts=[]
-            for item in chunk:
-                processed_item=DataProcessor.process_poetry_data(item)
-                processed_chunk.extend(processed_item)
-            # processed_chunk = [DataProcessor.process_poetry_data(item) for item in chunk]
-            # breakpoint()
-            for item in processed_chunk:
-                for_emb=item["text_for_embedding"]
-                texts.append(for_emb)
-            
-            # 批量计算嵌入向量
-            with torch.no_grad():
-                embeddings = self.model.encode(texts, batch_size=rag_config.BATCH_SIZE, 
-                                               show_progress_bar=True, convert_to_numpy=True)
-            
-            if first_chunk:
-                dimension = embeddings.shape[1]
-                index = IndexFlatIP(dimension)
-                first_chunk = False
-            
-            # 添加向量到索引
-            index.add(embeddings)
-            
-            # 保存元数据
-            metadata.extend(processed_chunk)
-        
-        # 保存索引和元数据
-        try:
-            import pickle
-            
-            # 保存索引
-            with open(f"{rag_config.POETRY_INDEX_PATH}.pkl", "wb") as f:
-                pickle.dump(index, f)
-            
-            # 保存元数据
-            torch.save(metadata, f"{rag_config.POETRY_INDEX_PATH}.meta")
-            
-            logger.info(f"诗词向量索引创建完成，共 {len(metadata)} 条记录")
-        except Exception as e:
-            logger.error(f"保存索引失败: {str(e)}")
-            raise
-    def create_idiom_index(self) -> None:
-        """创建成语向量索引"""
-        logger.info("开始创建成语向量索引...")
-        
-        # 确保索引目录存在
-        os.makedirs(os.path.dirname(rag_config.IDIOM_INDEX_PATH), exist_ok=True)
-        
-        # 收集所有文档和元数据
-        documents = []
-        metadata = []
-        
-        # 流式处理成语数据
-        data_gen = DataProcessor.stream_json_data(rag_config.IDIOM_DATA_PATH)
-        chunk_gen = DataProcessor.chunk_data(data_gen, rag_config.CHUNK_SIZE)
-        
-        # 为索引创建目录
-        index_dir = os.path.dirname(rag_config.IDIOM_INDEX_PATH)
+    def __init__(self, model_name: str = rag_config.MODEL_NAME, device: str = None):
+        self.model_name = model_name
+        self.device = device  # 为 None 时由模型注册表按后端决定（torch 后端才检测 CUDA）
+        self.last_build_stats = []  # 最近一次构建流水线各阶段的统计
+
+    @property
+    def model(self):
+        # 模型由进程级注册表统一管理，只加载索引时不会触发模型加载
+        return get_model(self.model_name, self.device)
+
+    @staticmethod
+    def _process_poetry_chunk(chunk: List[Dict[str, Any]], dedup: bool = None) -> List[Dict[str, Any]]:
+        dedup = rag_config.DEDUP_LINES if dedup is None else dedup
+        processed_chunk = []
+        for item in chunk:
+            processed_chunk.extend(DataProcessor.process_poetry_data(item, dedup))
+        return processed_chunk
+
+    @staticmethod
+    def _process_idiom_chunk(chunk: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [DataProcessor.process_idiom_data(item) for item in chunk]
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """按文本长度排序后分批编码（长度相近的文本同批，减少填充），再还原为输入顺序"""
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        if rag_config.ENCODER_BACKEND == "torch":
+            import torch
+            no_grad = torch.no_grad()
+        else:
+            no_grad = contextlib.nullcontext()
+        with no_grad:
+            vectors = self.model.encode([texts[i] for i in order], batch_size=rag_config.BATCH_SIZE,
+                                        show_progress_bar=False, convert_to_numpy=True)
+        result = np.empty_like(vectors)
+        result[order] = vectors
+        return result
+
+    def _build_index(self, data_path: str, index_path: str, process_chunk, desc: str, rebuild: bool = False):
+        """增量构建索引：只编码新增或内容变化的记录，删除数据中已不存在的记录
+
+        索引配置变化、没有可增量更新的现有索引或 rebuild=True 时全量重建；
+        每处理完一个数据块记录一次断点，中断后再次运行从断点继续。
+        返回 (index, 记录数)，数据无变化时 index 为 None
+        """
+        index_dir = os.path.dirname(index_path)
         if not os.path.exists(index_dir):
             os.makedirs(index_dir)
-        
-        # 初始化索引
-        first_chunk = True
-        dimension = None
-        
-        for chunk in tqdm(chunk_gen, desc="处理成语数据块"):
-            # breakpoint()
-            processed_chunk = [DataProcessor.process_idiom_data(item) for item in chunk]
-            texts = [item["text_for_embedding"] for item in processed_chunk]
-            
-            # 批量计算嵌入向量
-            with torch.no_grad():
-                embeddings = self.model.encode(texts, batch_size=rag_config.BATCH_SIZE, 
-                                               show_progress_bar=True, convert_to_numpy=True)
-            
-            if first_chunk:
-                dimension = embeddings.shape[1]
-                index = IndexFlatIP(dimension)
-                first_chunk = False
-            
-            # 添加向量到索引
-            index.add(embeddings)
-            
-            # 保存元数据
-            metadata.extend(processed_chunk)
+
+        meta_path = metadata_path(index_path)
+        signature = index_config_signature(self.model_name)
+        if rebuild:
+            full, reason = True, "指定了全量重建"
+        elif not os.path.exists(f"{index_path}.faiss") or not os.path.exists(meta_path):
+            full, reason = True, "尚无索引"
+        elif read_info(meta_path).get("index_config") != signature:
+            full, reason = True, "索引配置已变化或为旧版索引"
+        else:
+            full, reason = False, ""
+
+        checkpoint = BuildCheckpoint(f"{index_path}.build", signature, full)
+        if checkpoint.resumed and not os.path.exists(f"{meta_path}.tmp"):
+            checkpoint.reset()
+        full = checkpoint.full
+        if checkpoint.resumed:
+            logger.info(f"从断点继续构建：已处理 {checkpoint.chunks_done} 个数据块，"
+                        f"已编码 {checkpoint.rows} 条新向量")
+        elif full:
+            logger.info(f"全量构建 {index_path}（{reason}）")
+        writer = MetadataWriter(meta_path, resume=checkpoint.resumed, base=not full)
+
+        # 已有向量的 id：现有索引中的（增量构建时）+ 断点中已编码的
+        base_ids = set() if full else MetadataStore(meta_path).ids()
+        embedded = base_ids | set(checkpoint.ids().tolist())
+        seen = set()
+        # 出处表随本次遍历全部重新记录；sources 为全部出处 id 的摘要，用于判断出处是否变化
+        writer.clear_sources()
+        sources = {"count": 0, "digest": 0}
+
+        def filter_new(pairs):
+            new_items, new_ids, existing = [], [], []
+            for vid, item in pairs:
+                sources["count"] += 1
+                sources["digest"] = (sources["digest"] + DataProcessor.vector_id(item["id"])) % (1 << 64)
+                if vid in seen or vid in embedded:
+                    # 向量已存在：重复的诗句（或内容完全相同的重复数据）、增量构建时未变化的记录，只记出处
+                    existing.append((vid, item))
+                else:
+                    new_items.append(item)
+                    new_ids.append(vid)
+                seen.add(vid)
+            return new_items, new_ids, existing
+
+        def persist(chunk_no, new_items, new_ids, embeddings, existing):
+            if new_items:
+                checkpoint.append(new_ids, embeddings)
+                writer.add(new_items, new_ids)
+            if existing:
+                writer.add_sources([item for _, item in existing], [vid for vid, _ in existing])
+            checkpoint.commit(chunk_no)
+
+        # 只对新增/变化的记录计算嵌入向量
+        pipeline = BuildPipeline(data_path, process_chunk, filter_new, self._encode, persist)
+        self.last_build_stats = pipeline.run(desc)
+
+        checkpoint_ids = checkpoint.ids()
+        seen_array = np.fromiter(seen, dtype=np.int64, count=len(seen))
+        new_rows = np.flatnonzero(np.isin(checkpoint_ids, seen_array))
+        stale_ids = base_ids - seen
+        sources_digest = f"{sources['count']}:{sources['digest']}"
+        if not full and not len(new_rows) and not stale_ids and \
+                read_info(meta_path).get("sources_digest") == sources_digest:
+            writer.discard()
+            checkpoint.clear()
+            logger.info(f"{data_path} 无变化，跳过 {index_path}")
+            return None, len(base_ids)
+
+        index = self._assemble_index(index_path, checkpoint, new_rows, stale_ids, full)
+        self._save_index(index, index_path)
+        writer.remove(writer.ids() - seen)
+        writer.set_info("index_config", signature if index.ntotal else "")
+        writer.set_info("sources_digest", sources_digest)
+        count = writer.count
+        writer.close()
+        checkpoint.clear()
+        logger.info(f"{index_path}: 新增 {len(new_rows)} 条，删除 {len(stale_ids)} 条；"
+                    f"{sources['count']} 条记录共用 {len(seen)} 个向量")
+        return index, count
+
+    def _assemble_index(self, index_path: str, checkpoint: "BuildCheckpoint", new_rows: np.ndarray,
+                        stale_ids: set, full: bool):
+        """把断点中编码好的向量写入索引：全量时新建（按需训练），增量时在现有索引上增删"""
+        import faiss
+        vectors, ids = checkpoint.vectors(), checkpoint.ids()
+        if full:
+            if not len(new_rows):
+                # 没有数据（如按朝代分片时的空分片）：写入空的精确索引，下次构建时全量重建
+                logger.warning(f"{index_path} 没有数据，写入空索引")
+                # 新版 sentence-transformers 将方法改名为 get_embedding_dimension
+                get_dimension = getattr(self.model, "get_embedding_dimension", None) \
+                    or self.model.get_sentence_embedding_dimension
+                return faiss.IndexIDMap2(faiss.IndexFlatIP(get_dimension()))
+            train_vectors = None
+            if needs_training():
+                # 从已编码的向量中抽样训练 IVF/PQ/SQ8/PCA，无需额外编码
+                rng = np.random.default_rng(0)
+                picks = np.sort(rng.choice(new_rows, size=min(len(new_rows), rag_config.TRAIN_SAMPLE_SIZE),
+                                           replace=False))
+                train_vectors = np.ascontiguousarray(vectors[picks])
+            index = faiss.IndexIDMap2(create_faiss_index(checkpoint.dimension, train_vectors=train_vectors))
+        else:
+            index = load_faiss_index(index_path, mmap=False)
+            # 连同本次新增的 id 一起删除：上次在替换元数据前中断时，索引里可能已有这些 id
+            index = remove_vectors(index, stale_ids | set(ids[new_rows].tolist()))
+        for start in range(0, len(new_rows), rag_config.CHUNK_SIZE):
+            rows = new_rows[start:start + rag_config.CHUNK_SIZE]
+            index.add_with_ids(np.ascontiguousarray(vectors[rows]), ids[rows])
+        apply_search_params(index)
+        return index
+
+    def _save_index(self, index, index_path: str) -> None:
         try:
-            
-            
-            # 保存索引
-            with open(f"{rag_config.IDIOM_INDEX_PATH}.pkl", "wb") as f:
-                pickle.dump(index, f)
-            
-            # 保存元数据
-            torch.save(metadata, f"{rag_config.IDIOM_INDEX_PATH}.meta")
-            
-            logger.info(f"成语向量索引创建完成，共 {len(metadata)} 条记录")
+            import faiss
+            # 以 faiss 原生格式保存索引，加载时可直接内存映射；先写临时文件再替换
+            faiss_path = f"{index_path}.faiss"
+            faiss.write_index(index, f"{faiss_path}.tmp")
+            os.replace(f"{faiss_path}.tmp", faiss_path)
         except Exception as e:
             logger.error(f"保存索引失败: {str(e)}")
             raise
-        # # 保存索引和元数据
-        # write_index(index, f"{config.IDIOM_INDEX_PATH}.faiss")
-        # torch.save(metadata, f"{config.IDIOM_INDEX_PATH}.meta")
-        
-        # logger.info(f"成语向量索引创建完成，共 {len(metadata)} 条记录")
-    
-    def load_index(self, index_path: str):
-        """加载向量索引"""
-        try:
-            index = read_index(f"{index_path}.faiss")
-            metadata = torch.load(f"{index_path}.meta")
-            return index, metadata
-        except Exception as e:
-            logger.error(f"加载索引失败: {str(e)}")
-            raise
-        
-    def load_index(self, index_path: str):
+
+    def _build_sharded(self, data_path: str, index_path: str, process_chunk, desc: str,
+                       rebuild: bool = False, shards: List[int] = None) -> int:
+        """按 NUM_SHARDS/SHARD_BY 构建单个索引或分片索引，shards 指定只更新其中几个分片，返回记录数"""
+        num_shards, shard_by = rag_config.NUM_SHARDS, rag_config.SHARD_BY
+        manifest = read_manifest(index_path)
+        if num_shards <= 1:
+            if manifest is not None:
+                os.remove(manifest_path(index_path))
+                logger.info(f"{index_path} 改为不分片")
+            return self._build_index(data_path, index_path, process_chunk, desc, rebuild)[1]
+
+        if shard_by not in SHARD_METHODS:
+            raise ValueError(f"不支持的分片方式: {shard_by}")
+        if manifest != {"num_shards": num_shards, "shard_by": shard_by}:
+            # 分片方式变化后记录会换分片，所有分片都要全量重建
+            if manifest is not None:
+                logger.info(f"{index_path} 分片方式由 {manifest} 改为 {num_shards} 片/{shard_by}，全量重建")
+                for shard in range(num_shards, manifest["num_shards"]):
+                    for suffix in (".faiss", ".sqlite"):
+                        stale_path = shard_path(index_path, shard) + suffix
+                        if os.path.exists(stale_path):
+                            os.remove(stale_path)
+            rebuild, shards = True, None
+        count = 0
+        for shard in (shards if shards is not None else range(num_shards)):
+            if not 0 <= shard < num_shards:
+                raise ValueError(f"分片编号 {shard} 超出范围（共 {num_shards} 片）")
+            shard_chunk = functools.partial(process_shard_chunk, process_chunk, shard, num_shards, shard_by)
+            count += self._build_index(data_path, shard_path(index_path, shard), shard_chunk,
+                                       f"{desc}（分片 {shard}）", rebuild)[1]
+        # 所有分片构建完成后才写入清单，中途中断时仍按原布局加载
+        write_manifest(index_path, num_shards, shard_by)
+        return count
+
+    def create_poetry_index(self, rebuild: bool = False, shards: List[int] = None) -> None:
+        """创建（或增量更新）诗词向量索引"""
+        logger.info(f"开始构建诗词向量索引（{rag_config.INDEX_TYPE}/{rag_config.VECTOR_ENCODING}）...")
+        # 显式传入去重开关，预处理进程与主进程使用相同的配置
+        process_chunk = functools.partial(self._process_poetry_chunk, dedup=rag_config.DEDUP_LINES)
+        count = self._build_sharded(rag_config.POETRY_DATA_PATH, rag_config.POETRY_INDEX_PATH,
+                                    process_chunk, "处理诗词数据块", rebuild, shards)
+        logger.info(f"诗词向量索引构建完成，共 {count} 条记录")
+
+    def create_idiom_index(self, rebuild: bool = False, shards: List[int] = None) -> None:
+        """创建（或增量更新）成语向量索引"""
+        logger.info(f"开始构建成语向量索引（{rag_config.INDEX_TYPE}/{rag_config.VECTOR_ENCODING}）...")
+        count = self._build_sharded(rag_config.IDIOM_DATA_PATH, rag_config.IDIOM_INDEX_PATH,
+                                    self._process_idiom_chunk, "处理成语数据块", rebuild, shards)
+        logger.info(f"成语向量索引构建完成，共 {count} 条记录")
     
+    @staticmethod
+    def load_index(index_path: str, mmap: bool = True):
+        """加载向量索引及元数据（元数据按需查询，不整体读入内存）"""
         try:
-           
-            # 加载索引
-            with open(f"{index_path}.pkl", "rb") as f:
-                index = pickle.load(f)
-            
+            manifest = read_manifest(index_path)
+            if manifest is not None:
+                # 分片索引：各分片分别加载，检索时并行查询
+                paths = [shard_path(index_path, i) for i in range(manifest["num_shards"])]
+                index = ShardedIndex([load_faiss_index(path, mmap=mmap) for path in paths])
+                metadata = ShardedMetadata([open_metadata(path) for path in paths], manifest["shard_by"])
+                return index, metadata
+
+            index = load_faiss_index(index_path, mmap=mmap)
+
             # 加载元数据
-            metadata = torch.load(f"{index_path}.meta")
+            metadata = open_metadata(index_path)
             return index, metadata
         except Exception as e:
             logger.error(f"加载索引失败: {str(e)}")
             raise
-    
\ No newline at end of file
+
+    @staticmethod
+    def migrate_legacy_index(index_path: str) -> bool:
+        """将旧版 pickle 索引与 .meta 元数据转换为 faiss 原生格式与 SQLite，返回是否进行了转换"""
+        migrated = False
+        pkl_path, faiss_path = f"{index_path}.pkl", f"{index_path}.faiss"
+        if not os.path.exists(faiss_path) and os.path.exists(pkl_path):
+            import faiss
+            with open(pkl_path, "rb") as f:
+                index = pickle.load(f)
+            faiss.write_index(index, faiss_path)
+            logger.info(f"已将 {pkl_path} 转换为 {faiss_path}，确认无误后可删除旧文件")
+            migrated = True
+        if migrate_legacy_metadata(index_path):
+            logger.info(f"已将 {index_path}.meta 转换为 {metadata_path(index_path)}")
+            migrated = True
+        return migrated
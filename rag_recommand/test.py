@@ -28,11 +28,17 @@
 #         print(f"    相似度: {rec['score']}")
 #     print("-" * 50)
 from rag_recommand import query_rag_system 
+from src.rag_client import RagClient
 
-def get_recommendations(text, top_k=5):
+def get_recommendations(text, top_k=5, use_server=True):
     """
     获取诗词成语推荐结果的包装函数
+    常驻服务（python rag_recommand.py --serve）在运行时直接请求服务，否则在本进程内加载模型查询
     """
+    if use_server:
+        client = RagClient()
+        if client.available():
+            return client.recommend_summary(text, top_k=top_k)
     results = query_rag_system(text, top_k=top_k)
     return results
 
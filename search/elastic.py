@@ -5,8 +5,18 @@ import warnings
 import time
 from tqdm import tqdm
 import  hashlib
+try:
+    from search.metrics import STAGE_LATENCY, ES_ROUND_TRIPS, ES_TOOK
+except ImportError:  # 作为脚本运行（python search/elastic.py）时 search 不在 sys.path 上
+    from metrics import STAGE_LATENCY, ES_ROUND_TRIPS, ES_TOOK
 
 class Esearch(Elasticsearch):
+    # 索引中可供检索接口返回的字段
+    SOURCE_FIELDS = ["类型", "古诗名", "作者", "朝代", "内容", "译文",
+                     "作者简介", "鉴赏", "赏析", "简析", "创作背景", "注释"]
+    # 游标分页的排序：先按得分，再以唯一的古诗名打破平分
+    PAGE_SORT = [{"_score": "desc"}, {"古诗名": "asc"}]
+
     def __init__(self,host="http://localhost:9200",index_name="poetry_index") -> None:
         # 忽略 Elasticsearch 警告
         warnings.simplefilter('ignore', category=ElasticsearchWarning)
@@ -17,10 +27,23 @@ class Esearch(Elasticsearch):
         #     max_retries=10,  
         #     retry_on_timeout=True  # 超时重试
         # )
+        self.host = host
         self.client = Elasticsearch([host], timeout=30, max_retries=10, retry_on_timeout=True)
+        self._probe = None  # ping 专用客户端，首次探测时创建后复用
 
         self.index_name = index_name  # 索引名称
 
+    def ping(self, timeout=1):
+        """快速探测 Elasticsearch 是否可用
+        使用不重试的短超时客户端，避免启动阶段被 max_retries 长时间阻塞
+        """
+        if self._probe is None:
+            self._probe = Elasticsearch([self.host], timeout=timeout, max_retries=0)
+        try:
+            return self._probe.ping()
+        except Exception:
+            return False
+
     # **1. 创建索引**
     def create_index(self):
         index_config = {
@@ -53,7 +76,9 @@ class Esearch(Elasticsearch):
             }
         }
         
+        ES_ROUND_TRIPS.inc(op="index_exists")
         if not self.client.indices.exists(index=self.index_name):
+            ES_ROUND_TRIPS.inc(op="index_create")
             self.client.indices.create(index=self.index_name, body=index_config)
             print(f"索引 {self.index_name} 创建成功")
         else:
@@ -120,6 +145,7 @@ class Esearch(Elasticsearch):
             print(f"有{len(long_titles)}条数据古诗名超长，已存入 long_titles.json备份")
 
     def index_exists(self,):
+        ES_ROUND_TRIPS.inc(op="index_exists")
         return self.client.indices.exists(index=self.index_name)
 
 
@@ -130,20 +156,76 @@ class Esearch(Elasticsearch):
             return None
 
         query_body = {
-            "query": {
-                "match": {
-                    "内容": query  # 进行内容字段的模糊匹配
-                }
-            },
+            "query": self._match_query(query),
             "size": 10
         }
         
         # 搜索
-        response = self.client.search(index=self.index_name, body=query_body)
+        response = self._timed_search(query_body)
         
         print(f"==== 搜索 '{query}' 相关的诗词 ====")
 
         return response['hits']['hits']
+
+    def _timed_search(self, query_body):
+        """执行搜索并记录往返耗时与服务端耗时"""
+        ES_ROUND_TRIPS.inc(op="search")
+        with STAGE_LATENCY.time(stage="es_query"):
+            response = self.client.search(index=self.index_name, body=query_body)
+        if 'took' in response:
+            ES_TOOK.observe(response['took'] / 1000)
+        return response
+
+    def _match_query(self, query):
+        return {
+            "match": {
+                "内容": query  # 进行内容字段的模糊匹配
+            }
+        }
+
+    def search_poetry_page(self, query, size=10, search_after=None, fields=None):
+        """基于 search_after 游标的分页搜索
+        返回 (hits, next_after)，next_after 为 None 表示没有下一页
+        深翻页不使用 from 偏移，避免 Elasticsearch 每页重新收集前面所有结果
+        """
+        query_body = {
+            "query": self._match_query(query),
+            "size": size,
+            "sort": self.PAGE_SORT,
+            "track_total_hits": False  # 不统计总数，减少分页开销
+        }
+        if search_after:
+            query_body["search_after"] = search_after
+        if fields is not None:
+            query_body["_source"] = fields
+
+        response = self._timed_search(query_body)
+        hits = response['hits']['hits']
+        next_after = hits[-1]['sort'] if len(hits) == size else None
+        return hits, next_after
+
+    def msearch_poetry(self, queries, size=3, fields=None):
+        """多条查询合并为一次 _msearch 往返，返回与 queries 对应的 hits 列表"""
+        if not queries:
+            return []
+        body = []
+        for query in queries:
+            query_body = {"query": self._match_query(query), "size": size,
+                          "track_total_hits": False}
+            if fields is not None:
+                query_body["_source"] = fields
+            body.extend([{}, query_body])
+
+        ES_ROUND_TRIPS.inc(op="msearch")
+        with STAGE_LATENCY.time(stage="es_query"):
+            response = self.client.msearch(index=self.index_name, body=body)
+        results = []
+        for item in response['responses']:
+            if 'took' in item:
+                ES_TOOK.observe(item['took'] / 1000)
+            results.append(item['hits']['hits'] if 'hits' in item else [])
+        return results
+
     # 删除索引
     def delete_index(self,index_name):
         if self.client.indices.exists(index=self.index_name):
@@ -1,6 +1,10 @@
 import json
 import re
 from fuzzywuzzy import fuzz, process
+try:
+    from search.metrics import timed
+except ImportError:  # 作为脚本运行（python search/match_poem.py）时 search 不在 sys.path 上
+    from metrics import timed
 
 class PoemSearcher:
     def __init__(self, json_path):
@@ -66,6 +70,7 @@ class PoemSearcher:
         
         return round(total_score, 1)
 
+    @timed("local_match")
     def search(self, query, top_n=5, min_score=60):
         """改进版搜索算法"""
         query_clean = self._clean_text(query)
@@ -0,0 +1,68 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# app.py 以 FinalWeb 为工作目录运行，rag_recommand 的模块以 rag_recommand 为根导入
+for path in (ROOT, os.path.join(ROOT, "FinalWeb"), os.path.join(ROOT, "rag_recommand")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import rag_config  # noqa: E402
+
+# src 下的模块在导入时就向 LOG_DIR 写日志文件
+os.makedirs(rag_config.LOG_DIR, exist_ok=True)
+
+import zlib  # noqa: E402
+
+import numpy as np  # noqa: E402
+import pytest  # noqa: E402
+
+
+class FakeModel:
+    """按文本确定性生成单位向量的编码器（相同文本相似度为 1，不同文本近似正交），记录每次编码的文本"""
+
+    dimension = 32
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, **kwargs):
+        self.encoded.extend(texts)
+        vectors = np.stack([np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(self.dimension)
+                            for text in texts]).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    """构建索引与编码查询都使用 FakeModel，不加载真实模型"""
+    from src import vector_store, embedding_cache
+    model = FakeModel()
+    for module in (vector_store, embedding_cache):
+        monkeypatch.setattr(module, "get_model", lambda *args, **kwargs: model)
+    return model
+
+
+@pytest.fixture
+def rag_data(tmp_path, monkeypatch):
+    """数据与索引路径指向临时目录：精确索引、float32、诗句去重、不分片、在解析线程内预处理"""
+    settings = {
+        "POETRY_DATA_PATH": str(tmp_path / "poem.json"),
+        "IDIOM_DATA_PATH": str(tmp_path / "chengyu.json"),
+        "POETRY_INDEX_PATH": str(tmp_path / "index" / "poetry_index"),
+        "IDIOM_INDEX_PATH": str(tmp_path / "index" / "idiom_index"),
+        "BUILD_WORKERS": 0,
+        "NUM_SHARDS": 1,
+        "SHARD_BY": "hash",
+        "INDEX_TYPE": "flat",
+        "VECTOR_ENCODING": "float32",
+        "PCA_DIM": None,
+        "DEDUP_LINES": True,
+        "EMBEDDING_CACHE_DIR": None,
+    }
+    for name, value in settings.items():
+        monkeypatch.setattr(rag_config, name, value)
+    return tmp_path
@@ -0,0 +1,137 @@
+import json
+import os
+
+import pytest
+
+import rag_config
+from src import corpus
+from src.corpus import CorpusFile, offsets_path
+
+ARTICLES = [
+    {"url": "http://news/1", "title": "春", "text": "春眠不觉晓，处处闻啼鸟。" * 6},
+    {"url": "http://news/2", "title": "夏", "text": "接天莲叶无穷碧，映日荷花别样红。" * 4},
+    {"id": "a3", "url": "http://news/3", "title": "秋", "text": "一篇短文"},
+]
+
+
+def write_corpus(path, articles, mode="w", indent=None):
+    # indent 不为 None 时与爬虫输出一样，每篇是跨多行的 JSON 对象
+    with open(path, mode, encoding="utf-8") as f:
+        for article in articles:
+            f.write(json.dumps(article, ensure_ascii=False, indent=indent) + "\n")
+
+
+@pytest.fixture
+def corpus_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag_config, "CORPUS_INDEX_DIR", str(tmp_path / "index"))
+    path = tmp_path / "news.jsonl"
+    write_corpus(path, ARTICLES, indent=2)
+    return str(path)
+
+
+@pytest.fixture
+def count_builds(monkeypatch):
+    """统计偏移索引的构建次数（每次构建都要顺序扫描一遍语料）"""
+    builds = []
+    iter_records = corpus.iter_records
+
+    def counting(path, start=0):
+        builds.append(path)
+        return iter_records(path, start)
+
+    monkeypatch.setattr(corpus, "iter_records", counting)
+    return builds
+
+
+def test_offsets_match_record_bytes(corpus_path):
+    with CorpusFile(corpus_path) as cf, open(corpus_path, "rb") as f:
+        data = f.read()
+        assert len(cf) == 3
+        assert cf.ids == ["http://news/1", "http://news/2", "a3"]
+        for row, article in enumerate(ARTICLES):
+            assert json.loads(data[cf.starts[row]:cf.ends[row]]) == article
+            assert cf.read(row) == article
+        assert cf.get("a3") == ARTICLES[2]
+        assert cf.get("http://news/404") is None
+
+
+def test_short_text_has_no_fingerprint(corpus_path):
+    with CorpusFile(corpus_path) as cf:
+        assert cf.fingerprints[0] is not None
+        assert cf.fingerprints[2] is None
+
+
+def test_sidecar_is_reused(corpus_path, count_builds):
+    CorpusFile(corpus_path).close()
+    assert os.path.exists(offsets_path(corpus_path))
+    with CorpusFile(corpus_path) as cf:
+        assert cf.get("http://news/2") == ARTICLES[1]
+    assert len(count_builds) == 1
+
+
+def test_append_rebuilds_and_finds_new_record(corpus_path, count_builds):
+    CorpusFile(corpus_path).close()
+    added = {"url": "http://news/4", "title": "冬", "text": "千山鸟飞绝，万径人踪灭。" * 5}
+    write_corpus(corpus_path, [added], mode="a")
+    with CorpusFile(corpus_path) as cf:
+        assert len(cf) == 4
+        assert cf.get("http://news/4") == added
+        assert cf.get("http://news/1") == ARTICLES[0]
+    assert len(count_builds) == 2
+
+
+def test_rewrite_with_same_size_rebuilds(corpus_path, count_builds):
+    CorpusFile(corpus_path).close()
+    stat = os.stat(corpus_path)
+    with open(corpus_path, "r+b") as f:
+        data = f.read().replace("http://news/2".encode(), "http://news/9".encode())
+        f.seek(0)
+        f.write(data)
+    # 修改时间精度不足时同一时刻的两次写入可能相同，显式推后
+    os.utime(corpus_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert os.stat(corpus_path).st_size == stat.st_size
+    with CorpusFile(corpus_path) as cf:
+        assert cf.row_of("http://news/9") == 1
+        assert cf.row_of("http://news/2") is None
+    assert len(count_builds) == 2
+
+
+def test_fingerprint_config_change_rebuilds(corpus_path, count_builds, monkeypatch):
+    with CorpusFile(corpus_path) as cf:
+        before = list(cf.fingerprints)
+    monkeypatch.setattr(rag_config, "SIMHASH_MIN_CHARS", 1)
+    with CorpusFile(corpus_path) as cf:
+        assert cf.fingerprints[2] is not None
+        assert cf.fingerprints[:2] == before[:2]
+    assert len(count_builds) == 2
+    monkeypatch.setattr(rag_config, "SIMHASH_NGRAM", 2)
+    with CorpusFile(corpus_path) as cf:
+        assert cf.fingerprints[0] != before[0]
+    assert len(count_builds) == 3
+
+
+def test_same_name_in_other_directory_has_own_sidecar(corpus_path, tmp_path):
+    other_dir = tmp_path / "other"
+    other_dir.mkdir()
+    other = str(other_dir / "news.jsonl")
+    write_corpus(other, ARTICLES[:1])
+    assert offsets_path(other) != offsets_path(corpus_path)
+    with CorpusFile(corpus_path) as a, CorpusFile(other) as b:
+        assert (len(a), len(b)) == (3, 1)
+
+
+def test_empty_file(corpus_path, tmp_path):
+    empty = tmp_path / "empty.jsonl"
+    empty.write_bytes(b"")
+    with CorpusFile(str(empty)) as cf:
+        assert len(cf) == 0
+        assert cf.sample(5) == []
+
+
+@pytest.mark.parametrize("num_shards", [1, 2, 3, 5])
+def test_shard_rows_cover_every_row_once(corpus_path, num_shards):
+    with CorpusFile(corpus_path) as cf:
+        rows = [row for shard in range(num_shards) for row in cf.shard_rows(shard, num_shards)]
+        assert rows == list(range(len(cf)))
+        with pytest.raises(ValueError):
+            cf.shard_rows(num_shards, num_shards)
@@ -0,0 +1,164 @@
+import json
+import random
+
+import pytest
+
+import rag_config
+from src import corpus_scan
+from src.corpus_scan import CorpusScanner
+
+CHARS = "床前明月光疑是地上霜举头望低思故乡春眠不觉晓处闻啼鸟夜来风雨声花落知多少白日依山尽黄河入海流"
+
+
+def article_text(seed):
+    rng = random.Random(seed)
+    return "".join(rng.choice(CHARS) for _ in range(120))
+
+
+# d1、d3 与 d0 正文相同（转载），d3 只多了一个字：扫描时只检索 d0，d1、d3 写为指向 d0 的链接
+ARTICLES = [
+    {"url": "u0", "title": "t0", "text": article_text(0)},
+    {"url": "u1", "title": "t1", "text": article_text(0)},
+    {"url": "u2", "title": "t2", "text": article_text(2)},
+    {"url": "u3", "title": "t3", "text": article_text(0) + "。"},
+    {"url": "u4", "title": "t4", "text": article_text(4)},
+]
+
+
+class StubScan:
+    """代替工作进程中的检索：fail 中的文章所在批次抛出异常，interrupt_at 为第几次调用时模拟中断"""
+
+    def __init__(self, fail=(), interrupt_at=None):
+        self.fail = set(fail)
+        self.interrupt_at = interrupt_at
+        self.scanned = []
+
+    def __call__(self, articles, top_k):
+        if self.interrupt_at is not None and len(self.scanned) >= self.interrupt_at:
+            raise KeyboardInterrupt
+        ids = [article_id for _, _, _, article_id in articles]
+        if self.fail & set(ids):
+            raise RuntimeError("retrieval failed")
+        self.scanned.extend(ids)
+        return [{"file": path, "offset": start, "length": end - start, "id": article_id,
+                 "chunks": 1, "findings": [], "summary": {}}
+                for path, start, end, article_id in articles]
+
+
+@pytest.fixture
+def corpus_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag_config, "CORPUS_INDEX_DIR", str(tmp_path / "index"))
+    monkeypatch.setattr(corpus_scan, "_init_worker", lambda settings: None)
+    path = tmp_path / "news.jsonl"
+    with open(path, "w", encoding="utf-8") as f:
+        for article in ARTICLES:
+            f.write(json.dumps(article, ensure_ascii=False, indent=2) + "\n")
+    return str(path)
+
+
+def scan(corpus_path, output, monkeypatch, **stub):
+    stub = StubScan(**stub)
+    monkeypatch.setattr(corpus_scan, "scan_articles", stub)
+    stats = CorpusScanner(str(output), workers=0, batch_articles=1).run([corpus_path])
+    return stub, stats
+
+
+def read_output(output):
+    with open(output, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def assert_links_follow_canonical(records):
+    """每条重复链接之前都已写入其代表文章的成功结果"""
+    written = set()
+    for record in records:
+        if "duplicate_of" in record:
+            assert (record["duplicate_of"]["file"], record["duplicate_of"]["offset"]) in written
+        elif "error" not in record:
+            written.add((record["file"], record["offset"]))
+
+
+def test_normal_run(corpus_path, tmp_path, monkeypatch):
+    output = tmp_path / "out" / "scan.jsonl"
+    stub, stats = scan(corpus_path, output, monkeypatch)
+    assert stub.scanned == ["u0", "u2", "u4"]
+    assert (stats["articles"], stats["duplicates"], stats["failed"], stats["skipped"]) == (3, 2, 0, 0)
+    records = read_output(output)
+    assert_links_follow_canonical(records)
+    links = {r["id"]: r["duplicate_of"]["id"] for r in records if "duplicate_of" in r}
+    assert links == {"u1": "u0", "u3": "u0"}
+
+    # 全部完成后再次运行不再检索，也不重复写入
+    stub, stats = scan(corpus_path, output, monkeypatch)
+    assert stub.scanned == [] and stats["skipped"] == 5
+    assert len(read_output(output)) == 5
+
+
+def test_keep_duplicates(corpus_path, tmp_path, monkeypatch):
+    stub = StubScan()
+    monkeypatch.setattr(corpus_scan, "scan_articles", stub)
+    CorpusScanner(str(tmp_path / "scan.jsonl"), workers=0, skip_duplicates=False).run([corpus_path])
+    assert sorted(stub.scanned) == ["u0", "u1", "u2", "u3", "u4"]
+
+
+def test_resume_after_torn_results_file(corpus_path, tmp_path, monkeypatch):
+    output = tmp_path / "scan.jsonl"
+    scan(corpus_path, output, monkeypatch)
+    with open(output, "rb") as f:
+        lines = f.readlines()
+    last = json.loads(lines[-1])
+    # 中断时最后一行只写了一半
+    with open(output, "wb") as f:
+        f.writelines(lines[:-1])
+        f.write(lines[-1][:len(lines[-1]) // 2])
+
+    stub, stats = scan(corpus_path, output, monkeypatch)
+    records = read_output(output)  # 半行已截掉，每行都是完整的 JSON
+    assert len(records) == 5
+    assert records[-1] == last
+    assert stub.scanned == [last["id"]] == ["u4"]
+    assert_links_follow_canonical(records)
+
+
+def test_failed_canonical_reemits_links(corpus_path, tmp_path, monkeypatch):
+    output = tmp_path / "scan.jsonl"
+    stub, stats = scan(corpus_path, output, monkeypatch, fail={"u0"})
+    records = read_output(output)
+    assert [r["id"] for r in records if "error" in r] == ["u0"]
+    # 代表文章失败，重复链接不落盘
+    assert not any("duplicate_of" in r for r in records)
+    assert (stats["failed"], stats["duplicates"]) == (1, 0)
+
+    stub, stats = scan(corpus_path, output, monkeypatch)
+    assert stub.scanned == ["u0"]
+    assert stats["duplicates"] == 2
+    records = read_output(output)
+    assert_links_follow_canonical(records)
+    assert sorted(r["id"] for r in records if "duplicate_of" in r) == ["u1", "u3"]
+
+
+def test_interrupted_before_canonical(corpus_path, tmp_path, monkeypatch):
+    output = tmp_path / "scan.jsonl"
+    with pytest.raises(KeyboardInterrupt):
+        scan(corpus_path, output, monkeypatch, interrupt_at=0)
+    assert read_output(output) == []
+
+    stub, stats = scan(corpus_path, output, monkeypatch)
+    assert stub.scanned == ["u0", "u2", "u4"] and stats["duplicates"] == 2
+
+
+def test_orphan_link_is_not_counted_done(corpus_path, tmp_path, monkeypatch):
+    output = tmp_path / "scan.jsonl"
+    scan(corpus_path, output, monkeypatch)
+    records = read_output(output)
+    # 只留下一条链接，代表文章的结果丢失（例如旧版本先写链接后中断）
+    orphan = next(r for r in records if "duplicate_of" in r)
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(json.dumps(orphan, ensure_ascii=False) + "\n")
+    assert CorpusScanner(str(output), workers=0).completed() == set()
+
+    stub, stats = scan(corpus_path, output, monkeypatch)
+    assert stub.scanned == ["u0", "u2", "u4"]
+    records = read_output(output)[1:]
+    assert_links_follow_canonical(records)
+    assert sorted(r["id"] for r in records if "duplicate_of" in r) == ["u1", "u3"]
@@ -0,0 +1,63 @@
+import pytest
+
+from src import evaluator as evaluator_module
+from src.evaluator import Evaluator
+
+
+class FakeRetriever:
+    def __init__(self, model_name="fake", device=None, use_cache=True):
+        self.model_name = model_name
+        self.device = device
+        self.use_cache = use_cache
+        self.encoder = None
+        self.calls = []
+
+    def retrieve(self, query):
+        self.calls.append([query])
+
+    def retrieve_batch(self, queries, top_k):
+        self.calls.append(list(queries))
+        return [[] for _ in queries]
+
+
+CASES = [{"text": "床前明月光。"}, {"text": "春眠不觉晓。"}]
+
+
+@pytest.fixture
+def created(monkeypatch):
+    """记录 Evaluator 自行创建的性能测试检索器"""
+    retrievers = []
+
+    def factory(*args, **kwargs):
+        retriever = FakeRetriever(*args, **kwargs)
+        retrievers.append(retriever)
+        return retriever
+
+    monkeypatch.setattr(evaluator_module, "Retriever", factory)
+    return retrievers
+
+
+def test_performance_uses_uncached_retriever_by_default(created):
+    cached = FakeRetriever(use_cache=True)
+    evaluator = Evaluator(cached)
+    performance = evaluator.measure_performance(CASES, rounds=2)
+    assert performance["chunks"] == 2
+    assert len(created) == 1 and created[0].use_cache is False
+    # 预热 + 2 轮逐案例 + 1 次整批
+    assert len(created[0].calls) == 1 + 2 * 2 + 1
+    assert cached.calls == []
+
+
+def test_uncached_retriever_is_reused(created):
+    uncached = FakeRetriever(use_cache=False)
+    Evaluator(uncached).measure_performance(CASES)
+    assert created == []
+    assert uncached.calls
+
+
+def test_explicit_cached_performance(created):
+    cached = FakeRetriever(use_cache=True)
+    evaluator = Evaluator(cached, perf_retriever=cached)
+    evaluator.measure_performance(CASES)
+    assert created == []
+    assert evaluator.perf_retriever.use_cache is True
@@ -0,0 +1,142 @@
+import threading
+
+import numpy as np
+import pytest
+
+import rag_config
+from src.retriever import Retriever
+
+
+class StubLexical:
+    """按查询返回预先给定的词法命中：{查询: [(向量 id, 覆盖率, 字符数), ...]}"""
+
+    def __init__(self, hits):
+        self.hits = hits
+
+    def search(self, queries, k):
+        rows = []
+        for query in queries:
+            hits = self.hits.get(query, [])[:k]
+            rows.append((np.array([h[0] for h in hits], dtype=np.int64),
+                         np.ones(len(hits), dtype=np.float32),
+                         np.array([h[1] for h in hits], dtype=np.float32),
+                         np.array([h[2] for h in hits], dtype=np.int32)))
+        return rows
+
+
+class StubMetadata:
+    def __init__(self, items):
+        self.items = items
+
+    def get_many(self, rows):
+        return [self.items.get(row) for row in rows]
+
+
+def line(vid, text):
+    return {"type": "poetry_line", "id": f"p-{vid}", "line": text, "line_index": 0,
+            "title": "", "author": "", "dynasty": ""}
+
+
+def make_retriever(poetry_lexical, idiom_lexical, dense):
+    """不加载索引与模型的检索器：词法与向量两路都由桩给出"""
+    retriever = Retriever.__new__(Retriever)
+    retriever._line_copies = 1
+    retriever._lexical = {"poetry": StubLexical(poetry_lexical), "idiom": StubLexical(idiom_lexical)}
+    retriever._lexical_lock = threading.Lock()
+    retriever._stats_lock = threading.Lock()
+    retriever.short_circuits = 0
+    retriever.poetry_metadata = StubMetadata({vid: line(vid, f"诗句{vid}") for vid in range(1, 10)})
+    retriever.idiom_metadata = StubMetadata({vid: {"type": "idiom", "idiom": f"成语{vid}"} for vid in range(100, 110)})
+    retriever.dense_queries = []
+
+    def dense_hits(queries, top_k, score_threshold):
+        retriever.dense_queries.append(list(queries))
+        return ([[(vid, {"score": score}) for vid, score in dense.get(q, {}).get("poetry", [])] for q in queries],
+                [[(vid, {"score": score}) for vid, score in dense.get(q, {}).get("idiom", [])] for q in queries])
+
+    retriever._dense_hits = dense_hits
+    return retriever
+
+
+@pytest.fixture(autouse=True)
+def hybrid_config(monkeypatch):
+    monkeypatch.setattr(rag_config, "RRF_K", 60)
+    monkeypatch.setattr(rag_config, "HYBRID_SHORT_CIRCUIT", True)
+    monkeypatch.setattr(rag_config, "LEXICAL_CONFIDENCE", 1.0)
+    monkeypatch.setattr(rag_config, "LEXICAL_CONFIDENT_MIN_CHARS", 4)
+
+
+def test_rrf_fusion_ranks_and_match_labels():
+    retriever = make_retriever(
+        {"q": [(2, 0.6, 5), (3, 0.5, 5)]}, {},
+        {"q": {"poetry": [(1, 0.9), (2, 0.8)], "idiom": [(100, 0.7)]}})
+    results = retriever.retrieve_batch(["q"], top_k=10, mode="hybrid")[0]
+    by_id = {item["vector_id"]: item for item in results}
+    assert by_id[2]["rrf_score"] == pytest.approx(1 / 62 + 1 / 61)
+    assert by_id[1]["rrf_score"] == pytest.approx(1 / 61)
+    assert by_id[3]["rrf_score"] == pytest.approx(1 / 62)
+    assert [by_id[v]["match"] for v in (1, 2, 3)] == ["dense", "both", "lexical"]
+    # 仅词法命中时 score 为覆盖率；两路都命中时保留向量相似度并附 lexical_score
+    assert by_id[3]["score"] == pytest.approx(0.5)
+    assert by_id[2]["score"] == pytest.approx(0.8) and by_id[2]["lexical_score"] == pytest.approx(0.6)
+    # 两个索引的结果统一按 rrf_score 排序，同分时按 score
+    assert [item["vector_id"] for item in results] == [2, 1, 100, 3]
+
+
+def test_top_k_truncates_fused_results():
+    retriever = make_retriever({"q": [(v, 0.6, 5) for v in range(1, 8)]}, {}, {})
+    assert len(retriever.retrieve_batch(["q"], top_k=3, mode="hybrid")[0]) == 3
+
+
+def test_confident_lexical_hit_skips_dense():
+    retriever = make_retriever({"引用": [(4, 1.0, 5)], "改写": [(5, 0.6, 5)]}, {},
+                               {"改写": {"poetry": [(6, 0.9)]}})
+    results = retriever.retrieve_batch(["引用", "改写"], top_k=5, mode="hybrid")
+    # 只有没有可信词法命中的查询做向量检索
+    assert retriever.dense_queries == [["改写"]]
+    assert retriever.short_circuits == 1
+    assert [item["vector_id"] for item in results[0]] == [4]
+    assert {item["vector_id"] for item in results[1]} == {5, 6}
+
+
+def test_short_hit_is_not_confident():
+    # 覆盖率为 1 但句子短于 LEXICAL_CONFIDENT_MIN_CHARS，仍做向量检索
+    retriever = make_retriever({"q": [(4, 1.0, 3)]}, {}, {})
+    retriever.retrieve_batch(["q"], top_k=5, mode="hybrid")
+    assert retriever.dense_queries == [["q"]]
+    assert retriever.short_circuits == 0
+
+
+def test_confident_idiom_hit_also_short_circuits():
+    retriever = make_retriever({}, {"q": [(101, 1.0, 4)]}, {})
+    assert [item["vector_id"] for item in retriever.retrieve_batch(["q"], top_k=5, mode="hybrid")[0]] == [101]
+    assert retriever.dense_queries == []
+
+
+def test_short_circuit_disabled(monkeypatch):
+    monkeypatch.setattr(rag_config, "HYBRID_SHORT_CIRCUIT", False)
+    retriever = make_retriever({"q": [(4, 1.0, 5)]}, {}, {"q": {"poetry": [(4, 0.95)]}})
+    results = retriever.retrieve_batch(["q"], top_k=5, mode="hybrid")[0]
+    assert retriever.dense_queries == [["q"]]
+    assert results[0]["match"] == "both"
+
+
+def test_short_circuit_counter_is_thread_safe():
+    retriever = make_retriever({"q": [(4, 1.0, 5)]}, {}, {})
+
+    def worker():
+        for _ in range(200):
+            retriever.retrieve_batch(["q", "q"], top_k=1, mode="hybrid")
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert retriever.short_circuits == 8 * 200 * 2
+
+
+def test_unknown_mode_rejected():
+    retriever = make_retriever({}, {}, {})
+    with pytest.raises(ValueError):
+        retriever.retrieve_batch(["q"], mode="sparse")
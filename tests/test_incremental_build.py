@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+import rag_config
+from src.vector_store import VectorStore
+
+POEMS = [
+    {"古诗名": "静夜思", "作者": "李白", "朝代": "唐", "内容": "床前明月光，疑是地上霜。举头望明月，低头思故乡。"},
+    {"古诗名": "春晓", "作者": "孟浩然", "朝代": "唐", "内容": "春眠不觉晓，处处闻啼鸟。夜来风雨声，花落知多少。"},
+    {"古诗名": "登鹳雀楼", "作者": "王之涣", "朝代": "唐", "内容": "白日依山尽，黄河入海流。欲穷千里目，更上一层楼。"},
+]
+
+
+@pytest.fixture
+def store(rag_data, fake_model):
+    store = VectorStore(model_name="fake-model")
+    store.fake_model = fake_model
+    return store
+
+
+def build(store, poems):
+    with open(rag_config.POETRY_DATA_PATH, "w", encoding="utf-8") as f:
+        json.dump(poems, f, ensure_ascii=False)
+    store.fake_model.encoded.clear()
+    store.create_poetry_index()
+    return list(store.fake_model.encoded)
+
+
+def index_size():
+    index, metadata = VectorStore.load_index(rag_config.POETRY_INDEX_PATH, mmap=False)
+    return index.ntotal, len(metadata)
+
+
+def test_first_build_encodes_every_line(store):
+    encoded = build(store, POEMS)
+    assert sorted(encoded) == sorted(["床前明月光", "疑是地上霜", "举头望明月", "低头思故乡",
+                                      "春眠不觉晓", "处处闻啼鸟", "夜来风雨声", "花落知多少",
+                                      "白日依山尽", "黄河入海流", "欲穷千里目", "更上一层楼"])
+    assert index_size() == (12, 12)
+
+
+def test_unchanged_rebuild_encodes_nothing(store):
+    build(store, POEMS)
+    assert build(store, POEMS) == []
+    assert index_size() == (12, 12)
+
+
+def test_added_poem_encodes_only_new_lines(store):
+    build(store, POEMS)
+    added = {"古诗名": "相思", "作者": "王维", "朝代": "唐",
+             "内容": "红豆生南国，春来发几枝。愿君多采撷，此物最相思。"}
+    assert sorted(build(store, POEMS + [added])) == sorted(["红豆生南国", "春来发几枝", "愿君多采撷", "此物最相思"])
+    assert index_size() == (16, 16)
+
+
+def test_changed_poem_encodes_only_changed_line(store):
+    build(store, POEMS)
+    changed = dict(POEMS[0], 内容="床前看月光，疑是地上霜。举头望山月，低头思故乡。")
+    assert sorted(build(store, [changed] + POEMS[1:])) == ["举头望山月", "床前看月光"]
+    # 旧句已不在数据中，从索引中删除
+    assert index_size() == (12, 12)
+
+
+def test_duplicate_line_is_encoded_once(store):
+    copy = dict(POEMS[0], 古诗名="静夜思（又一版本）", 作者="佚名")
+    encoded = build(store, POEMS + [copy])
+    assert encoded.count("床前明月光") == 1
+    assert index_size() == (12, 12)
+
+
+def test_removed_poem_encodes_nothing(store):
+    build(store, POEMS)
+    assert build(store, POEMS[:2]) == []
+    assert index_size() == (8, 8)
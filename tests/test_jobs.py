@@ -0,0 +1,230 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import jobs
+from jobs import JobManager, QUEUED, RUNNING, FINISHED, FAILED
+
+DOCS = [{"id": f"d{i}", "text": f"文档{i}"} for i in range(10)]
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def wait_status(manager, job_id, status):
+    assert wait_for(lambda: manager.get(job_id)["status"] == status), manager.get(job_id)
+    return manager.get(job_id)
+
+
+def read_results(manager, job_id):
+    with open(manager.results_path(job_id), "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+class StubTrace:
+    """记录处理过的文档；gate 未放行时阻塞，fail 中的文档抛出异常"""
+
+    def __init__(self, gate=None, fail=()):
+        self.gate = gate
+        self.fail = set(fail)
+        self.seen = []
+        self.params = []
+        self._lock = threading.Lock()
+
+    def __call__(self, doc, **params):
+        with self._lock:
+            self.seen.append(doc["id"])
+            self.params.append(params)
+        if self.gate is not None:
+            self.gate.wait(5)
+        if doc["id"] in self.fail:
+            raise RuntimeError(f"bad {doc['id']}")
+        return {"id": doc["id"], "findings": []}
+
+
+def test_status_transitions_and_results(tmp_path):
+    gate = threading.Event()
+    trace = StubTrace(gate, fail={"d3"})
+    manager = JobManager(str(tmp_path), trace, max_workers=2)
+    job_id = manager.submit(DOCS, {"recommend": True, "top_k": 3})
+    assert manager.get(job_id)["status"] == QUEUED
+
+    manager.start()
+    job = wait_status(manager, job_id, RUNNING)
+    assert job["started_at"] is not None and job["finished_at"] is None
+    gate.set()
+    job = wait_status(manager, job_id, FINISHED)
+    assert (job["total"], job["done"], job["failed"]) == (10, 10, 1)
+
+    results = read_results(manager, job_id)
+    assert sorted(r["index"] for r in results) == list(range(10))
+    assert [r for r in results if "error" in r] == [{"index": 3, "error": "bad d3"}]
+    # 提交时的参数传给处理函数
+    assert trace.params[0] == {"recommend": True, "top_k": 3}
+    # 状态落盘，新的管理器（重启后）读到相同的结果
+    assert JobManager(str(tmp_path), trace).get(job_id)["status"] == FINISHED
+
+
+def test_iter_progress_ends_when_finished(tmp_path):
+    manager = JobManager(str(tmp_path), StubTrace(), max_workers=2)
+    job_id = manager.submit(DOCS[:3])
+    manager.start()
+    states = list(manager.iter_progress(job_id, interval=0.01))
+    assert states[-1]["status"] == FINISHED and states[-1]["done"] == 3
+
+
+def test_job_failure_marks_failed(tmp_path):
+    manager = JobManager(str(tmp_path), StubTrace(), max_workers=2)
+    job_id = manager.submit(DOCS[:2])
+    os.remove(os.path.join(str(tmp_path), job_id, "input.jsonl"))
+    manager.start()
+    job = wait_status(manager, job_id, FAILED)
+    assert job["error"] and job["finished_at"] is not None
+
+
+def test_waits_for_ready_event(tmp_path):
+    ready = threading.Event()
+    trace = StubTrace()
+    manager = JobManager(str(tmp_path), trace, max_workers=2, ready_event=ready)
+    job_id = manager.submit(DOCS[:2])
+    manager.start()
+    time.sleep(0.1)
+    assert trace.seen == [] and manager.get(job_id)["status"] == QUEUED
+    ready.set()
+    wait_status(manager, job_id, FINISHED)
+
+
+def test_recovery_truncates_torn_line_and_skips_finished(tmp_path):
+    first = JobManager(str(tmp_path), StubTrace())
+    job_id = first.submit(DOCS)
+    # 模拟进程在处理中途崩溃：3 条完整结果（其中一条失败）+ 写了一半的最后一行，job.json 仍为 running
+    with open(first.results_path(job_id), "w", encoding="utf-8") as f:
+        f.write(json.dumps({"index": 0, "id": "d0", "findings": []}) + "\n")
+        f.write(json.dumps({"index": 4, "id": "d4", "findings": []}) + "\n")
+        f.write(json.dumps({"index": 7, "error": "bad d7"}) + "\n")
+        f.write('{"index": 5, "id": "d')
+    job = first.get(job_id)
+    job["status"] = RUNNING
+    first._save(job)
+
+    trace = StubTrace()
+    restarted = JobManager(str(tmp_path), trace, max_workers=3)
+    restarted.start()
+    job = wait_status(restarted, job_id, FINISHED)
+    assert sorted(trace.seen) == sorted(f"d{i}" for i in range(10) if i not in (0, 4, 7))
+    assert (job["done"], job["failed"]) == (10, 1)
+    results = read_results(restarted, job_id)  # 每行都是完整的 JSON
+    assert sorted(r["index"] for r in results) == list(range(10))
+
+
+def test_recovery_ignores_finished_jobs(tmp_path):
+    manager = JobManager(str(tmp_path), StubTrace())
+    job_id = manager.submit(DOCS[:2])
+    manager.start()
+    wait_status(manager, job_id, FINISHED)
+
+    trace = StubTrace()
+    JobManager(str(tmp_path), trace).start()
+    time.sleep(0.1)
+    assert trace.seen == []
+
+
+def test_in_flight_documents_are_bounded(tmp_path, monkeypatch):
+    outstanding, peak = set(), [0]
+    lock = threading.Lock()
+
+    class CountingPool(jobs.ThreadPoolExecutor):
+        """统计已提交但尚未完成的文档数"""
+
+        def submit(self, fn, *args, **kwargs):
+            future = super().submit(fn, *args, **kwargs)
+            with lock:
+                outstanding.add(future)
+                peak[0] = max(peak[0], len(outstanding))
+            future.add_done_callback(lambda f: outstanding.discard(f))
+            return future
+
+    monkeypatch.setattr(jobs, "ThreadPoolExecutor", CountingPool)
+
+    def slow_trace(doc, **params):
+        time.sleep(0.005)
+        return {"id": doc["id"]}
+
+    docs = [{"id": f"d{i}", "text": "x"} for i in range(200)]
+    manager = JobManager(str(tmp_path), slow_trace, max_workers=3)
+    job_id = manager.submit(docs)
+    manager.start()
+    job = wait_status(manager, job_id, FINISHED)
+    assert job["done"] == 200
+    assert 3 <= peak[0] <= 3 * 2
+
+
+def test_invalid_job_id(tmp_path):
+    manager = JobManager(str(tmp_path), StubTrace())
+    with pytest.raises(ValueError):
+        manager.get("../etc")
+    assert manager.get("abc123") is None
+
+
+class StubEs:
+    def __init__(self):
+        self.queries = []
+
+    def msearch_poetry(self, queries, size=3, fields=None):
+        self.queries.append(list(queries))
+        return [[{"_score": 12.0, "_source": {"古诗名": "静夜思", "作者": "李白", "朝代": "唐"}}],
+                [{"_score": 3.0, "_source": {"古诗名": "无关", "作者": "", "朝代": ""}}]][:len(queries)]
+
+
+class StubRecommender:
+    def __init__(self):
+        self.calls = []
+
+    def recommend(self, text, top_k=None, timeout=10.0):
+        self.calls.append((text, top_k))
+        return [{"chunk": text, "start": 0, "end": len(text), "recommendations": []}]
+
+
+@pytest.fixture
+def app_module(monkeypatch):
+    import app
+    monkeypatch.setattr(app, "es", StubEs())
+    monkeypatch.setattr(app, "recommender", StubRecommender())
+    return app
+
+
+def test_trace_document_search_only(app_module):
+    result = app_module.trace_document({"id": "d1", "text": "床前明月光。今天天气很好。"})
+    assert app_module.es.queries == [["床前明月光", "今天天气很好"]]
+    assert [f["sentence"] for f in result["findings"]] == ["床前明月光"]
+    assert "recommendations" not in result
+    assert app_module.recommender.calls == []
+
+
+def test_trace_document_with_recommendation(app_module):
+    text = "床前明月光。今天天气很好。"
+    result = app_module.trace_document({"id": "d1", "text": text}, recommend=True, top_k=3)
+    assert app_module.recommender.calls == [(text, 3)]
+    assert result["recommendations"][0]["chunk"] == text
+    assert len(result["findings"]) == 1
+
+
+def test_create_job_passes_recommend_option(app_module, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(app_module.job_manager, "submit", lambda docs, params=None: submitted.append(params) or "ab12")
+    monkeypatch.setattr(app_module, "start_background_services", lambda: None)
+    client = app_module.app.test_client()
+    docs = [{"id": "d1", "text": "床前明月光。"}]
+    assert client.post("/api/jobs", json={"documents": docs}).status_code == 202
+    assert client.post("/api/jobs", json={"documents": docs, "recommend": True, "top_k": 50}).status_code == 202
+    assert client.post("/api/jobs", json={"documents": docs, "recommend": True, "top_k": "x"}).status_code == 400
+    assert submitted == [{}, {"recommend": True, "top_k": app_module.RECOMMEND_MAX_TOP_K}]
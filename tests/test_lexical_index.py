@@ -0,0 +1,119 @@
+import math
+import os
+
+import pytest
+
+import rag_config
+from src.lexical_index import LexicalIndex, lexical_dir
+
+DOCS = [(10, "床前明月光"), (11, "举头望明月"), (12, "明月几时有"), (13, "春眠不觉晓"), (14, "明月明月明月")]
+
+
+def grams(text, n=2):
+    return [text[i:i + n] for i in range(len(text) - n + 1)]
+
+
+def bm25(query, docs, n=2):
+    """按定义逐项计算的 BM25，作为对照"""
+    k1, b = rag_config.BM25_K1, rag_config.BM25_B
+    doc_grams = {vid: grams(text, n) for vid, text in docs}
+    avgdl = sum(len(g) for g in doc_grams.values()) / len(docs)
+    scores = {}
+    for vid, terms in doc_grams.items():
+        score = 0.0
+        for term in set(grams(query, n)):
+            tf = terms.count(term)
+            if not tf:
+                continue
+            df = sum(term in other for other in doc_grams.values())
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(terms) / avgdl))
+        if score:
+            scores[vid] = score
+    return scores
+
+
+@pytest.fixture
+def index(tmp_path):
+    return LexicalIndex.build(str(tmp_path / "lexical"), DOCS, ngram=2)
+
+
+def test_bm25_scores_match_definition(index):
+    query = "床前明月光，明月几时有"
+    ids, scores, _, _ = index.search_one(query, k=10, min_coverage=0.0)
+    expected = bm25(query, DOCS)
+    assert set(ids.tolist()) == set(expected)
+    for vid, score in zip(ids.tolist(), scores.tolist()):
+        assert score == pytest.approx(expected[vid], rel=1e-5)
+    assert scores.tolist() == sorted(scores.tolist(), reverse=True)
+
+
+def test_coverage_filter(index):
+    query = "床前明月光疑是地上霜"
+    ids, _, coverage, chars = index.search_one(query, k=10, min_coverage=0.0)
+    by_id = dict(zip(ids.tolist(), coverage.tolist()))
+    # 整句出现在查询中时覆盖率为 1；只共用“明月”的句子为 1/4
+    assert by_id[10] == pytest.approx(1.0)
+    assert by_id[11] == pytest.approx(0.25)
+    # 重复的 n-gram 只按不同 n-gram 计覆盖率
+    assert by_id[14] == pytest.approx(0.5)
+    ids, _, coverage, chars = index.search_one(query, k=10, min_coverage=0.5)
+    assert ids.tolist()[0] == 10 and set(ids.tolist()) == {10, 14}
+    assert chars.tolist()[0] == 5
+
+
+def test_top_k_and_no_match(index):
+    ids, _, _, _ = index.search_one("明月", k=2, min_coverage=0.0)
+    assert len(ids) == 2
+    ids, scores, coverage, chars = index.search_one("秋风萧瑟", k=5)
+    assert len(ids) == len(scores) == len(coverage) == len(chars) == 0
+    assert len(index.search_one("月", k=5)[0]) == 0  # 短于 n-gram
+
+
+def test_lone_surrogate_query_and_doc(tmp_path):
+    index = LexicalIndex.build(str(tmp_path / "lexical"), [(1, "春眠\ud800不觉晓"), (2, "床前明月光")], ngram=2)
+    ids, _, _, _ = index.search_one("春眠\ud800不觉晓" * 3, k=5)
+    assert ids.tolist() == [1]
+
+
+class FakeMetadata:
+    def __init__(self, docs):
+        self.docs = docs
+        self.iterations = 0
+
+    def iter_texts(self):
+        self.iterations += 1
+        return iter(self.docs)
+
+
+def test_load_or_build_invalidation(tmp_path, monkeypatch):
+    index_path = str(tmp_path / "poetry_index")
+    sqlite_path = f"{index_path}.sqlite"
+    with open(sqlite_path, "wb") as f:
+        f.write(b"v1")
+    metadata = FakeMetadata(DOCS)
+    monkeypatch.setattr(rag_config, "LEXICAL_NGRAM", 2)
+
+    LexicalIndex.load_or_build(index_path, metadata)
+    assert os.path.exists(os.path.join(lexical_dir(index_path), "meta.json"))
+    LexicalIndex.load_or_build(index_path, metadata)
+    assert metadata.iterations == 1  # 元数据未变，直接加载
+
+    # 元数据文件变化（重建或增量更新）后重建
+    with open(sqlite_path, "ab") as f:
+        f.write(b"v2")
+    metadata.docs = DOCS + [(15, "秋风萧瑟")]
+    index = LexicalIndex.load_or_build(index_path, metadata)
+    assert metadata.iterations == 2
+    assert index.search_one("秋风萧瑟", k=5)[0].tolist() == [15]
+
+    # n-gram 配置变化后重建
+    monkeypatch.setattr(rag_config, "LEXICAL_NGRAM", 3)
+    index = LexicalIndex.load_or_build(index_path, metadata)
+    assert metadata.iterations == 3
+    assert index.ngram == 3
+
+
+def test_invalid_ngram(tmp_path):
+    with pytest.raises(ValueError):
+        LexicalIndex.build(str(tmp_path / "lexical"), DOCS, ngram=4)
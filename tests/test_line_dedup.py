@@ -0,0 +1,109 @@
+import json
+
+import pytest
+
+import rag_config
+from src.data_processor import DataProcessor
+from src.retriever import Retriever
+from src.sharding import shard_of
+from src.vector_store import VectorStore
+
+# “床前明月光”出现在三个朝代的诗中（朝代取值使三首诗在 3 个分片中各占一个）
+POEMS = [
+    {"古诗名": "静夜思", "作者": "李白", "朝代": "唐", "内容": "床前明月光，疑是地上霜。"},
+    {"古诗名": "拟静夜思", "作者": "某甲", "朝代": "宋", "内容": "床前明月光！秋风入户凉。"},
+    {"古诗名": "又拟静夜思", "作者": "某乙", "朝代": "明", "内容": "床前明月光。孤灯照夜长。"},
+]
+IDIOMS = [{"成语": "画蛇添足", "解释": "比喻做多余的事"}, {"成语": "守株待兔", "解释": "比喻死守经验"}]
+
+
+def test_line_key_normalizes_width_space_and_punctuation():
+    assert DataProcessor.line_key("床前明月光，") == "床前明月光"
+    assert DataProcessor.line_key(" 床前 明月光！") == "床前明月光"
+    assert DataProcessor.line_key("ＡＢＣ１２３") == "ABC123"
+    assert DataProcessor.line_key("“床前明月光”") == "床前明月光"
+    assert DataProcessor.line_key("，。！") == ""
+
+
+def test_identical_lines_share_vector_id():
+    lines = [item for poem in POEMS for item in DataProcessor.process_poetry_data(poem, dedup=True)]
+    shared = [item for item in lines if DataProcessor.line_key(item["line"]) == "床前明月光"]
+    assert len(shared) == 3
+    assert len({DataProcessor.item_vector_id(item) for item in shared}) == 1
+    assert len({item["id"] for item in shared}) == 3  # 各出处仍有自己的 id
+    # 不去重时每句一个向量
+    plain = [item for poem in POEMS for item in DataProcessor.process_poetry_data(poem, dedup=False)]
+    assert len({DataProcessor.item_vector_id(item) for item in plain}) == len(plain)
+
+
+def test_punctuation_only_line_is_not_deduplicated():
+    items = DataProcessor.process_poetry_data({"古诗名": "t", "内容": ["床前明月光", "……"]}, dedup=True)
+    assert "vector_key" in items[0] and "vector_key" not in items[1]
+
+
+def build(num_shards, shard_by):
+    rag_config.NUM_SHARDS = num_shards
+    rag_config.SHARD_BY = shard_by
+    for path, data in ((rag_config.POETRY_DATA_PATH, POEMS), (rag_config.IDIOM_DATA_PATH, IDIOMS)):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+    store = VectorStore(model_name="fake-model")
+    store.create_poetry_index()
+    store.create_idiom_index()
+    return Retriever(model_name="fake-model", use_cache=False)
+
+
+def shared_results(retriever, mode="dense"):
+    results = retriever.retrieve_batch(["床前明月光"], top_k=5, score_threshold=0.5, mode=mode)[0]
+    return [item for item in results if item["type"] == "poetry_line"
+            and DataProcessor.line_key(item["line"]) == "床前明月光"]
+
+
+def source_titles(item):
+    return sorted(source["title"] for source in item["sources"])
+
+
+def test_identical_lines_collapse_to_one_vector(rag_data, fake_model, monkeypatch):
+    monkeypatch.setattr(rag_config, "NUM_SHARDS", 1)
+    retriever = build(1, "hash")
+    # 6 句诗中 3 句相同，只编码一次
+    assert fake_model.encoded.count("床前明月光") == 1
+    assert retriever.poetry_index.ntotal == 4
+    [item] = shared_results(retriever)
+    assert source_titles(item) == ["又拟静夜思", "拟静夜思", "静夜思"]
+    assert {source["dynasty"] for source in item["sources"]} == {"唐", "宋", "明"}
+
+
+def test_dynasty_shards_merge_back_into_one_result(rag_data, fake_model, monkeypatch):
+    monkeypatch.setattr(rag_config, "HYBRID_SHORT_CIRCUIT", False)
+    monkeypatch.setattr(rag_config, "NUM_SHARDS", 3)
+    shards = {shard_of({"dynasty": poem["朝代"], "id": ""}, 3, "dynasty") for poem in POEMS}
+    assert shards == {0, 1, 2}
+    retriever = build(3, "dynasty")
+    # 每个朝代的分片各存一份该句的向量
+    assert retriever.poetry_index.ntotal == 6
+    for mode in ("dense", "hybrid"):
+        [item] = shared_results(retriever, mode)
+        assert source_titles(item) == ["又拟静夜思", "拟静夜思", "静夜思"]
+        assert len(item["sources"]) == 3
+
+
+def test_merge_is_noop_without_dynasty_shards():
+    retriever = Retriever.__new__(Retriever)
+    retriever._line_copies = 1
+    items = [{"type": "poetry_line", "line": "床前明月光"}, {"type": "poetry_line", "line": "床前明月光"}]
+    assert retriever._merge_line_copies(items) == items
+
+
+def test_merge_keeps_first_and_concatenates_sources():
+    retriever = Retriever.__new__(Retriever)
+    retriever._line_copies = 2
+    first = {"type": "poetry_line", "line": "床前明月光", "id": "a-0", "line_index": 0, "title": "A",
+             "author": "", "dynasty": "唐", "score": 0.9}
+    second = {"type": "poetry_line", "line": "床前明月光。", "id": "b-0", "line_index": 0, "title": "B",
+              "author": "", "dynasty": "宋", "score": 0.8,
+              "sources": [{"id": "b-0", "title": "B"}, {"id": "c-2", "title": "C"}]}
+    idiom = {"type": "idiom", "idiom": "画蛇添足", "score": 0.85}
+    merged = retriever._merge_line_copies([first, idiom, second])
+    assert [item.get("title") or item["idiom"] for item in merged] == ["A", "画蛇添足"]
+    assert [source["title"] for source in merged[0]["sources"]] == ["A", "B", "C"]
@@ -0,0 +1,71 @@
+from search.metrics import Histogram, MetricsRegistry
+
+
+def bucket_counts(histogram, **labels):
+    """render() 输出中各桶的累计计数：{le: count}"""
+    prefix = f"{histogram.name}_bucket"
+    counts = {}
+    for line in histogram.render():
+        if line.startswith(prefix):
+            series, value = line.rsplit(" ", 1)
+            le = series.split('le="', 1)[1].split('"', 1)[0]
+            counts[le] = int(value)
+    return counts
+
+
+def test_value_on_bound_falls_into_that_bucket():
+    histogram = Histogram("latency", "doc", buckets=(0.1, 0.5, 1.0))
+    histogram.observe(0.5)
+    assert bucket_counts(histogram) == {"0.1": 0, "0.5": 1, "1": 1, "+Inf": 1}
+
+
+def test_value_just_above_bound_goes_to_next_bucket():
+    histogram = Histogram("latency", "doc", buckets=(0.1, 0.5, 1.0))
+    histogram.observe(0.5000001)
+    assert bucket_counts(histogram) == {"0.1": 0, "0.5": 0, "1": 1, "+Inf": 1}
+
+
+def test_values_outside_bounds():
+    histogram = Histogram("latency", "doc", buckets=(0.1, 0.5, 1.0))
+    histogram.observe(0)
+    histogram.observe(5.0)
+    assert bucket_counts(histogram) == {"0.1": 1, "0.5": 1, "1": 1, "+Inf": 2}
+
+
+def test_buckets_are_sorted():
+    histogram = Histogram("latency", "doc", buckets=(1.0, 0.1, 0.5))
+    histogram.observe(0.3)
+    assert list(bucket_counts(histogram)) == ["0.1", "0.5", "1", "+Inf"]
+    assert bucket_counts(histogram)["0.5"] == 1
+
+
+def test_render_cumulative_sum_and_count():
+    histogram = Histogram("latency", "doc", buckets=(0.1, 0.5, 1.0))
+    for value in (0.05, 0.1, 0.3, 0.7, 2):
+        histogram.observe(value, stage="es_query")
+    lines = histogram.render()
+    assert lines[:2] == ["# HELP latency doc", "# TYPE latency histogram"]
+    assert 'latency_bucket{stage="es_query",le="0.1"} 2' in lines
+    assert 'latency_bucket{stage="es_query",le="0.5"} 3' in lines
+    assert 'latency_bucket{stage="es_query",le="1"} 4' in lines
+    assert 'latency_bucket{stage="es_query",le="+Inf"} 5' in lines
+    assert 'latency_sum{stage="es_query"} 3.15' in lines
+    assert 'latency_count{stage="es_query"} 5' in lines
+
+
+def test_label_series_are_separate():
+    histogram = Histogram("latency", "doc", buckets=(1.0,))
+    histogram.observe(0.5, stage="a")
+    histogram.observe(2.0, stage="b")
+    lines = histogram.render()
+    assert 'latency_bucket{stage="a",le="1"} 1' in lines
+    assert 'latency_bucket{stage="b",le="1"} 0' in lines
+    assert 'latency_count{stage="b"} 1' in lines
+
+
+def test_registry_returns_same_metric():
+    registry = MetricsRegistry()
+    first = registry.histogram("latency", "doc")
+    assert registry.histogram("latency", "other") is first
+    first.observe(0.01)
+    assert "latency_count 1" in registry.render().splitlines()
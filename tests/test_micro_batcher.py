@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+
+from src.rag_server import MicroBatcher
+
+
+class FakeRetriever:
+    """记录每次 retrieve_batch 的文本块；gate 未放行时第一次检索阻塞，便于让后续请求先排队"""
+
+    def __init__(self, gate: threading.Event = None, error: Exception = None):
+        self.batches = []
+        self.gate = gate
+        self.error = error
+        self.entered = threading.Event()
+
+    def retrieve_batch(self, chunks, top_k):
+        self.batches.append(list(chunks))
+        self.entered.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.error is not None:
+            raise self.error
+        return [[{"type": "poetry_line", "content": f"{chunk}#{i}"} for i in range(top_k)] for chunk in chunks]
+
+
+@pytest.fixture
+def make_batcher():
+    batchers = []
+
+    def make(retriever, **kwargs):
+        batcher = MicroBatcher(retriever, **kwargs)
+        batchers.append(batcher)
+        return batcher
+
+    yield make
+    for batcher in batchers:
+        batcher.close()
+
+
+def hold_first_batch(batcher, retriever):
+    """提交一个请求并等它进入检索（阻塞在 gate 上），之后提交的请求都在队列中等待下一批"""
+    first = batcher.submit("占位")
+    assert retriever.entered.wait(5)
+    return first
+
+
+def test_queued_requests_merge_into_one_batch(make_batcher):
+    gate = threading.Event()
+    retriever = FakeRetriever(gate)
+    batcher = make_batcher(retriever, max_batch_size=64, max_wait_ms=50)
+    first = hold_first_batch(batcher, retriever)
+    futures = [batcher.submit(text) for text in ("一", "二", "三")]
+    gate.set()
+    first.result(5)
+    for future in futures:
+        future.result(5)
+    assert retriever.batches == [["占位"], ["一", "二", "三"]]
+    assert batcher.stats()["batches"] == 2
+    assert batcher.stats()["requests"] == 4
+
+
+def test_max_batch_size_splits_batches(make_batcher):
+    gate = threading.Event()
+    retriever = FakeRetriever(gate)
+    batcher = make_batcher(retriever, max_batch_size=2, max_wait_ms=50)
+    hold_first_batch(batcher, retriever)
+    futures = [batcher.submit(text) for text in ("一", "二", "三", "四", "五")]
+    gate.set()
+    for future in futures:
+        future.result(5)
+    assert retriever.batches[1:] == [["一", "二"], ["三", "四"], ["五"]]
+
+
+def test_lone_request_waits_at_most_max_wait(make_batcher):
+    batcher = make_batcher(FakeRetriever(), max_batch_size=64, max_wait_ms=100)
+    start = time.monotonic()
+    batcher.submit("床前明月光").result(5)
+    elapsed = time.monotonic() - start
+    # 没有其他请求时等到截止时间才检索，但不会无限等待凑满一批
+    assert 0.09 <= elapsed < 1.0
+
+
+def test_zero_wait_does_not_delay(make_batcher):
+    batcher = make_batcher(FakeRetriever(), max_batch_size=64, max_wait_ms=0)
+    start = time.monotonic()
+    batcher.submit("床前明月光").result(5)
+    assert time.monotonic() - start < 0.05
+
+
+def test_full_batch_does_not_wait_for_deadline(make_batcher):
+    retriever = FakeRetriever()
+    batcher = make_batcher(retriever, max_batch_size=2, max_wait_ms=5000)
+    start = time.monotonic()
+    futures = [batcher.submit(text) for text in ("一", "二")]
+    for future in futures:
+        future.result(5)
+    # 凑满 max_batch_size 立即检索，不等 max_wait
+    assert time.monotonic() - start < 1.0
+    assert retriever.batches == [["一", "二"]]
+
+
+def test_results_routed_to_each_request(make_batcher):
+    gate = threading.Event()
+    retriever = FakeRetriever(gate)
+    batcher = make_batcher(retriever, max_batch_size=64, max_wait_ms=50)
+    hold_first_batch(batcher, retriever)
+    first = batcher.submit("明月", top_k=1)
+    second = batcher.submit("清风", top_k=3)
+    gate.set()
+    assert first.result(5) == [{"chunk": "明月", "start": 0, "end": 2,
+                                "recommendations": [{"type": "poetry_line", "content": "明月#0"}]}]
+    assert [rec["content"] for rec in second.result(5)[0]["recommendations"]] == ["清风#0", "清风#1", "清风#2"]
+    assert retriever.batches[-1] == ["明月", "清风"]
+
+
+def test_empty_text_resolves_without_batch(make_batcher):
+    retriever = FakeRetriever()
+    batcher = make_batcher(retriever, max_wait_ms=0)
+    assert batcher.submit("").result(1) == []
+    assert retriever.batches == []
+
+
+def test_retriever_error_fails_whole_batch(make_batcher):
+    batcher = make_batcher(FakeRetriever(error=RuntimeError("boom")), max_wait_ms=0)
+    with pytest.raises(RuntimeError, match="boom"):
+        batcher.submit("床前明月光").result(5)
@@ -0,0 +1,89 @@
+import random
+
+import pytest
+
+from src.near_dup import simhash, hamming, SimHashIndex, find_duplicates, FINGERPRINT_BITS
+
+
+def flip(fingerprint, bits, rng):
+    for bit in rng.sample(range(FINGERPRINT_BITS), bits):
+        fingerprint ^= 1 << bit
+    return fingerprint
+
+
+def brute_force(fingerprints, query, max_distance):
+    return sorted(key for key, fingerprint in fingerprints.items() if hamming(query, fingerprint) <= max_distance)
+
+
+@pytest.mark.parametrize("bands,max_distance", [(4, 3), (8, 7), (4, 0), (16, 3)])
+def test_query_matches_brute_force(bands, max_distance):
+    rng = random.Random(bands * 100 + max_distance)
+    fingerprints = {key: rng.getrandbits(FINGERPRINT_BITS) for key in range(2000)}
+    index = SimHashIndex(bands, max_distance)
+    for key, fingerprint in fingerprints.items():
+        index.add(key, fingerprint)
+    for _ in range(300):
+        target = rng.randrange(len(fingerprints))
+        query = flip(fingerprints[target], rng.randint(0, max_distance + 2), rng)
+        matches = index.query(query)
+        assert sorted(key for key, _ in matches) == brute_force(fingerprints, query, max_distance)
+        assert [distance for _, distance in matches] == sorted(distance for _, distance in matches)
+
+
+def test_every_near_duplicate_is_found():
+    # 距离不超过 max_distance 时即使翻转的位分散在各段也不会漏
+    rng = random.Random(0)
+    index = SimHashIndex(bands=4, max_distance=3)
+    base = rng.getrandbits(FINGERPRINT_BITS)
+    index.add("base", base)
+    for distance in range(4):
+        for _ in range(200):
+            assert index.query(flip(base, distance, rng)) == [("base", distance)]
+
+
+def test_beyond_max_distance_is_not_returned():
+    rng = random.Random(1)
+    index = SimHashIndex(bands=4, max_distance=3)
+    base = rng.getrandbits(FINGERPRINT_BITS)
+    index.add("base", base)
+    for distance in (4, 5, 8):
+        for _ in range(100):
+            assert index.query(flip(base, distance, rng)) == []
+
+
+@pytest.mark.parametrize("bands,max_distance", [(4, 4), (4, 5), (5, 1)])
+def test_invalid_configuration_rejected(bands, max_distance):
+    with pytest.raises(ValueError):
+        SimHashIndex(bands, max_distance)
+
+
+def test_similar_texts_have_close_fingerprints():
+    text = "国家统计局今日发布数据显示，今年前三季度国内生产总值同比增长百分之五，经济运行总体平稳，" \
+           "消费和投资保持增长，就业形势基本稳定，居民收入继续增加。"
+    reprinted = text.replace("今日", "昨日") + "（来源：新华社）"
+    other = "今年冬天气温偏低，气象部门提醒市民注意防寒保暖，出行时关注道路结冰情况，" \
+            "农业部门也提示各地做好越冬作物的防冻工作，保障蔬菜供应。"
+    assert hamming(simhash(text), simhash(text + "  ")) == 0
+    assert hamming(simhash(text), simhash(reprinted)) <= 12
+    assert hamming(simhash(text), simhash(other)) > 16
+
+
+def test_short_text_has_no_fingerprint():
+    assert simhash("短讯") is None
+    assert simhash("") is None
+    assert simhash(None) is None
+
+
+def test_lone_surrogate_does_not_crash():
+    text = "国家统计局今日发布数据显示，今年前三季度国内生产总值同比增长百分之五，经济运行总体平稳，" \
+           "消费和投资保持增长，就业形势基本稳定，居民收入继续增加。"
+    damaged = text.replace("数据", "数\ud800据")
+    assert hamming(simhash(text), simhash(damaged)) <= 12
+
+
+def test_find_duplicates_points_to_first_representative():
+    rng = random.Random(2)
+    base, unrelated = rng.getrandbits(FINGERPRINT_BITS), rng.getrandbits(FINGERPRINT_BITS)
+    near = flip(base, 2, rng)
+    items = [("a", base), ("b", None), ("c", near), ("d", unrelated), ("e", base)]
+    assert find_duplicates(items, bands=4, max_distance=3) == {"c": ("a", 2), "e": ("a", 0)}
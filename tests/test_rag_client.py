@@ -0,0 +1,73 @@
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.rag_client import RagClient
+
+
+def raw_server(reply: bytes):
+    """接受连接后读一次请求，回复 reply（非 HTTP 内容）后关闭"""
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+
+    def serve():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            with conn:
+                conn.recv(65536)
+                conn.sendall(reply)
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener
+
+
+@pytest.mark.parametrize("reply", [b"HELLO\r\n\r\n", b"SSH-2.0-OpenSSH_9.6\r\n", b""])
+def test_available_false_for_non_http_listener(reply):
+    listener = raw_server(reply)
+    try:
+        client = RagClient(f"http://127.0.0.1:{listener.getsockname()[1]}", timeout=2)
+        assert client.available() is False
+    finally:
+        listener.close()
+
+
+def test_available_false_when_nothing_listens():
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    assert RagClient(f"http://127.0.0.1:{port}", timeout=2).available() is False
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = json.dumps({"status": "ok"}).encode()
+        self.send_response(200 if self.path == "/health" else 404)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_available_true_for_healthy_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), HealthHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = RagClient(f"http://127.0.0.1:{server.server_address[1]}", timeout=2)
+        assert client.available() is True
+        assert client.health() == {"status": "ok"}
+        client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
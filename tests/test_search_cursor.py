@@ -0,0 +1,40 @@
+import base64
+
+import pytest
+
+from app import encode_cursor, decode_cursor
+
+
+@pytest.mark.parametrize("search_after", [
+    [12.5, "poem-1"],
+    [3, "静夜思"],
+    [0.1, "a", "b"],  # 编码后需要补不同长度的 '='
+    [],
+])
+def test_cursor_round_trip(search_after):
+    cursor = encode_cursor(search_after)
+    assert decode_cursor(cursor) == search_after
+
+
+def test_cursor_is_url_safe_without_padding():
+    cursor = encode_cursor([1.0, "床前明月光？>>>"])
+    assert "=" not in cursor
+    assert not set(cursor) & set("+/")
+
+
+def test_cursor_is_compact_json():
+    cursor = encode_cursor([1, "李白"])
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+    assert raw == '[1,"李白"]'
+
+
+def test_decode_rejects_non_list():
+    cursor = encode_cursor({"score": 1})
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", encode_cursor("x")[:-1], "////"])
+def test_decode_rejects_garbage(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
@@ -0,0 +1,118 @@
+import faiss
+import numpy as np
+import pytest
+
+from src.data_processor import DataProcessor
+from src.sharding import ShardedIndex, ShardedMetadata, shard_of
+
+DIM = 16
+
+
+def id_index(vectors, ids):
+    index = faiss.IndexIDMap(faiss.IndexFlatIP(DIM))
+    if len(ids):
+        index.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), np.asarray(ids, dtype=np.int64))
+    return index
+
+
+def build(vectors, ids, num_shards):
+    """按 id % num_shards 分片（与 hash 分片一致）；返回 (分片组合, 单一精确索引)"""
+    shards = [id_index(vectors[ids % num_shards == s], ids[ids % num_shards == s]) for s in range(num_shards)]
+    return shards, id_index(vectors, ids)
+
+
+def assert_same_topk(sharded, flat, queries, k):
+    scores, ids = sharded.search(queries, k)
+    expected_scores, expected_ids = flat.search(queries, k)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-6)
+    for q in range(len(queries)):
+        # 分数相同的结果之间顺序不定，逐个分数比较 id 集合
+        for score in set(expected_scores[q].tolist()):
+            assert set(ids[q][scores[q] == score]) == set(expected_ids[q][expected_scores[q] == score])
+
+
+@pytest.mark.parametrize("num_shards", [2, 3])
+@pytest.mark.parametrize("workers", [1, 0])
+def test_merged_search_equals_flat(num_shards, workers):
+    rng = np.random.default_rng(num_shards)
+    vectors = rng.normal(size=(300, DIM)).astype(np.float32)
+    ids = rng.permutation(10_000)[:300].astype(np.int64)
+    shards, flat = build(vectors, ids, num_shards)
+    sharded = ShardedIndex(shards, max_workers=workers or None)
+    assert sharded.ntotal == 300 and sharded.d == DIM
+    assert_same_topk(sharded, flat, rng.normal(size=(20, DIM)).astype(np.float32), k=10)
+
+
+def test_ties_across_shards():
+    rng = np.random.default_rng(0)
+    base = rng.normal(size=(1, DIM)).astype(np.float32)
+    # 同一向量出现在三个分片中（id 0、1、2），其余为随机向量
+    vectors = np.vstack([base, base, base, rng.normal(size=(30, DIM)).astype(np.float32) * 0.1])
+    ids = np.arange(len(vectors), dtype=np.int64)
+    shards, flat = build(vectors, ids, 3)
+    scores, found = ShardedIndex(shards).search(base, 3)
+    assert set(found[0]) == {0, 1, 2}
+    assert np.allclose(scores[0], scores[0][0])
+    assert_same_topk(ShardedIndex(shards), flat, base, k=5)
+
+
+def test_shards_with_fewer_than_k_vectors():
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(9, DIM)).astype(np.float32)
+    ids = np.array([0, 3, 6, 9, 12, 15, 1, 4, 2], dtype=np.int64)  # 分片 0 有 6 条，分片 1 有 2 条，分片 2 有 1 条
+    shards, flat = build(vectors, ids, 3)
+    queries = rng.normal(size=(5, DIM)).astype(np.float32)
+    assert_same_topk(ShardedIndex(shards), flat, queries, k=5)
+    # 总数不足 k 时与精确索引一样以 -1 补位
+    scores, found = ShardedIndex(shards).search(queries, 12)
+    assert (found[:, 9:] == -1).all() and np.isneginf(scores[:, 9:]).all()
+    assert sorted(found[0, :9]) == sorted(ids)
+
+
+def test_empty_shard():
+    rng = np.random.default_rng(2)
+    vectors = rng.normal(size=(6, DIM)).astype(np.float32)
+    ids = np.array([0, 2, 4, 6, 8, 10], dtype=np.int64)  # 全部在分片 0，分片 1 为空
+    shards, flat = build(vectors, ids, 2)
+    assert shards[1].ntotal == 0
+    assert_same_topk(ShardedIndex(shards), flat, rng.normal(size=(3, DIM)).astype(np.float32), k=4)
+
+
+class RecordingMetadata:
+    def __init__(self, items):
+        self.items = items
+        self.requests = []
+
+    def get_many(self, rows):
+        rows = list(rows)
+        self.requests.append(rows)
+        return [self.items.get(row) for row in rows]
+
+
+def test_hash_metadata_routes_by_id_modulo():
+    shards = [RecordingMetadata({row: {"row": row} for row in range(s, 30, 3)}) for s in range(3)]
+    metadata = ShardedMetadata(shards, "hash")
+    rows = [7, 3, 29, 12, 5]
+    assert metadata.get_many(rows) == [{"row": row} for row in rows]
+    for s, shard in enumerate(shards):
+        assert all(row % 3 == s for request in shard.requests for row in request)
+    assert metadata[12] == {"row": 12}
+    with pytest.raises(IndexError):
+        metadata[99]
+
+
+def test_dynasty_metadata_queries_shards_in_turn():
+    shards = [RecordingMetadata({1: {"row": 1}, 4: {"row": 4}}), RecordingMetadata({2: {"row": 2}}),
+              RecordingMetadata({3: {"row": 3}})]
+    metadata = ShardedMetadata(shards, "dynasty")
+    assert metadata.get_many([3, 1, 2, 8]) == [{"row": 3}, {"row": 1}, {"row": 2}, None]
+    # 已找到的行不再向后续分片查询
+    assert shards[1].requests == [[3, 2, 8]] and shards[2].requests == [[3, 8]]
+
+
+def test_shard_of_matches_vector_id_routing():
+    item = {"id": "poem-1-0", "type": "poetry_line", "dynasty": "唐"}
+    assert shard_of(item, 4, "dynasty") == shard_of(dict(item, id="poem-2-3"), 4, "dynasty")
+    # hash 分片与向量 id 取模一致，ShardedMetadata 可由向量 id 直接定位分片
+    assert shard_of(item, 4, "hash") == DataProcessor.item_vector_id(item) % 4
+    assert shard_of(dict(item, dynasty=""), 4, "dynasty") == DataProcessor.item_vector_id(item) % 4
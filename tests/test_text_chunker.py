@@ -0,0 +1,115 @@
+import random
+import re
+
+import pytest
+
+from benchmark import legacy_split_text
+from src import retriever
+from src.retriever import TextChunker, SENTENCE_END_CHARS
+
+CHARS = "床前明月光疑是地上霜举头望低思故乡春眠不觉晓处闻啼鸟abc 12"
+
+
+def random_text(rng, n_sentences, min_len=10, max_len=40):
+    return "".join("".join(rng.choice(CHARS) for _ in range(rng.randint(min_len, max_len))) + rng.choice(SENTENCE_END_CHARS)
+                   for _ in range(n_sentences))
+
+
+def assert_spans_valid(text, spans):
+    for start, end, chunk in spans:
+        assert text[start:end] == chunk
+        assert chunk
+    starts = [start for start, _, _ in spans]
+    assert starts == sorted(set(starts))
+    # 相邻块首尾相接或重叠，不跳过任何字符；最多只落下结尾一个字符
+    for (_, prev_end, _), (start, _, _) in zip(spans, spans[1:]):
+        assert start <= prev_end
+    assert spans[0][0] == 0 and spans[-1][1] >= len(text) - 1
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_char_mode_matches_legacy(seed):
+    # 句子不长于块大小减去重叠，不会出现旧实现死循环的退化情形
+    rng = random.Random(seed)
+    text = random_text(rng, rng.randint(1, 60))
+    assert TextChunker.split_text(text, chunk_size=100, overlap=5, unit="char") == \
+        legacy_split_text(text, chunk_size=100, overlap=5)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_spans_are_offsets_into_text(seed):
+    rng = random.Random(seed)
+    text = random_text(rng, 50, 1, 120)
+    spans = TextChunker.split_spans(text, chunk_size=80, overlap=10, unit="char")
+    assert_spans_valid(text, spans)
+    assert all(end - start <= 80 for start, end, _ in spans)
+
+
+def test_short_and_empty_text():
+    assert TextChunker.split_spans("", unit="char") == []
+    assert TextChunker.split_spans(None, unit="char") == []
+    assert TextChunker.split_spans("床前明月光。", chunk_size=10, unit="char") == [(0, 6, "床前明月光。")]
+
+
+def test_boundary_inside_overlap_still_advances():
+    # 第二个窗口中唯一的句末落在重叠区内：旧实现反复输出同一块直到迭代上限
+    text = "床" * 40 + "。" + "月" * 300
+    spans = TextChunker.split_spans(text, chunk_size=50, overlap=10, unit="char")
+    assert_spans_valid(text, spans)
+    assert spans[0] == (0, 41, text[:41])
+    assert spans[1][:2] == (31, 81)
+    assert len(spans) == 9
+    assert len(legacy_split_text(text, chunk_size=50, overlap=10)) > 100
+
+
+def test_zero_overlap_keeps_every_character():
+    text = "床前明月光。" * 30
+    chunks = TextChunker.split_text(text, chunk_size=20, overlap=0, unit="char")
+    assert "".join(chunks) == text
+    # 旧实现每块之间丢掉一个字符
+    assert "".join(legacy_split_text(text, chunk_size=20, overlap=0)) != text
+
+
+def test_lone_surrogate_does_not_crash():
+    # json.loads('"\\ud800"') 得到的孤立代理项是合法的 str
+    text = "春眠\ud800不觉晓。" * 100
+    spans = TextChunker.split_spans(text, chunk_size=300, overlap=30, unit="char")
+    assert_spans_valid(text, spans)
+    assert TextChunker.sentence_ends("春\ud800。晓") == [3]
+
+
+class StubTokenizer:
+    """ASCII 字母数字连续成一个 token，其余每个非空白字符一个 token"""
+
+    def __call__(self, text, add_special_tokens=False, return_offsets_mapping=False, verbose=True):
+        return {"offset_mapping": [match.span() for match in re.finditer(r"[A-Za-z0-9]+|\S", text)]}
+
+
+def count_tokens(text):
+    return len(StubTokenizer()(text)["offset_mapping"])
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_token_mode_respects_token_budget(seed, monkeypatch):
+    monkeypatch.setattr(retriever, "_get_tokenizer", lambda model_name: StubTokenizer())
+    rng = random.Random(seed)
+    text = random_text(rng, 40, 1, 60) + "abcdefgh" * 30
+    spans = TextChunker.split_spans(text, chunk_size=50, overlap=5, unit="token")
+    assert_spans_valid(text, spans)
+    assert all(count_tokens(chunk) <= 50 for _, _, chunk in spans)
+    # 块边界对齐到 token 边界或句末（换行符不是 token），不会把一个 token 截成两半
+    token_bounds = {0, len(text)} | {b for span in StubTokenizer()(text)["offset_mapping"] for b in span}
+    for start, end, _ in spans:
+        assert start in token_bounds
+        assert end in token_bounds or text[end - 1] in SENTENCE_END_CHARS
+
+
+def test_token_mode_short_text_single_chunk(monkeypatch):
+    monkeypatch.setattr(retriever, "_get_tokenizer", lambda model_name: StubTokenizer())
+    text = "床前明月光 " + "abc" * 100
+    assert TextChunker.split_spans(text, chunk_size=10, unit="token") == [(0, len(text), text)]
+
+
+def test_unknown_unit_rejected():
+    with pytest.raises(ValueError):
+        TextChunker.split_spans("床前明月光。" * 100, unit="word")